@@ -0,0 +1,365 @@
+#!/bin/python3
+import heapq
+import logging
+import os
+import re
+from threading import Lock
+
+
+logger = logging.getLogger(__name__)
+
+# log_format main of the bundled nginx.conf
+ACCESS_LOG_FORMAT = (
+    '$remote_addr - $remote_user [$time_local] "$request" '
+    '$status $body_bytes_sent "$http_referer" '
+    '"$http_user_agent" "$http_x_forwarded_for" '
+    '$request_time "$upstream_addr" $upstream_response_time'
+)
+
+# upper bounds (seconds) of the latency histogram buckets, +Inf is implied
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# separators of the upstream lists: "a, b" (next upstream) and "a : b" (internal redirect)
+UPSTREAM_SEPARATOR = re.compile(r", | : ")
+
+LOG_VARIABLE = re.compile(r"\$(\w+)|\$\{(\w+)\}")
+
+
+def compile_log_format(log_format: str):
+    """Compile a nginx log_format into a regex with one named group per variable.
+
+    A variable matches everything up to the first character of the literal after it,
+    so quoted and bracketed fields may contain spaces, but never a line break.
+
+    Args:
+        log_format (str): log_format of nginx, e.g. ACCESS_LOG_FORMAT
+
+    Returns:
+        re.Pattern: compiled pattern, match(line).groupdict() gives the variables
+    """
+    pattern = []
+    names = set()
+    position = 0
+    matches = list(LOG_VARIABLE.finditer(log_format))
+    for i, match in enumerate(matches):
+        pattern.append(re.escape(log_format[position : match.start()]))
+        name = match.group(1) or match.group(2)
+        position = match.end()
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(log_format)
+        literal = log_format[position:end]
+        if literal:
+            field = f"[^{re.escape(literal[0])}\\n]*"
+        elif i + 1 < len(matches):
+            field = r"\S*?"  # adjacent variables, split lazily
+        else:
+            field = "[^\\n]*"
+        if name in names:
+            pattern.append(field)  # same variable again, not captured
+        else:
+            names.add(name)
+            pattern.append(f"(?P<{name}>{field})")
+    pattern.append(re.escape(log_format[position:]))
+    return re.compile("".join(pattern) + "$")
+
+
+class SpaceSaving:
+    def __init__(self, capacity: int = 1000):
+        """Approximate top-N counter in bounded memory (space-saving algorithm)
+
+        At most capacity keys are tracked, a new key replaces the least counted one
+        and inherits its count as the error bound. The least counted key is found
+        in a min-heap with one entry per key, an entry counted since it was pushed
+        is pushed again once it reaches the top, so an eviction is O(log capacity) amortized.
+
+        Args:
+            capacity (int, optional): max keys tracked. Defaults to 1000.
+        """
+        self.capacity = max(int(capacity), 1)
+        self.counters = {}  # key -> [count, error]
+        self.heap = []  # (count when pushed, key)
+
+    def add(self, key, value: int = 1):
+        """Count key, return the evicted key or None."""
+        counter = self.counters.get(key)
+        if counter is not None:
+            counter[0] += value
+            return None
+        evicted = None
+        count = 0
+        if len(self.counters) >= self.capacity:
+            while True:
+                pushed, evicted = self.heap[0]
+                count = self.counters[evicted][0]
+                if count == pushed:
+                    break
+                heapq.heapreplace(self.heap, (count, evicted))
+            heapq.heappop(self.heap)
+            del self.counters[evicted]
+        self.counters[key] = [count + value, count]
+        heapq.heappush(self.heap, (count + value, key))
+        return evicted
+
+    def top(self, n: int):
+        """[(key, count, error)] of the n most counted keys"""
+        items = sorted(self.counters.items(), key=lambda item: -item[1][0])[:n]
+        return [(key, count, error) for key, (count, error) in items]
+
+
+class LatencyHistogram:
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        """Latency histogram over fixed buckets, in seconds"""
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        i = 0
+        while i < len(self.buckets) and seconds > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def cumulative(self):
+        """[(upper bound, cumulative count)], the last bound is inf"""
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": [
+                ["+Inf" if bound == float("inf") else bound, count]
+                for bound, count in self.cumulative()
+            ],
+        }
+
+
+class AccessLogStats:
+    def __init__(self, top_n: int = 10, capacity: int = 1000, upstreams: int = 100):
+        """In-memory aggregates of access log entries, bounded by the capacities
+
+        Args:
+            top_n (int, optional): size of the top lists in snapshot. Defaults to 10.
+            capacity (int, optional): max paths and clients tracked. Defaults to 1000.
+            upstreams (int, optional): max upstreams with a latency histogram. Defaults to 100.
+        """
+        self.top_n = top_n
+        self.lock = Lock()
+        self.lines = 0
+        self.unparsed = 0
+        self.bytes_sent = 0
+        self.status = {}  # status code -> count
+        self.paths = SpaceSaving(capacity)
+        self.clients = SpaceSaving(capacity)
+        self.upstreams = SpaceSaving(upstreams)
+        self.upstream_latency = {}  # upstream address -> LatencyHistogram
+        self.request_latency = LatencyHistogram()
+
+    def add(self, fields: dict):
+        """Aggregate one parsed entry (variables of the log_format)."""
+        with self.lock:
+            self.lines += 1
+            status = fields.get("status")
+            if status is not None:
+                status = status if len(status) == 3 and status.isdigit() else "other"
+                self.status[status] = self.status.get(status, 0) + 1
+            body_bytes_sent = fields.get("body_bytes_sent", "")
+            if body_bytes_sent.isdigit():
+                self.bytes_sent += int(body_bytes_sent)
+            request = fields.get("request")
+            if request is not None:
+                parts = request.split(" ")
+                path = parts[1].split("?", 1)[0] if len(parts) == 3 else "-"
+                self.paths.add(path)
+            elif "uri" in fields:
+                self.paths.add(fields["uri"])
+            if "remote_addr" in fields:
+                self.clients.add(fields["remote_addr"])
+            request_time = fields.get("request_time")
+            if request_time:
+                try:
+                    self.request_latency.observe(float(request_time))
+                except ValueError:
+                    pass
+            self._add_upstreams(
+                fields.get("upstream_addr"), fields.get("upstream_response_time")
+            )
+
+    def _add_upstreams(self, addrs: str, times: str):
+        if not addrs or not times or addrs == "-":
+            return
+        for addr, seconds in zip(
+            UPSTREAM_SEPARATOR.split(addrs), UPSTREAM_SEPARATOR.split(times)
+        ):
+            if seconds == "-":
+                continue
+            try:
+                seconds = float(seconds)
+            except ValueError:
+                continue
+            evicted = self.upstreams.add(addr)
+            if evicted is not None:
+                self.upstream_latency.pop(evicted, None)
+            histogram = self.upstream_latency.get(addr)
+            if histogram is None:
+                histogram = self.upstream_latency[addr] = LatencyHistogram()
+            histogram.observe(seconds)
+
+    def snapshot(self):
+        """Aggregates as a json serializable dict."""
+        with self.lock:
+            return {
+                "lines": self.lines,
+                "unparsed": self.unparsed,
+                "bytes_sent": self.bytes_sent,
+                "status": dict(self.status),
+                "top_paths": self.paths.top(self.top_n),
+                "top_clients": self.clients.top(self.top_n),
+                "request_latency": self.request_latency.snapshot(),
+                "upstream_latency": {
+                    addr: self.upstream_latency[addr].snapshot()
+                    for addr, _, _ in self.upstreams.top(self.top_n)
+                    if addr in self.upstream_latency
+                },
+            }
+
+
+class AccessLogTailer:
+    def __init__(self, path: str, from_end: bool = True, max_line_size: int = 65536):
+        """Follow a log file across rotations
+
+        The file is reopened when the path points to a new inode (moved and
+        reopened by nginx -s reopen) or shrinks (truncated), the rest of the
+        old file is read before switching.
+
+        Args:
+            path (str): log file
+            from_end (bool, optional): skip the existing content if the file exists. Defaults to True.
+            max_line_size (int, optional): longer lines are dropped. Defaults to 65536.
+        """
+        self.path = path
+        self.from_end = from_end
+        self.max_line_size = max_line_size
+        self.file = None
+        self.inode = None
+        self.buffer = b""
+        # a file created later is read from the start
+        self._open(from_end)
+
+    def _open(self, from_end: bool):
+        try:
+            self.file = open(self.path, "rb")
+        except OSError:
+            return False
+        stat = os.fstat(self.file.fileno())
+        self.inode = (stat.st_dev, stat.st_ino)
+        if from_end:
+            self.file.seek(0, os.SEEK_END)
+        self.buffer = b""
+        return True
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _read(self, max_bytes: int):
+        lines = []
+        remaining = max_bytes
+        while remaining > 0:
+            data = self.file.read(min(remaining, 1 << 20))
+            if not data:
+                break
+            remaining -= len(data)
+            data = self.buffer + data
+            end = data.rfind(b"\n")
+            if end < 0:
+                self.buffer = data
+            else:
+                lines += data[:end].split(b"\n")
+                self.buffer = data[end + 1 :]
+            if len(self.buffer) > self.max_line_size:
+                logger.error(f"Drop line longer than {self.max_line_size} bytes")
+                self.buffer = b""
+        return lines, remaining > 0
+
+    def read_lines(self, max_bytes: int = 8 << 20):
+        """Read the complete lines appended since the last call.
+
+        Args:
+            max_bytes (int, optional): max bytes read per call. Defaults to 8MB.
+
+        Returns:
+            list: lines as str, without the line break
+        """
+        if self.file is None and not self._open(from_end=False):
+            return []
+        lines, drained = self._read(max_bytes)
+        if drained:
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                stat = None  # moved, not reopened by nginx yet
+            if stat is not None and (stat.st_dev, stat.st_ino) != self.inode:
+                logger.info(f"Log file rotated: {self.path}")
+                self.close()
+                if self._open(from_end=False):
+                    more, _ = self._read(max_bytes)
+                    lines += more
+            elif stat is not None and stat.st_size < self.file.tell():
+                logger.info(f"Log file truncated: {self.path}")
+                self.file.seek(0)
+                self.buffer = b""
+                more, _ = self._read(max_bytes)
+                lines += more
+        return [line.decode("utf-8", "replace") for line in lines]
+
+
+class AccessLogAnalyzer:
+    def __init__(
+        self,
+        path: str,
+        log_format: str = ACCESS_LOG_FORMAT,
+        top_n: int = 10,
+        capacity: int = 1000,
+        from_end: bool = True,
+    ):
+        """Tail an access log and aggregate the parsed entries
+
+        Args:
+            path (str): access log file
+            log_format (str, optional): log_format of the access log. Defaults to ACCESS_LOG_FORMAT.
+            top_n (int, optional): size of the top lists. Defaults to 10.
+            capacity (int, optional): max paths and clients tracked. Defaults to 1000.
+            from_end (bool, optional): skip the existing content. Defaults to True.
+        """
+        self.tailer = AccessLogTailer(path, from_end=from_end)
+        self.log_format = log_format
+        self.parser = compile_log_format(log_format)
+        self.stats = AccessLogStats(top_n=top_n, capacity=capacity)
+
+    def poll(self):
+        """Parse and aggregate the new lines, return the number of lines read."""
+        lines = self.tailer.read_lines()
+        match = self.parser.match
+        unparsed = 0
+        for line in lines:
+            result = match(line)
+            if result is None:
+                unparsed += 1
+                continue
+            self.stats.add(result.groupdict())
+        if unparsed:
+            with self.stats.lock:
+                self.stats.unparsed += unparsed
+        return len(lines)
+
+    def close(self):
+        self.tailer.close()
@@ -0,0 +1,585 @@
+#!/bin/python3
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import shutil
+import socket
+import sys
+import tempfile
+import time
+from http.client import HTTPConnection, HTTPException
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Event, Thread
+from urllib.request import urlopen
+from nginx import NginxUtils
+from monitor import MonitorDaemon
+from sync import ConfigSync
+from fakenacos import FakeNacosServer
+import config
+
+
+BASE_PATH = Path(__file__).resolve().parent
+PROJ_PATH = BASE_PATH.parent
+
+logger = logging.getLogger(__name__)
+
+BENCHMARKS = ("status", "sync", "publish", "reload", "restart")
+
+# nginx.conf of the scratch context, the synced bench_*.conf are included
+BENCH_NGINX_CONFIG = """worker_processes 1;
+pid logs/nginx.pid;
+error_log logs/error.log;
+events {{
+    worker_connections 1024;
+}}
+http {{
+    access_log off;
+    client_body_temp_path tmp/client_body;
+    proxy_temp_path tmp/proxy;
+    fastcgi_temp_path tmp/fastcgi;
+    uwsgi_temp_path tmp/uwsgi;
+    scgi_temp_path tmp/scgi;
+    include bench_*.conf;
+    server {{
+        listen 127.0.0.1:{port};
+        location /status {{
+            stub_status on;
+        }}
+        location /bench {{
+            return 200 "$bench_version";
+        }}
+    }}
+}}
+"""
+
+BENCH_VERSION_CONFIG = 'map $host $bench_version {{ default "{version}"; }}\n'
+
+STUB_STATUS = (
+    "Active connections: 1 \nserver accepts handled requests\n 1 1 1 \n"
+    "Reading: 0 Writing: 1 Waiting: 0 \n"
+)
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _get(url: str, timeout: float = 1):
+    """body of a GET, None if failed"""
+    try:
+        with urlopen(url, timeout=timeout) as response:
+            return response.read().decode("utf-8")
+    except (OSError, HTTPException):
+        return None
+
+
+def _wait_until(predicate, timeout: float, interval: float = 0.01):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(interval)
+    return True
+
+
+def summarize_samples(samples: list):
+    """{"count", "min", "avg", "p50", "p99", "max"} of durations in seconds"""
+    if not samples:
+        return {"count": 0}
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "min": samples[0],
+        "avg": sum(samples) / len(samples),
+        "p50": samples[int(0.5 * (len(samples) - 1))],
+        "p99": samples[int(0.99 * (len(samples) - 1))],
+        "max": samples[-1],
+    }
+
+
+class StubStatusHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        data = STUB_STATUS.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class BenchContext:
+    def __init__(self, nginx_runner_path: str):
+        """Scratch nginx context for a benchmark
+
+        A temp dir with conf/nginx.conf listening on a free port, the conf dir,
+        nginxdaemon.ini, the manifest and the snapshots of the config module
+        point into it while the context is entered.
+
+        Args:
+            nginx_runner_path (str): nginx runner path (bin file)
+        """
+        self.nginx_runner_path = nginx_runner_path
+        self.nginx_available = os.access(nginx_runner_path, os.X_OK)
+        self.path: Path = None
+        self.port = None
+        self.saved = {}
+
+    def __enter__(self):
+        self.path = Path(tempfile.mkdtemp(prefix="nginxdaemon-bench-"))
+        self.port = _free_port()
+        for name in ("conf", "logs", "tmp"):
+            (self.path / name).mkdir()
+        (self.path / "conf" / "nginx.conf").write_text(
+            BENCH_NGINX_CONFIG.format(port=self.port)
+        )
+        (self.path / "conf" / "bench_version.conf").write_text(
+            BENCH_VERSION_CONFIG.format(version=0)
+        )
+        (self.path / "conf" / "nacos_conf_version").write_text("0")
+        (self.path / "conf" / "nacos_conf_series").write_text("")
+        paths = {
+            "CONFIG_BASE_PATH": self.path / "conf",
+            "NGINX_CONFIG_FILE": self.path / "conf" / "nginx.conf",
+            "NGINX_DAEMON_CONFIG_FILE": self.path / "conf" / "nginxdaemon.ini",
+            "NGINX_DAEMON_MANIFEST_FILE": self.path / "tmp" / "manifest.json",
+            "NGINX_DAEMON_SNAPSHOT_PATH": self.path / "tmp" / "snapshot",
+        }
+        for name, path in paths.items():
+            self.saved[name] = getattr(config, name)
+            setattr(config, name, path)
+        return self
+
+    def __exit__(self, *args):
+        for name, path in self.saved.items():
+            setattr(config, name, path)
+        if self.nginx_available:
+            nginx = self.nginx()
+            pid = nginx.master_pid()
+            if pid is not None:
+                nginx.stop()
+                nginx.wait_stopped(pid)
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def url(self, path: str):
+        return f"http://127.0.0.1:{self.port}{path}"
+
+    def nginx(self, nginx_status_url: str = None):
+        return NginxUtils(
+            self.nginx_runner_path,
+            str(self.path),
+            nginx_status_url or self.url("/status"),
+        )
+
+    def seed(self, nacos: FakeNacosServer, configs: int, group: str = "bench"):
+        """publish the config series (version 1) with configs files to nacos
+
+        Returns:
+            list: names of the config files
+        """
+        names = [f"bench_{i}.conf" for i in range(configs)]
+        for name in names:
+            nacos.publish(name, group, f"# {name}\n")
+        nacos.publish(
+            "bench_version.conf", group, BENCH_VERSION_CONFIG.format(version=1)
+        )
+        nacos.publish(
+            "nacos_conf_series",
+            group,
+            "\n".join(
+                ["nacos_conf_series", "nacos_conf_version", "bench_version.conf"]
+                + names
+            ),
+        )
+        nacos.publish("nacos_conf_version", group, "1")
+        return names
+
+    def write_daemon_config(self, nacos_port: int, auto_reload: bool):
+        config.NGINX_DAEMON_CONFIG_FILE.write_text(
+            "[default]\n"
+            "check_alive_interval=1\n"
+            "check_config_interval=1\n"
+            f"nginx_status_url={self.url('/status')}\n"
+            "nacos_address=127.0.0.1\n"
+            f"nacos_port={nacos_port}\n"
+            "nacos_username=nacos\n"
+            "nacos_password=nacos\n"
+            "nacos_namespace=\n"
+            "nacos_group=bench\n"
+            "nacos_conf_series_data_id=nacos_conf_series\n"
+            "nacos_conf_version_data_id=nacos_conf_version\n"
+            f"nacos_auto_reload_nginx={str(auto_reload).lower()}\n"
+            "nacos_sync_mode=listen\n"
+            "nacos_sync_concurrency=4\n"
+        )
+
+    def daemon(self, loop: asyncio.AbstractEventLoop):
+        """monitor daemon of the scratch context, its command socket is in the context too"""
+        daemon = MonitorDaemon(
+            self.nginx_runner_path, str(self.path), self.url("/status"), loop=loop
+        )
+        daemon.command_socket = str(self.path / "logs" / "cmd.sock")
+        return daemon
+
+
+class LoadGenerator:
+    def __init__(self, url: str, concurrency: int = 4, timeout: float = 2):
+        """Closed-loop HTTP load, every thread sends a request after the previous response
+
+        Args:
+            url (str): http url
+            concurrency (int, optional): threads, each one keeps a connection alive. Defaults to 4.
+            timeout (float, optional): request timeout in seconds. Defaults to 2.
+        """
+        self.url = url
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.stopped = Event()
+        self.threads = []
+        self.successes = []  # per thread [(end time, latency)]
+        self.errors = []  # per thread error count
+        self.started = None
+        self.finished = None
+
+    def _run(self, i: int):
+        host, _, rest = self.url.split("//", 1)[1].partition("/")
+        hostname, _, port = host.partition(":")
+        conn = None
+        while not self.stopped.is_set():
+            start = time.perf_counter()
+            try:
+                if conn is None:
+                    conn = HTTPConnection(
+                        hostname, int(port or 80), timeout=self.timeout
+                    )
+                conn.request("GET", "/" + rest)
+                response = conn.getresponse()
+                response.read()
+                if response.will_close:
+                    conn.close()
+                    conn = None
+                if response.status != 200:
+                    raise HTTPException(f"status {response.status}")
+                end = time.perf_counter()
+                self.successes[i].append((end, end - start))
+            except (OSError, HTTPException):
+                self.errors[i] += 1
+                if conn is not None:
+                    conn.close()
+                    conn = None
+                time.sleep(0.001)
+        if conn is not None:
+            conn.close()
+
+    def start(self):
+        self.successes = [[] for _ in range(self.concurrency)]
+        self.errors = [0] * self.concurrency
+        self.started = time.perf_counter()
+        self.threads = [
+            Thread(target=self._run, args=(i,), daemon=True)
+            for i in range(self.concurrency)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join(self.timeout + 1)
+        self.finished = time.perf_counter()
+
+    def summary(self):
+        """requests, errors, the longest time without any successful response and the latencies"""
+        successes = sorted(item for items in self.successes for item in items)
+        # responses delimit the gaps, so do the start and the end of the load
+        times = [self.started] + [end for end, _ in successes] + [self.finished]
+        elapsed = self.finished - self.started
+        return {
+            "requests": len(successes),
+            "errors": sum(self.errors),
+            "requests_per_second": len(successes) / elapsed if elapsed > 0 else 0,
+            "max_gap_seconds": max(b - a for a, b in zip(times, times[1:])),
+            "latency": summarize_samples([latency for _, latency in successes]),
+        }
+
+
+def bench_status_probe(ctx: BenchContext, duration: float = 3):
+    """NginxUtils.status() probes per second, against a local stub_status if nginx is not available"""
+    stub = None
+    if ctx.nginx_available:
+        nginx = ctx.nginx()
+        if not (nginx.start() and nginx.wait_ready()):
+            return {"error": "nginx is not ready"}
+        target = "nginx"
+    else:
+        stub = ThreadingHTTPServer(("127.0.0.1", 0), StubStatusHandler)
+        stub.daemon_threads = True
+        Thread(target=stub.serve_forever, daemon=True).start()
+        nginx = ctx.nginx(f"http://127.0.0.1:{stub.server_address[1]}/status")
+        target = "stub"
+    try:
+        latencies = []
+        failures = 0
+        deadline = time.perf_counter() + duration
+        start = time.perf_counter()
+        while time.perf_counter() < deadline:
+            probe_start = time.perf_counter()
+            nginx.status()
+            latencies.append(time.perf_counter() - probe_start)
+            if not nginx.nginx_alive:
+                failures += 1
+        elapsed = time.perf_counter() - start
+        return {
+            "target": target,
+            "probes": len(latencies),
+            "failures": failures,
+            "probes_per_second": len(latencies) / elapsed,
+            "latency": summarize_samples(latencies),
+        }
+    finally:
+        nginx.status_poller.close()
+        if stub is not None:
+            stub.shutdown()
+            stub.server_close()
+
+
+def bench_sync_cycle(
+    ctx: BenchContext, configs: int = 1000, rounds: int = 5, latency: float = 0
+):
+    """config_status_monitor sync cycle time against a series of configs files
+
+    The cycles are a full download, an unchanged version and one file changed.
+    The staged configs are validated by nginx if available.
+    """
+    with FakeNacosServer(username="nacos", password="nacos", latency=latency) as nacos:
+        ctx.seed(nacos, configs)
+        ctx.write_daemon_config(nacos.port, auto_reload=False)
+        loop = asyncio.new_event_loop()
+        daemon = ctx.daemon(loop)
+        try:
+            if not ctx.nginx_available:
+                daemon.config_sync = ConfigSync(
+                    daemon.config_source, daemon.nacos_sync_concurrency
+                )
+            cycles = {"full": [], "unchanged": [], "one_changed": []}
+            requests = {name: 0 for name in cycles}
+
+            def cycle(name: str):
+                count = sum(nacos.requests.values())
+                start = time.perf_counter()
+                synced = daemon._sync_config()
+                cycles[name].append(time.perf_counter() - start)
+                requests[name] += sum(nacos.requests.values()) - count
+                if not synced:
+                    raise Exception(f"Sync config failed in the {name} cycle")
+
+            cycle("full")
+            for i in range(rounds):
+                cycle("unchanged")
+                nacos.publish(f"bench_{i % max(configs, 1)}.conf", "bench", f"# {i}\n")
+                nacos.publish("nacos_conf_version", "bench", str(i + 2))
+                cycle("one_changed")
+            return {
+                "configs": configs,
+                "validated": ctx.nginx_available,
+                **{
+                    name: dict(
+                        summarize_samples(samples),
+                        requests=requests[name] / len(samples),
+                    )
+                    for name, samples in cycles.items()
+                },
+            }
+        finally:
+            daemon.nacos.close()
+            loop.close()
+
+
+def bench_publish_to_serve(
+    ctx: BenchContext,
+    configs: int = 100,
+    rounds: int = 5,
+    latency: float = 0,
+    timeout: float = 30,
+):
+    """time from a nacos publish to nginx serving the new config, through the running daemon"""
+    if not ctx.nginx_available:
+        return {"skipped": "nginx is not available"}
+    with FakeNacosServer(username="nacos", password="nacos", latency=latency) as nacos:
+        ctx.seed(nacos, configs)
+        ctx.write_daemon_config(nacos.port, auto_reload=True)
+        daemon = ctx.daemon(asyncio.new_event_loop())
+        daemon.loop_thread = Thread(target=daemon._run_loop)
+        daemon.loop_thread.start()
+        try:
+            daemon.start()
+            if not daemon.nginx.wait_ready(timeout):
+                return {"error": "nginx is not ready"}
+            # the first sync downloads version 1
+            if not _wait_until(lambda: _get(ctx.url("/bench")) == "1", timeout):
+                return {"error": "initial sync timeout"}
+            samples = []
+            for i in range(rounds):
+                version = str(i + 2)
+                start = time.perf_counter()
+                nacos.publish(
+                    "bench_version.conf",
+                    "bench",
+                    BENCH_VERSION_CONFIG.format(version=version),
+                )
+                nacos.publish("nacos_conf_version", "bench", version)
+                if not _wait_until(
+                    lambda: _get(ctx.url("/bench")) == version, timeout, 0.005
+                ):
+                    return {"error": f"version {version} not served in {timeout}s"}
+                samples.append(time.perf_counter() - start)
+            return {"configs": configs, **summarize_samples(samples)}
+        finally:
+            daemon.quit()
+            daemon.loop_thread.join(10)
+
+
+def bench_downtime(
+    ctx: BenchContext, action: str = "reload", duration: float = 3, concurrency: int = 4
+):
+    """requests failed and the longest gap without response while nginx reloads or restarts under load"""
+    if not ctx.nginx_available:
+        return {"skipped": "nginx is not available"}
+    nginx = ctx.nginx()
+    if not (nginx.start() and nginx.wait_ready()):
+        return {"error": "nginx is not ready"}
+    load = LoadGenerator(ctx.url("/bench"), concurrency)
+    load.start()
+    try:
+        time.sleep(duration / 3)
+        start = time.perf_counter()
+        success = nginx.reload() if action == "reload" else nginx.restart()
+        action_seconds = time.perf_counter() - start
+        time.sleep(duration * 2 / 3)
+    finally:
+        load.stop()
+        nginx.status_poller.close()
+    return {"success": success, "action_seconds": action_seconds, **load.summary()}
+
+
+def run_benchmarks(
+    benchmarks: list,
+    nginx_runner_path: str = str(PROJ_PATH / "nginx" / "nginx"),
+    configs: int = 1000,
+    rounds: int = 5,
+    duration: float = 3,
+    latency: float = 0,
+    concurrency: int = 4,
+):
+    """Run the benchmarks, each one in its own scratch context.
+
+    Args:
+        benchmarks (list): names in BENCHMARKS
+        nginx_runner_path (str, optional): nginx runner path, benchmarks needing nginx are skipped if not executable. Defaults to the bundled nginx.
+        configs (int, optional): config files in the series. Defaults to 1000.
+        rounds (int, optional): measured syncs and publishes. Defaults to 5.
+        duration (float, optional): seconds of the probe and load benchmarks. Defaults to 3.
+        latency (float, optional): seconds added to every request of the fake nacos. Defaults to 0.
+        concurrency (int, optional): threads of the load generator. Defaults to 4.
+
+    Returns:
+        dict: json serializable results, {"timestamp", "python", "nginx", "params", "results"}
+    """
+    results = {}
+    nginx_version = None
+    for name in benchmarks:
+        logger.info(f"Running benchmark {name}...")
+        try:
+            with BenchContext(nginx_runner_path) as ctx:
+                if ctx.nginx_available and nginx_version is None:
+                    nginx_version = ctx.nginx().version()[1]
+                if name == "status":
+                    results[name] = bench_status_probe(ctx, duration)
+                elif name == "sync":
+                    results[name] = bench_sync_cycle(ctx, configs, rounds, latency)
+                elif name == "publish":
+                    results[name] = bench_publish_to_serve(
+                        ctx, configs, rounds, latency
+                    )
+                elif name in ("reload", "restart"):
+                    results[name] = bench_downtime(ctx, name, duration, concurrency)
+                else:
+                    results[name] = {"error": f"Unknown benchmark {name}"}
+        except Exception as e:
+            logger.error(f"Benchmark {name} error: {e}")
+            results[name] = {"error": str(e)}
+        logger.info(f"Benchmark {name}: {results[name]}")
+    return {
+        "timestamp": int(time.time()),
+        "python": platform.python_version(),
+        "nginx": nginx_version,
+        "params": {
+            "configs": configs,
+            "rounds": rounds,
+            "duration": duration,
+            "latency": latency,
+            "concurrency": concurrency,
+        },
+        "results": results,
+    }
+
+
+def _command_parser():
+    parser = argparse.ArgumentParser(
+        "bench", description="Benchmarks of the daemon hot paths, results in json"
+    )
+    parser.add_argument(
+        "benchmarks",
+        nargs="*",
+        help=f"benchmarks to run ({', '.join(BENCHMARKS)}), all by default",
+    )
+    parser.add_argument(
+        "--nginx", default=str(PROJ_PATH / "nginx" / "nginx"), help="nginx binary"
+    )
+    parser.add_argument("-n", dest="configs", type=int, default=1000)
+    parser.add_argument("-r", dest="rounds", type=int, default=5)
+    parser.add_argument("-d", dest="duration", type=float, default=3)
+    parser.add_argument(
+        "--latency", type=float, default=0, help="seconds per fake nacos request"
+    )
+    parser.add_argument("-c", dest="concurrency", type=int, default=4)
+    parser.add_argument("-o", dest="output", help="json file, stdout by default")
+    return parser
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="[%(asctime)s - %(levelname)s]: %(message)s"
+    )
+    parser = _command_parser()
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(
+                f"unknown benchmark {name}, choose from {', '.join(BENCHMARKS)}"
+            )
+    result = run_benchmarks(
+        args.benchmarks or list(BENCHMARKS),
+        args.nginx,
+        args.configs,
+        args.rounds,
+        args.duration,
+        args.latency,
+        args.concurrency,
+    )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    else:
+        print(json.dumps(result, indent=2))
+    sys.exit(1 if any("error" in value for value in result["results"].values()) else 0)
@@ -2,7 +2,14 @@
 import logging
 from pathlib import Path
 import configparser
+import hashlib
+import json
 import os
+import shutil
+import time
+from collections.abc import Mapping
+from threading import Lock
+from types import MappingProxyType
 
 BASE_PATH = Path(__file__).resolve().parent
 PROJ_PATH = Path(__file__).resolve().parent.parent
@@ -12,33 +19,159 @@ logger = logging.getLogger(__name__)
 CONFIG_BASE_PATH = PROJ_PATH / "conf"
 NGINX_CONFIG_FILE = CONFIG_BASE_PATH / "nginx.conf"
 NGINX_DAEMON_CONFIG_FILE = CONFIG_BASE_PATH / "nginxdaemon.ini"
+NGINX_DAEMON_MANIFEST_FILE = BASE_PATH / "tmp" / "manifest.json"
+NGINX_DAEMON_SNAPSHOT_PATH = BASE_PATH / "tmp" / "snapshot"
 
+# changes of the conf dir within this time of a scan may share its mtime
+CONFIG_INDEX_RACY_NS = 1_000_000_000
 
-def nginx_daemon_config_get():
-    try:
-        config = configparser.ConfigParser()
-        config.read(NGINX_DAEMON_CONFIG_FILE, encoding="utf-8")
-        if "default" not in config.sections():
-            msg = "default section not found in nginxdaemon.ini"
-            logger.error(msg)
-            return False, msg
+
+# typed fields of nginxdaemon.ini, the other fields are str, an empty value is None
+NGINX_DAEMON_CONFIG_TYPES = {
+    "check_alive_interval": int,
+    "check_config_interval": int,
+    "check_access_log_interval": float,
+    "check_upstream_interval": float,
+    "daemon_threads": int,
+    "restart_failure_threshold": int,
+    "restart_probe_interval": float,
+    "restart_backoff_max": float,
+    "restart_crash_loop_limit": int,
+    "restart_crash_loop_window": float,
+    "reload_debounce": float,
+    "reload_max_delay": float,
+    "reload_min_interval": float,
+    "reload_max_old_workers": int,
+    "reload_drain_timeout": float,
+    "access_log_top_n": int,
+    "nacos_port": int,
+    "nacos_pool_size": int,
+    "nacos_timeout": float,
+    "nacos_retries": int,
+    "nacos_sync_concurrency": int,
+    "nacos_register_port": int,
+    "nacos_register_weight": float,
+    "nacos_auto_reload_nginx": bool,
+}
+
+# fields masked in logs
+NGINX_DAEMON_CONFIG_SECRETS = ("password", "secret", "token")
+
+# (path, st_dev, st_ino, st_mtime_ns, st_size) of nginxdaemon.ini -> parsed config
+_daemon_config_cache = {"key": None, "raw": None, "config": None}
+_daemon_config_lock = Lock()
+
+
+def _daemon_config_read():
+    config = configparser.ConfigParser()
+    config.read(NGINX_DAEMON_CONFIG_FILE, encoding="utf-8")
+    if "default" not in config.sections():
+        return None
+    cfg_dict = dict(config["default"])
+    if "override" in config.sections():
+        cfg_dict.update(dict(config["override"]))
+    return cfg_dict
+
+
+def _daemon_config_typed(cfg_dict: dict):
+    typed = {}
+    for key, value in cfg_dict.items():
+        value_type = NGINX_DAEMON_CONFIG_TYPES.get(key, str)
+        if value_type is str:
+            typed[key] = value
+        elif value.strip() == "":
+            typed[key] = None
+        elif value_type is bool:
+            if value.lower() not in configparser.ConfigParser.BOOLEAN_STATES:
+                raise ValueError(f"{key} is not a boolean: {value}")
+            typed[key] = configparser.ConfigParser.BOOLEAN_STATES[value.lower()]
         else:
-            cfg_dict = dict(config["default"])
-            if "override" in config.sections():
-                cfg_dict.update(dict(config["override"]))
-            return True, cfg_dict
+            try:
+                typed[key] = value_type(value)
+            except ValueError:
+                raise ValueError(f"{key} is not a {value_type.__name__}: {value}")
+    return MappingProxyType(typed)
+
+
+def nginx_daemon_config_load():
+    """get the typed config of nginxdaemon.ini, parsed again only if the file changed
+
+    The file is identified by its inode, mtime and size, the same snapshot
+    object is returned as long as it is unchanged.
+
+    Returns:
+        success, data: True and the read-only config (str fields unless typed in NGINX_DAEMON_CONFIG_TYPES) or False and msg
+    """
+    try:
+        with _daemon_config_lock:
+            try:
+                stat = os.stat(NGINX_DAEMON_CONFIG_FILE)
+                key = (
+                    str(NGINX_DAEMON_CONFIG_FILE),
+                    stat.st_dev,
+                    stat.st_ino,
+                    stat.st_mtime_ns,
+                    stat.st_size,
+                )
+            except OSError:
+                key = None
+            if key is not None and key == _daemon_config_cache["key"]:
+                return True, _daemon_config_cache["config"]
+            cfg_dict = _daemon_config_read()
+            if cfg_dict is None:
+                msg = "default section not found in nginxdaemon.ini"
+                logger.error(msg)
+                return False, msg
+            cfg = _daemon_config_typed(cfg_dict)
+            _daemon_config_cache.update(key=key, raw=cfg_dict, config=cfg)
+            return True, cfg
     except Exception as e:
         msg = f"Error getting nginx daemon config: {e}"
         logger.error(msg)
         return False, msg
 
 
+def nginx_daemon_config_get():
+    """get the config of nginxdaemon.ini as a new dict of str fields
+
+    Returns:
+        success, data: True and dict or False and msg
+    """
+    success, data = nginx_daemon_config_load()
+    if not success:
+        return False, data
+    with _daemon_config_lock:
+        return True, dict(_daemon_config_cache["raw"])
+
+
+def nginx_daemon_config_changes(previous, current):
+    """keys added, removed or changed from the previous config to the current one"""
+    return sorted(
+        key
+        for key in previous.keys() | current.keys()
+        if key not in previous or key not in current or previous[key] != current[key]
+    )
+
+
+def nginx_daemon_config_mask(cfg):
+    """copy of a config for logging, the secrets are masked"""
+    return {
+        key: (
+            "******"
+            if value and any(word in key for word in NGINX_DAEMON_CONFIG_SECRETS)
+            else value
+        )
+        for key, value in cfg.items()
+    }
+
+
 def nginx_daemon_config_set(cfg: str | dict):
     try:
         # str
         if type(cfg) == str:
             with open(NGINX_DAEMON_CONFIG_FILE, "w", encoding="utf-8") as f:
                 f.write(cfg)
+            _daemon_config_cache["key"] = None
             return True, None
         # dict
         config = configparser.ConfigParser()
@@ -46,6 +179,7 @@ def nginx_daemon_config_set(cfg: str | dict):
         config["override"] = cfg
         with open(NGINX_DAEMON_CONFIG_FILE, "w", encoding="utf-8") as f:
             config.write(f)
+        _daemon_config_cache["key"] = None
         return True, None
     except Exception as e:
         msg = f"Error setting nginx daemon config: {e}"
@@ -90,40 +224,303 @@ def nginx_config_set_custom(cfg_filename: str, cfg: str):
         return False, msg
 
 
+class NginxConfigIndex:
+    def __init__(self, path: str | Path):
+        """Index of the regular files in a conf dir, filename -> os.stat_result
+
+        The dir is only rescanned when its mtime changed, i.e. a file was created,
+        removed or renamed (written by nginx_config_apply_custom) in it. The
+        contents are never cached, they are read on access.
+
+        Args:
+            path (str | Path): conf dir
+        """
+        self.path = Path(path)
+        self.lock = Lock()
+        self.entries = {}
+        self.dir_key = None  # (st_ino, st_mtime_ns) of the dir at the last scan
+        self.scans = 0
+
+    def refresh(self):
+        """rescan the dir if it changed since the last scan, return the entries"""
+        stat = os.stat(self.path)
+        key = (stat.st_ino, stat.st_mtime_ns)
+        with self.lock:
+            if key == self.dir_key:
+                return self.entries
+            entries = {}
+            with os.scandir(self.path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_file():
+                            entries[entry.name] = entry.stat()
+                    except OSError:
+                        pass  # removed while scanning
+            self.entries = entries
+            self.scans += 1
+            # a change within the same mtime tick would not be seen, rescan next time
+            racy = time.time_ns() - stat.st_mtime_ns < CONFIG_INDEX_RACY_NS
+            self.dir_key = None if racy else key
+            return entries
+
+    def stat(self, cfg_filename: str):
+        """os.stat_result of a config file at the last scan, None if not found"""
+        return self.refresh().get(cfg_filename)
+
+    def read(self, cfg_filename: str):
+        """content of a config file, FileNotFoundError if not indexed"""
+        if self.stat(cfg_filename) is None:
+            raise FileNotFoundError(cfg_filename)
+        with open(self.path / cfg_filename, "r", encoding="utf-8") as f:
+            return f.read()
+
+
+class NginxConfigFiles(Mapping):
+    def __init__(self, index: NginxConfigIndex):
+        """Read-only mapping filename -> content of a conf dir, the contents are read on access"""
+        self.index = index
+        self.names = sorted(index.refresh())
+
+    def __getitem__(self, cfg_filename: str):
+        if cfg_filename not in self.names:
+            raise KeyError(cfg_filename)
+        try:
+            return self.index.read(cfg_filename)
+        except FileNotFoundError:
+            raise KeyError(cfg_filename)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __repr__(self):
+        return f"NginxConfigFiles({self.names})"
+
+
+# conf dir -> NginxConfigIndex
+_config_indexes = {}
+
+
+def nginx_config_index():
+    """index of CONFIG_BASE_PATH"""
+    index = _config_indexes.get(CONFIG_BASE_PATH)
+    if index is None:
+        index = _config_indexes[CONFIG_BASE_PATH] = NginxConfigIndex(CONFIG_BASE_PATH)
+    return index
+
+
 def nginx_config_get_custom(cfg_filename: str = None):
     """get custom config file
 
+    Files are looked up in the index of the conf dir, and read only when needed.
+
     Args:
         cfg_filename (str, optional): config filename. Defaults to None.
 
     Returns:
-        (dict[filename,content] | str): return dict if cfg_filename is None, otherwise return str (config content)
+        (Mapping[filename,content] | str): return NginxConfigFiles (contents read on access) if cfg_filename is None, otherwise return str (config content)
+    """
+    try:
+        index = nginx_config_index()
+        if cfg_filename is None:
+            return True, NginxConfigFiles(index)
+        filepath = (CONFIG_BASE_PATH / cfg_filename).parent
+        if cfg_filename.count("/") > 0 or not filepath.is_relative_to(
+            CONFIG_BASE_PATH
+        ):
+            msg = "Invalid path"
+            logger.error(msg)
+            return False, msg
+        try:
+            # only allow same level files, not allow subdirectories
+            return True, index.read(cfg_filename)
+        except FileNotFoundError:
+            msg = "Config file not found"
+            logger.error(msg)
+            return False, msg
+    except Exception as e:
+        msg = f"Error setting custom config: {e}"
+        logger.error(msg)
+        return False, msg
+
+
+def nginx_config_manifest_get():
+    """get the manifest of configs synced with nacos
+
+    Returns:
+        (dict): manifest[source address][tenant][group][data_id] = {"md5": str, "timestamp": int, "rejected": md5 of the content rolled back if any}, empty if never synced
     """
     try:
-        if cfg_filename is not None:
-            filepath = (CONFIG_BASE_PATH / cfg_filename).parent
-            if cfg_filename.count("/") > 0 or not filepath.is_relative_to(
-                CONFIG_BASE_PATH
-            ):
-                msg = "Invalid path"
+        if not os.path.isfile(NGINX_DAEMON_MANIFEST_FILE):
+            return True, {}
+        with open(NGINX_DAEMON_MANIFEST_FILE, "r", encoding="utf-8") as f:
+            return True, json.load(f)
+    except Exception as e:
+        msg = f"Error getting config manifest: {e}"
+        logger.error(msg)
+        return False, msg
+
+
+def nginx_config_manifest_set(manifest: dict):
+    try:
+        os.makedirs(NGINX_DAEMON_MANIFEST_FILE.parent, exist_ok=True)
+        tmp_file = NGINX_DAEMON_MANIFEST_FILE.with_suffix(".tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_file, NGINX_DAEMON_MANIFEST_FILE)
+        return True, None
+    except Exception as e:
+        msg = f"Error setting config manifest: {e}"
+        logger.error(msg)
+        return False, msg
+
+
+def _config_generation_path(generation: str):
+    """path of a config generation beside the conf dir, e.g. conf.staging, conf.previous"""
+    base_path = CONFIG_BASE_PATH.resolve()
+    return base_path.parent / f"{base_path.name}.{generation}"
+
+
+def _config_check_filename(cfg_filename: str):
+    filepath = CONFIG_BASE_PATH / cfg_filename
+    return cfg_filename.count("/") == 0 and filepath.is_relative_to(CONFIG_BASE_PATH)
+
+
+def nginx_config_apply_custom(cfgs: dict, validate=None):
+    """apply several custom config files all or nothing
+
+    The whole conf dir with cfgs overlaid is staged in conf.staging and validated,
+    then the changed files are swapped in by atomic renames.
+    The replaced files are kept in conf.previous for nginx_config_rollback_custom,
+    one generation for all the applies until nginx_config_commit_custom,
+    i.e. the files and the manifest as they were before the first of them.
+
+    Args:
+        cfgs (dict[filename,content]): config files to apply
+        validate (callable, optional): validate(staged nginx.conf path) -> bool, nothing is applied if it returns False. Defaults to None.
+
+    Returns:
+        success, msg: True and None or False and msg
+    """
+    staging_path = _config_generation_path("staging")
+    previous_path = _config_generation_path("previous")
+    try:
+        for cfg_filename in cfgs:
+            if not _config_check_filename(cfg_filename):
+                msg = f"Invalid path: {cfg_filename}"
                 logger.error(msg)
                 return False, msg
-        cfg_dict = {}
+        # stage the whole conf dir, unchanged files are hard linked
+        shutil.rmtree(staging_path, ignore_errors=True)
+        os.makedirs(staging_path)
         for cfg_file in os.listdir(CONFIG_BASE_PATH):
-            # only allow same level files, not allow subdirectories
             filepath = CONFIG_BASE_PATH / cfg_file
-            if cfg_filename is not None and cfg_filename == cfg_file:
-                if os.path.isfile(filepath):
-                    with open(filepath, "r", encoding="utf-8") as f:
-                        return True, f.read()
-                msg = "Config file not found"
-                logger.error(msg)
-                return False, msg
-            elif os.path.isfile(filepath):
-                with open(filepath, "r", encoding="utf-8") as f:
-                    cfg_dict[cfg_file] = f.read()
-        return True, cfg_dict
+            if cfg_file in cfgs or not os.path.isfile(filepath):
+                continue
+            try:
+                os.link(filepath, staging_path / cfg_file)
+            except OSError:
+                shutil.copy2(filepath, staging_path / cfg_file)
+        for cfg_filename, cfg in cfgs.items():
+            with open(staging_path / cfg_filename, "w", encoding="utf-8") as f:
+                f.write(cfg)
+        if validate is not None and not validate(
+            str(staging_path / NGINX_CONFIG_FILE.name)
+        ):
+            msg = "Staged config validation failed"
+            logger.error(msg)
+            return False, msg
+        # keep the previous generation, then swap in
+        if os.path.isfile(previous_path / ".created"):
+            with open(previous_path / ".created", "r", encoding="utf-8") as f:
+                created = json.load(f)
+        else:
+            shutil.rmtree(previous_path, ignore_errors=True)
+            os.makedirs(previous_path)
+            created = []
+            success, manifest = nginx_config_manifest_get()
+            with open(previous_path / ".manifest", "w", encoding="utf-8") as f:
+                json.dump(manifest if success else {}, f)
+        for cfg_filename in cfgs:
+            filepath = CONFIG_BASE_PATH / cfg_filename
+            # the version before the first apply is kept
+            if cfg_filename in created or os.path.exists(previous_path / cfg_filename):
+                continue
+            if os.path.isfile(filepath):
+                os.link(filepath, previous_path / cfg_filename)
+            else:
+                created.append(cfg_filename)
+        with open(previous_path / ".created", "w", encoding="utf-8") as f:
+            json.dump(created, f)
+        for cfg_filename in cfgs:
+            os.replace(staging_path / cfg_filename, CONFIG_BASE_PATH / cfg_filename)
+        shutil.rmtree(staging_path, ignore_errors=True)
+        return True, None
     except Exception as e:
-        msg = f"Error setting custom config: {e}"
+        msg = f"Error applying custom config: {e}"
+        logger.error(msg)
+        return False, msg
+
+
+def nginx_config_rollback_custom():
+    """restore the custom config files and the manifest as they were before the applies since the last commit
+
+    The manifest entries of the restored configs are marked with the md5 of the rejected
+    content, so they are not downloaded again until the config changes on the source.
+
+    Returns:
+        success, msg: True and None or False and msg
+    """
+    previous_path = _config_generation_path("previous")
+    try:
+        if not os.path.isfile(previous_path / ".created"):
+            msg = "No previous config generation"
+            logger.error(msg)
+            return False, msg
+        with open(previous_path / ".created", "r", encoding="utf-8") as f:
+            created = json.load(f)
+        with open(previous_path / ".manifest", "r", encoding="utf-8") as f:
+            previous_manifest = json.load(f)
+        restored = [
+            cfg_file for cfg_file in os.listdir(previous_path) if cfg_file[0] != "."
+        ]
+        rejected = {}
+        for cfg_file in restored + created:
+            filepath = CONFIG_BASE_PATH / cfg_file
+            if os.path.isfile(filepath):
+                with open(filepath, "rb") as f:
+                    rejected[cfg_file] = hashlib.md5(f.read()).hexdigest()
+        for cfg_file in restored:
+            os.replace(previous_path / cfg_file, CONFIG_BASE_PATH / cfg_file)
+        for cfg_file in created:
+            if os.path.isfile(CONFIG_BASE_PATH / cfg_file):
+                os.remove(CONFIG_BASE_PATH / cfg_file)
+        success, manifest = nginx_config_manifest_get()
+        if success:
+            for address, tenants in manifest.items():
+                for tenant, groups in tenants.items():
+                    for group, entries in groups.items():
+                        previous = (
+                            previous_manifest.get(address, {})
+                            .get(tenant, {})
+                            .get(group, {})
+                        )
+                        for cfg_file, md5 in rejected.items():
+                            if entries.get(cfg_file, {}).get("md5") == md5:
+                                entries[cfg_file] = dict(
+                                    previous.get(cfg_file, {}), rejected=md5
+                                )
+            nginx_config_manifest_set(manifest)
+        shutil.rmtree(previous_path, ignore_errors=True)
+        return True, None
+    except Exception as e:
+        msg = f"Error rolling back custom config: {e}"
         logger.error(msg)
         return False, msg
+
+
+def nginx_config_commit_custom():
+    """drop the previous generation once nginx runs the applied custom configs"""
+    shutil.rmtree(_config_generation_path("previous"), ignore_errors=True)
@@ -0,0 +1,43 @@
+#!/bin/python3
+import json
+import socket
+import sys
+from pathlib import Path
+
+
+BASE_PATH = Path(__file__).resolve().parent
+COMMAND_SOCKET = BASE_PATH / "logs" / "cmd.sock"
+
+
+def send_command(command: str, socket_path: str = COMMAND_SOCKET, timeout: float = 60):
+    """send a command to the running monitor daemon and wait for its acknowledgement
+
+    Args:
+        command (str): command line, e.g. "-n reload", "-m status"
+        socket_path (str, optional): command socket of the daemon. Defaults to logs/cmd.sock.
+        timeout (float, optional): timeout in seconds. Defaults to 60.
+
+    Returns:
+        success, data: True and result of the command or False and msg
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(str(socket_path))
+            sock.sendall(f"{command}\n".encode("utf-8"))
+            response = b""
+            while not response.endswith(b"\n"):
+                data = sock.recv(4096)
+                if not data:
+                    break
+                response += data
+        response = json.loads(response.decode("utf-8"))
+        return response["success"], response["result"]
+    except Exception as e:
+        return False, f"Error sending command: {e}"
+
+
+if __name__ == "__main__":
+    success, result = send_command(" ".join(sys.argv[1:]))
+    print(json.dumps(result, indent=2) if not isinstance(result, str) else result)
+    sys.exit(0 if success else 1)
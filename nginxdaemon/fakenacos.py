@@ -0,0 +1,402 @@
+#!/bin/python3
+import argparse
+import hashlib
+import json
+import logging
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Condition, Thread
+from urllib.parse import parse_qs, quote, urlsplit
+
+
+logger = logging.getLogger(__name__)
+
+FAKE_NACOS_PREFIX = "/nacos/v1/"
+
+
+def _md5(content: str):
+    return hashlib.md5(content.encode("utf-8")).hexdigest()
+
+
+class FakeNacosHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, nagle would delay the body
+    disable_nagle_algorithm = True
+
+    def _reply(self, body, code: int = 200):
+        if not isinstance(body, str):
+            body = json.dumps(body)
+        data = body.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _params(self):
+        # the client sends query params, the nacos sdks send forms
+        query = urlsplit(self.path).query
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            query += "&" + self.rfile.read(length).decode("utf-8")
+        return {k: v[0] for k, v in parse_qs(query, keep_blank_values=True).items()}
+
+    def _handle(self, method: str):
+        nacos: FakeNacosServer = self.server.nacos
+        uri = urlsplit(self.path).path
+        if not uri.startswith(FAKE_NACOS_PREFIX):
+            self._reply("not found", 404)
+            return
+        uri = uri[len(FAKE_NACOS_PREFIX) :]
+        params = self._params()
+        nacos.count(method, uri)
+        if nacos.latency:
+            time.sleep(nacos.latency)
+        if uri != "auth/login" and not nacos.authorized(params.get("accessToken")):
+            self._reply("token invalid!", 403)
+            return
+        handler = nacos.routes.get((method, uri))
+        if handler is None:
+            self._reply("not found", 404)
+            return
+        try:
+            code, body = handler(params, self.headers)
+        except (KeyError, ValueError) as e:
+            code, body = 400, f"bad request: {e}"
+        self._reply(body, code)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeNacosServer:
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        username: str = None,
+        password: str = None,
+        latency: float = 0,
+        token_ttl: int = 18000,
+    ):
+        """In-process nacos server with the v1 open api used by NacosClient
+
+        Configs (get, publish, delete, long pulling listener), auth and
+        instances (register, deregister, modify, list, beat, health) are kept
+        in memory, for tests and load tests without a nacos server.
+        Every request is delayed by latency and counted in requests.
+
+        Args:
+            host (str, optional): listen address. Defaults to "127.0.0.1".
+            port (int, optional): listen port, 0 for a free port. Defaults to 0.
+            username (str, optional): login username, None to disable the auth. Defaults to None.
+            password (str, optional): login password. Defaults to None.
+            latency (float, optional): seconds added to every request. Defaults to 0.
+            token_ttl (int, optional): seconds an access token is valid. Defaults to 18000.
+        """
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.token_ttl = token_ttl
+        self.tokens = {}  # access token -> expiry (monotonic)
+        self.configs = {}  # (data_id, group, tenant) -> content
+        self.instances = {}  # (namespace, group, service) -> {(ip, port): instance}
+        self.requests = {}  # (method, uri) -> count
+        self.condition = Condition()  # notified when a config changed
+        self.routes = {
+            ("POST", "auth/login"): self._login,
+            ("GET", "cs/configs"): self._config_get,
+            ("POST", "cs/configs"): self._config_publish,
+            ("DELETE", "cs/configs"): self._config_delete,
+            ("POST", "cs/configs/listener"): self._config_listen,
+            ("POST", "ns/instance"): self._instance_register,
+            ("DELETE", "ns/instance"): self._instance_deregister,
+            ("PUT", "ns/instance"): self._instance_modify,
+            ("GET", "ns/instance"): self._instance_get,
+            ("GET", "ns/instance/list"): self._instance_list,
+            ("PUT", "ns/instance/beat"): self._instance_beat,
+            ("PUT", "ns/health/instance"): self._instance_health,
+        }
+        self.server = ThreadingHTTPServer((host, port), FakeNacosHandler)
+        self.server.daemon_threads = True
+        self.server.nacos = self
+        self.thread: Thread = None
+        self.stopped = False
+
+    @property
+    def address(self):
+        return self.server.server_address[0]
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        with self.condition:
+            # release the long pulling requests
+            self.stopped = True
+            self.condition.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def count(self, method: str, uri: str):
+        with self.condition:
+            key = (method, uri)
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def authorized(self, access_token: str):
+        if self.username is None:
+            return True
+        with self.condition:
+            expiry = self.tokens.get(access_token)
+            return expiry is not None and expiry > time.monotonic()
+
+    def revoke_tokens(self):
+        """expire every access token, the clients have to login again"""
+        with self.condition:
+            self.tokens.clear()
+
+    def publish(self, data_id: str, group: str, content: str, tenant: str = None):
+        """set a config and wake up the listeners"""
+        with self.condition:
+            self.configs[(data_id, group, tenant or "")] = content
+            self.condition.notify_all()
+
+    def delete(self, data_id: str, group: str, tenant: str = None):
+        with self.condition:
+            self.configs.pop((data_id, group, tenant or ""), None)
+            self.condition.notify_all()
+
+    def _login(self, params: dict, headers):
+        if self.username is not None and (
+            params.get("username") != self.username
+            or params.get("password") != self.password
+        ):
+            return 403, "unknown user!"
+        access_token = uuid.uuid4().hex
+        with self.condition:
+            self.tokens[access_token] = time.monotonic() + self.token_ttl
+        return 200, {
+            "accessToken": access_token,
+            "tokenTtl": self.token_ttl,
+            "globalAdmin": True,
+        }
+
+    def _config_get(self, params: dict, headers):
+        with self.condition:
+            content = self.configs.get(
+                (params["dataId"], params["group"], params.get("tenant") or "")
+            )
+        if content is None:
+            return 404, "config data not exist"
+        return 200, content
+
+    def _config_publish(self, params: dict, headers):
+        self.publish(
+            params["dataId"], params["group"], params["content"], params.get("tenant")
+        )
+        return 200, "true"
+
+    def _config_delete(self, params: dict, headers):
+        self.delete(params["dataId"], params["group"], params.get("tenant"))
+        return 200, "true"
+
+    def _changed(self, listening: list):
+        changed = ""
+        for data_id, group, md5, tenant in listening:
+            content = self.configs.get((data_id, group, tenant))
+            if ("" if content is None else _md5(content)) != md5:
+                fields = [data_id, group] + ([tenant] if tenant else [])
+                changed += chr(2).join(fields) + chr(1)
+        return changed
+
+    def _config_listen(self, params: dict, headers):
+        listening = []
+        for item in params["Listening-Configs"].split(chr(1)):
+            if item == "":
+                continue
+            fields = item.split(chr(2))
+            data_id, group, md5 = fields[:3]
+            listening.append(
+                (data_id, group, md5, fields[3] if len(fields) > 3 else "")
+            )
+        timeout = int(headers.get("Long-Pulling-Timeout") or 30000) / 1000
+        no_hangup = headers.get("Long-Pulling-No-Hangup") == "true"
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            changed = self._changed(listening)
+            while not changed and not no_hangup and not self.stopped:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.condition.wait(remaining):
+                    break
+                changed = self._changed(listening)
+        return 200, quote(changed, safe="")
+
+    def _service(self, params: dict):
+        service_name = params["serviceName"]
+        group_name = params.get("groupName") or "DEFAULT_GROUP"
+        if "@@" in service_name:
+            group_name, service_name = service_name.split("@@", 1)
+        return (params.get("namespaceId") or "public", group_name, service_name)
+
+    def _instance_set(self, params: dict, instance: dict = None):
+        namespace, group_name, service_name = self._service(params)
+        ip, port = params["ip"], int(params["port"])
+        cluster_name = params.get("clusterName") or "DEFAULT"
+        metadata = params.get("metadata")
+        instance = dict(
+            instance or {},
+            instanceId=f"{ip}#{port}#{cluster_name}#{group_name}@@{service_name}",
+            ip=ip,
+            port=port,
+            clusterName=cluster_name,
+            serviceName=f"{group_name}@@{service_name}",
+        )
+        for key in ("weight",):
+            if params.get(key) is not None:
+                instance[key] = float(params[key])
+        for key in ("enabled", "healthy", "ephemeral"):
+            if params.get(key) is not None:
+                instance[key] = params[key] == "true"
+        if metadata:
+            instance["metadata"] = (
+                json.loads(metadata) if isinstance(metadata, str) else metadata
+            )
+        instance.setdefault("weight", 1.0)
+        instance.setdefault("enabled", True)
+        instance.setdefault("healthy", True)
+        instance.setdefault("ephemeral", True)
+        instance.setdefault("metadata", {})
+        with self.condition:
+            self.instances.setdefault((namespace, group_name, service_name), {})[
+                (ip, port)
+            ] = instance
+        return instance
+
+    def _instance_find(self, params: dict):
+        with self.condition:
+            return self.instances.get(self._service(params), {}).get(
+                (params["ip"], int(params["port"]))
+            )
+
+    def _instance_register(self, params: dict, headers):
+        self._instance_set(params)
+        return 200, "ok"
+
+    def _instance_deregister(self, params: dict, headers):
+        with self.condition:
+            self.instances.get(self._service(params), {}).pop(
+                (params["ip"], int(params["port"])), None
+            )
+        return 200, "ok"
+
+    def _instance_modify(self, params: dict, headers):
+        instance = self._instance_find(params)
+        if instance is None:
+            return 400, "instance not exist"
+        self._instance_set(params, instance)
+        return 200, "ok"
+
+    def _instance_get(self, params: dict, headers):
+        instance = self._instance_find(params)
+        if instance is None:
+            return 404, "no ips found"
+        return 200, dict(instance, service=instance["serviceName"])
+
+    def _instance_list(self, params: dict, headers):
+        namespace, group_name, service_name = self._service(params)
+        healthy_only = params.get("healthyOnly") == "true"
+        with self.condition:
+            hosts = [
+                dict(instance)
+                for instance in self.instances.get(
+                    (namespace, group_name, service_name), {}
+                ).values()
+                if instance["enabled"] and (instance["healthy"] or not healthy_only)
+            ]
+        return 200, {
+            "name": f"{group_name}@@{service_name}",
+            "groupName": group_name,
+            "clusters": params.get("clusters") or "",
+            "cacheMillis": 10000,
+            "hosts": hosts,
+        }
+
+    def _instance_beat(self, params: dict, headers):
+        instance = self._instance_find(params)
+        if instance is None:
+            beat = params.get("beat")
+            if not beat:
+                # a light beat of a forgotten instance
+                return 200, {"code": 20404, "clientBeatInterval": 5000}
+            beat = json.loads(beat)
+            self._instance_set(
+                dict(
+                    params,
+                    weight=beat.get("weight"),
+                    metadata=beat.get("metadata"),
+                    clusterName=beat.get("cluster"),
+                )
+            )
+        return 200, {
+            "code": 10200,
+            "clientBeatInterval": 5000,
+            "lightBeatEnabled": True,
+        }
+
+    def _instance_health(self, params: dict, headers):
+        instance = self._instance_find(params)
+        if instance is None:
+            return 400, "instance not exist"
+        self._instance_set(
+            {k: v for k, v in params.items() if k != "enabled"}, instance
+        )
+        return 200, "ok"
+
+
+def _command_parser():
+    parser = argparse.ArgumentParser(
+        "fakenacos", description="In-process nacos server for tests and load tests"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18848)
+    parser.add_argument("--username", default=None)
+    parser.add_argument("--password", default=None)
+    parser.add_argument("--latency", type=float, default=0, help="seconds per request")
+    return parser
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = _command_parser().parse_args()
+    server = FakeNacosServer(
+        args.host, args.port, args.username, args.password, args.latency
+    )
+    logger.info(f"Fake nacos listening on {server.address}:{server.port}")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
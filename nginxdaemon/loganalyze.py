@@ -0,0 +1,391 @@
+#!/bin/python3
+import argparse
+import gzip
+import json
+import logging
+import mmap
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from accesslog import ACCESS_LOG_FORMAT, LATENCY_BUCKETS, compile_log_format
+
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 32 << 20  # bytes of a log file parsed by one task
+
+MONTHS = {
+    month: f"{i + 1:02d}"
+    for i, month in enumerate("Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec".split())
+}
+
+UPSTREAM_SEPARATOR = re.compile(rb", | : ")
+
+# 2026/10/17 10:00:00 [error] 1234#0: *1 ...
+ERROR_LOG_LINE = re.compile(rb"^(\d{4})/(\d\d)/(\d\d) (\d\d:\d\d):\d\d \[(\w+)\]", re.M)
+
+
+def access_log_minute(time_local: bytes):
+    """17/Oct/2026:10:00:00 +0800 -> 2026-10-17 10:00 (the local time of the log, the offset is ignored)"""
+    day, month, rest = time_local.split(b"/", 2)
+    return f"{rest[:4].decode()}-{MONTHS.get(month.decode(), '00')}-{day.decode()} {rest[5:10].decode()}"
+
+
+def new_access_minute():
+    return {
+        "requests": 0,
+        "bytes": 0,
+        "status": {},
+        "latency": [0] * (len(LATENCY_BUCKETS) + 1),
+        "latency_sum": 0.0,
+        "latency_max": 0.0,
+        "upstream_latency_max": 0.0,
+    }
+
+
+def merge_minutes(target: dict, source: dict):
+    """add the per-minute aggregates of source into target"""
+    for minute, aggregate in source.items():
+        current = target.get(minute)
+        if current is None:
+            target[minute] = aggregate
+            continue
+        for key, value in aggregate.items():
+            if isinstance(value, dict):
+                for k, v in value.items():
+                    current[key][k] = current[key].get(k, 0) + v
+            elif isinstance(value, list):
+                current[key] = [a + b for a, b in zip(current[key], value)]
+            elif key.endswith("_max"):
+                current[key] = max(current[key], value)
+            else:
+                current[key] += value
+    return target
+
+
+def _latency(seconds: bytes):
+    """request_time or the sum of an upstream_response_time list, None if absent"""
+    total = None
+    for value in UPSTREAM_SEPARATOR.split(seconds):
+        try:
+            total = (total or 0.0) + float(value)
+        except ValueError:
+            pass
+    return total
+
+
+def _analyze_access(data, start: int, end: int, pattern, since: str, until: str):
+    # required by analyze_logs, the missing optional fields are read from group 0 and ignored
+    time_local = pattern.groupindex["time_local"]
+    status, body_bytes_sent, request_time, upstream_response_time = (
+        pattern.groupindex.get(name, 0)
+        for name in (
+            "status",
+            "body_bytes_sent",
+            "request_time",
+            "upstream_response_time",
+        )
+    )
+    minutes = {}
+    # the same raw values repeat a lot, they are parsed once
+    minute_keys = {}  # time_local prefix -> minute
+    latencies = {}  # request_time -> (seconds, bucket index)
+    upstream_latencies = {}  # upstream_response_time -> seconds
+    buckets = LATENCY_BUCKETS
+    matched = 0
+    for match in pattern.finditer(data, start, end):
+        matched += 1
+        values = match.group(
+            time_local, status, body_bytes_sent, request_time, upstream_response_time
+        )
+        prefix = values[0][:17]
+        minute = minute_keys.get(prefix)
+        if minute is None:
+            minute = minute_keys[prefix] = access_log_minute(prefix)
+        if (since and minute < since) or (until and minute >= until):
+            continue
+        aggregate = minutes.get(minute)
+        if aggregate is None:
+            aggregate = minutes[minute] = new_access_minute()
+        aggregate["requests"] += 1
+        if status:
+            counts = aggregate["status"]
+            counts[values[1]] = counts.get(values[1], 0) + 1
+        if body_bytes_sent and values[2].isdigit():
+            aggregate["bytes"] += int(values[2])
+        if request_time:
+            latency = latencies.get(values[3])
+            if latency is None:
+                seconds = _latency(values[3])
+                i = 0
+                while seconds is not None and i < len(buckets) and seconds > buckets[i]:
+                    i += 1
+                latency = latencies[values[3]] = (seconds, i)
+            seconds, i = latency
+            if seconds is not None:
+                aggregate["latency"][i] += 1
+                aggregate["latency_sum"] += seconds
+                if seconds > aggregate["latency_max"]:
+                    aggregate["latency_max"] = seconds
+        if upstream_response_time:
+            seconds = upstream_latencies.get(values[4], False)
+            if seconds is False:
+                seconds = upstream_latencies[values[4]] = _latency(values[4])
+            if seconds is not None and seconds > aggregate["upstream_latency_max"]:
+                aggregate["upstream_latency_max"] = seconds
+    for aggregate in minutes.values():
+        aggregate["status"] = {
+            code.decode(): count for code, count in aggregate["status"].items()
+        }
+    return minutes, matched
+
+
+def _analyze_error(data, start: int, end: int, since: str, until: str):
+    minutes = {}
+    matched = 0
+    for match in ERROR_LOG_LINE.finditer(data, start, end):
+        year, month, day, hour_minute, level = match.groups()
+        matched += 1
+        minute = (
+            f"{year.decode()}-{month.decode()}-{day.decode()} {hour_minute.decode()}"
+        )
+        if (since and minute < since) or (until and minute >= until):
+            continue
+        aggregate = minutes.get(minute)
+        if aggregate is None:
+            aggregate = minutes[minute] = {"lines": 0, "levels": {}}
+        level = level.decode()
+        aggregate["lines"] += 1
+        aggregate["levels"][level] = aggregate["levels"].get(level, 0) + 1
+    return minutes, matched
+
+
+def analyze_chunk(
+    path: str,
+    start: int,
+    end: int,
+    kind: str,
+    log_format: str,
+    since: str = None,
+    until: str = None,
+    chunk_size: int = CHUNK_SIZE,
+):
+    """Aggregate the lines in [start, end) of a log file per minute (run in a worker process).
+
+    Args:
+        path (str): log file, gzip files are streamed as a whole
+        start (int): offset of the first line
+        end (int): offset after the last line, -1 for the end of the file
+        kind (str): access or error
+        log_format (str): log_format of the access log
+        since (str, optional): first minute (YYYY-MM-DD HH:MM) included. Defaults to None.
+        until (str, optional): first minute excluded. Defaults to None.
+        chunk_size (int, optional): bytes decompressed at once from gzip files. Defaults to CHUNK_SIZE.
+
+    Returns:
+        minutes, lines, matched: per-minute aggregates, lines scanned and lines parsed
+    """
+    # anchored, a malformed line is not searched for a record at every offset
+    pattern = re.compile(b"^" + compile_log_format(log_format).pattern.encode(), re.M)
+
+    def analyze(data, start, end):
+        if kind == "error":
+            minutes, matched = _analyze_error(data, start, end, since, until)
+        else:
+            minutes, matched = _analyze_access(data, start, end, pattern, since, until)
+        return minutes, data[start:end].count(b"\n"), matched
+
+    if path.endswith(".gz"):
+        minutes, lines, matched = {}, 0, 0
+        with gzip.open(path, "rb") as f:
+            rest = b""
+            while True:
+                block = f.read(chunk_size)
+                data = rest + block
+                # the partial last line is parsed with the next block
+                end = data.rfind(b"\n") + 1 if block else len(data)
+                result, block_lines, block_matched = analyze(data, 0, end)
+                merge_minutes(minutes, result)
+                lines += block_lines
+                matched += block_matched
+                rest = data[end:]
+                if not block:
+                    return minutes, lines, matched
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return {}, 0, 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return analyze(data, start, len(data) if end < 0 else end)
+
+
+def split_chunks(path: str, chunk_size: int = CHUNK_SIZE):
+    """[(start, end)] offsets of a log file split at line breaks, a gzip file is one chunk"""
+    if path.endswith(".gz"):
+        return [(0, -1)]
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size <= chunk_size:
+            return [(0, size)]
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            chunks = []
+            start = 0
+            while start < size:
+                end = data.find(b"\n", min(start + chunk_size, size - 1))
+                end = size if end < 0 else end + 1
+                chunks.append((start, end))
+                start = end
+            return chunks
+
+
+def summarize(minutes: dict, kind: str):
+    """sorted per-minute aggregates, the latency histograms are replaced by p50/p99/avg"""
+    result = []
+    for minute in sorted(minutes):
+        aggregate = dict(minutes[minute], minute=minute)
+        if kind == "access":
+            histogram = aggregate.pop("latency")
+            count = sum(histogram)
+            aggregate["latency_avg"] = (
+                aggregate.pop("latency_sum") / count if count else 0.0
+            )
+            for name, q in (("latency_p50", 0.5), ("latency_p99", 0.99)):
+                aggregate[name] = _histogram_quantile(
+                    histogram, q, aggregate["latency_max"]
+                )
+        result.append(aggregate)
+    return result
+
+
+def _histogram_quantile(histogram: list, q: float, maximum: float):
+    """upper bound of the bucket holding the quantile, maximum for the overflow bucket"""
+    count = sum(histogram)
+    if count == 0:
+        return 0.0
+    rank = q * count
+    total = 0
+    for bound, value in zip(LATENCY_BUCKETS, histogram):
+        total += value
+        if total >= rank:
+            return min(bound, maximum)
+    return maximum
+
+
+def analyze_logs(
+    paths: list,
+    kind: str = "access",
+    log_format: str = ACCESS_LOG_FORMAT,
+    since: str = None,
+    until: str = None,
+    workers: int = None,
+    chunk_size: int = CHUNK_SIZE,
+):
+    """Aggregate access or error logs per minute with a process pool.
+
+    The files are memory mapped and split into chunks at line breaks,
+    every chunk is parsed by a worker process and the results are merged.
+    A gzip file can not be split, it is streamed by one worker in blocks.
+
+    Args:
+        paths (list): log files, rotated .gz files are supported
+        kind (str, optional): access or error. Defaults to "access".
+        log_format (str, optional): log_format of the access log. Defaults to ACCESS_LOG_FORMAT.
+        since (str, optional): first minute (YYYY-MM-DD HH:MM) included. Defaults to None.
+        until (str, optional): first minute excluded. Defaults to None.
+        workers (int, optional): worker processes. Defaults to the cpu count.
+        chunk_size (int, optional): bytes per task, or per block of a gzip file. Defaults to CHUNK_SIZE.
+
+    Returns:
+        success, data: True and {"lines", "matched", "minutes": [per-minute aggregate]} or False and msg
+    """
+    if (
+        kind == "access"
+        and "time_local" not in compile_log_format(log_format).groupindex
+    ):
+        msg = "Error analyzing logs: log_format has no $time_local to group the lines by minute"
+        logger.error(msg)
+        return False, msg
+    try:
+        tasks = [
+            (path, start, end)
+            for path in paths
+            for start, end in split_chunks(path, chunk_size)
+        ]
+        minutes, lines, matched = {}, 0, 0
+        if len(tasks) == 1 or workers == 1:
+            results = (
+                analyze_chunk(
+                    path, start, end, kind, log_format, since, until, chunk_size
+                )
+                for path, start, end in tasks
+            )
+            for result, chunk_lines, chunk_matched in results:
+                merge_minutes(minutes, result)
+                lines += chunk_lines
+                matched += chunk_matched
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(
+                        analyze_chunk,
+                        path,
+                        start,
+                        end,
+                        kind,
+                        log_format,
+                        since,
+                        until,
+                        chunk_size,
+                    )
+                    for path, start, end in tasks
+                ]
+                for future in futures:
+                    result, chunk_lines, chunk_matched = future.result()
+                    merge_minutes(minutes, result)
+                    lines += chunk_lines
+                    matched += chunk_matched
+        return True, {
+            "lines": lines,
+            "matched": matched,
+            "minutes": summarize(minutes, kind),
+        }
+    except Exception as e:
+        msg = f"Error analyzing logs: {e}"
+        logger.error(msg)
+        return False, msg
+
+
+def _command_parser():
+    parser = argparse.ArgumentParser(
+        "analyze", description="Per-minute aggregates of nginx access or error logs"
+    )
+    parser.add_argument("paths", nargs="+", help="log files, .gz is supported")
+    parser.add_argument(
+        "-t",
+        dest="kind",
+        choices=["access", "error"],
+        default=None,
+        help="log type, defaults to error if the file name contains error",
+    )
+    parser.add_argument("-f", dest="log_format", default=ACCESS_LOG_FORMAT)
+    parser.add_argument("--since", help="first minute included, YYYY-MM-DD HH:MM")
+    parser.add_argument("--until", help="first minute excluded, YYYY-MM-DD HH:MM")
+    parser.add_argument("-w", dest="workers", type=int, default=None)
+    return parser
+
+
+if __name__ == "__main__":
+    args = _command_parser().parse_args()
+    kind = args.kind or (
+        "error" if "error" in os.path.basename(args.paths[0]) else "access"
+    )
+    success, result = analyze_logs(
+        args.paths,
+        kind,
+        args.log_format,
+        args.since,
+        args.until,
+        args.workers,
+    )
+    print(json.dumps(result, indent=2) if not isinstance(result, str) else result)
+    sys.exit(0 if success else 1)
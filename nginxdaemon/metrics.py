@@ -0,0 +1,319 @@
+#!/bin/python3
+import asyncio
+import logging
+import time
+from threading import Lock
+from nginx import NginxStatusSeries, STATUS_SERIES_WINDOWS
+from accesslog import AccessLogStats
+
+
+logger = logging.getLogger(__name__)
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# stub_status fields of nginx_status: (metric name, type, help)
+NGINX_STATUS_METRICS = {
+    "active_connections": (
+        "nginx_connections_active",
+        "gauge",
+        "Active client connections",
+    ),
+    "server_accepts": (
+        "nginx_connections_accepted",
+        "counter",
+        "Accepted client connections",
+    ),
+    "server_handled": (
+        "nginx_connections_handled",
+        "counter",
+        "Handled client connections",
+    ),
+    "server_requests": ("nginx_http_requests", "counter", "Client requests"),
+    "reading": (
+        "nginx_connections_reading",
+        "gauge",
+        "Connections where nginx is reading the request header",
+    ),
+    "writing": (
+        "nginx_connections_writing",
+        "gauge",
+        "Connections where nginx is writing the response",
+    ),
+    "waiting": (
+        "nginx_connections_waiting",
+        "gauge",
+        "Idle client connections waiting for a request",
+    ),
+}
+
+DAEMON_COUNTERS = {
+    "nginx_restarts": "Restarts of nginx by the daemon",
+    "nginx_reloads": "Reloads of nginx by the daemon",
+    "nginx_reload_failures": "Failed reloads of nginx",
+    "nginx_reload_requests": "Reloads of nginx requested, merged into fewer reloads",
+    "nacos_syncs": "Config syncs with nacos",
+    "nacos_sync_failures": "Failed config syncs with nacos",
+}
+
+DAEMON_DURATIONS = {
+    "nginx_reload_duration_seconds": "Duration of nginx reloads",
+    "nacos_sync_duration_seconds": "Duration of config syncs with nacos",
+}
+
+
+class DaemonMetrics:
+    def __init__(self, prefix: str = "nginxdaemon"):
+        """Metrics of nginx and the monitor daemon, rendered in OpenMetrics text format
+
+        Args:
+            prefix (str, optional): prefix of the daemon metrics. Defaults to "nginxdaemon".
+        """
+        self.prefix = prefix
+        self.status_series: NginxStatusSeries = None  # windowed rates if set
+        self.access_log_stats: AccessLogStats = None  # access log aggregates if set
+        self.lock = Lock()
+        self.nginx_status = {}
+        self.nginx_status_timestamp = 0
+        self.rates = {"requests": 0.0, "accepts": 0.0}
+        self.counters = {name: 0 for name in DAEMON_COUNTERS}
+        # name -> [count, sum, last]
+        self.durations = {name: [0, 0.0, 0.0] for name in DAEMON_DURATIONS}
+
+    def observe_status(self, nginx_status: dict, timestamp: float = None):
+        """Record a nginx_status sample, the rates are derived from the previous sample."""
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.lock:
+            previous, previous_timestamp = (
+                self.nginx_status,
+                self.nginx_status_timestamp,
+            )
+            self.nginx_status = dict(nginx_status)
+            self.nginx_status_timestamp = timestamp
+            elapsed = timestamp - previous_timestamp
+            for rate, field in (
+                ("requests", "server_requests"),
+                ("accepts", "server_accepts"),
+            ):
+                current, last = nginx_status.get(field, -1), previous.get(field, -1)
+                if current < 0 or last < 0 or elapsed <= 0:
+                    self.rates[rate] = 0.0
+                else:
+                    # counters restart from zero with nginx
+                    delta = current - last if current >= last else current
+                    self.rates[rate] = delta / elapsed
+
+    def inc(self, name: str, value: int = 1):
+        with self.lock:
+            self.counters[name] += value
+
+    def observe(self, name: str, seconds: float):
+        with self.lock:
+            duration = self.durations[name]
+            duration[0] += 1
+            duration[1] += seconds
+            duration[2] = seconds
+
+    def render(self):
+        """Render the metrics in OpenMetrics text format."""
+        with self.lock:
+            status = self.nginx_status
+            lines = [
+                "# TYPE nginx_up gauge",
+                "# HELP nginx_up Whether nginx stub_status is reachable",
+                f"nginx_up {1 if status.get('alive') else 0}",
+            ]
+            for field, (name, metric_type, help) in NGINX_STATUS_METRICS.items():
+                value = status.get(field, -1)
+                lines += [f"# TYPE {name} {metric_type}", f"# HELP {name} {help}"]
+                if value >= 0:
+                    suffix = "_total" if metric_type == "counter" else ""
+                    lines.append(f"{name}{suffix} {value}")
+            accepts, handled = status.get("server_accepts", -1), status.get(
+                "server_handled", -1
+            )
+            lines += [
+                "# TYPE nginx_connections_dropped gauge",
+                "# HELP nginx_connections_dropped Accepted but not handled connections",
+                f"nginx_connections_dropped {max(accepts - handled, 0)}",
+                "# TYPE nginx_http_requests_per_second gauge",
+                "# HELP nginx_http_requests_per_second Request rate between the last two probes",
+                f"nginx_http_requests_per_second {self.rates['requests']:.6f}",
+                "# TYPE nginx_connections_accepted_per_second gauge",
+                "# HELP nginx_connections_accepted_per_second Accept rate between the last two probes",
+                f"nginx_connections_accepted_per_second {self.rates['accepts']:.6f}",
+                "# TYPE nginx_status_probe_latency_seconds gauge",
+                "# HELP nginx_status_probe_latency_seconds Latency of the last stub_status probe",
+                f"nginx_status_probe_latency_seconds {status.get('latency', -1):.6f}",
+            ]
+            if self.status_series is not None:
+                lines += self._render_status_series()
+            if self.access_log_stats is not None:
+                lines += self._render_access_log()
+            for name, help in DAEMON_COUNTERS.items():
+                metric = f"{self.prefix}_{name}"
+                lines += [
+                    f"# TYPE {metric} counter",
+                    f"# HELP {metric} {help}",
+                    f"{metric}_total {self.counters[name]}",
+                ]
+            for name, help in DAEMON_DURATIONS.items():
+                metric = f"{self.prefix}_{name}"
+                count, total, last = self.durations[name]
+                lines += [
+                    f"# TYPE {metric} summary",
+                    f"# HELP {metric} {help}",
+                    f"{metric}_count {count}",
+                    f"{metric}_sum {total:.6f}",
+                    f"# TYPE {metric}_last gauge",
+                    f"{metric}_last {last:.6f}",
+                ]
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def _render_status_series(self):
+        """windowed rates and percentiles of the status series"""
+        summary = self.status_series.summary()
+        lines = []
+        for name, field, help in (
+            (
+                "nginx_http_requests_rate",
+                "requests_per_second",
+                "Request rate over the window",
+            ),
+            (
+                "nginx_connections_accepted_rate",
+                "accepts_per_second",
+                "Accept rate over the window",
+            ),
+            (
+                "nginx_connections_dropped_window",
+                "dropped",
+                "Accepted but not handled connections over the window",
+            ),
+        ):
+            lines += [f"# TYPE {name} gauge", f"# HELP {name} {help}"]
+            for window in STATUS_SERIES_WINDOWS:
+                lines.append(
+                    f'{name}{{window="{window}"}} {summary[window][field]:.6f}'
+                )
+        for name, field, help in (
+            (
+                "nginx_http_requests_rate_quantile",
+                "requests_per_second",
+                "Quantiles of the request rate between probes over the window",
+            ),
+            (
+                "nginx_status_probe_latency_quantile_seconds",
+                "latency",
+                "Quantiles of the stub_status probe latency over the window",
+            ),
+        ):
+            lines += [f"# TYPE {name} gauge", f"# HELP {name} {help}"]
+            for window in STATUS_SERIES_WINDOWS:
+                for quantile in ("p50", "p99"):
+                    key = f"{field}_{quantile}"
+                    lines.append(
+                        f'{name}{{window="{window}",quantile="0.{quantile[1:]}"}} '
+                        f"{summary[window][key]:.6f}"
+                    )
+        return lines
+
+    @staticmethod
+    def _render_histogram(name: str, histogram: dict, labels: str = ""):
+        lines = []
+        for bound, count in histogram["buckets"]:
+            lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {count}')
+        labels = f"{{{labels[:-1]}}}" if labels else ""
+        lines += [
+            f"{name}_count{labels} {histogram['count']}",
+            f"{name}_sum{labels} {histogram['sum']:.6f}",
+        ]
+        return lines
+
+    def _render_access_log(self):
+        """status counts and latency histograms of the access log"""
+        snapshot = self.access_log_stats.snapshot()
+        lines = [
+            "# TYPE nginx_access_log_lines counter",
+            "# HELP nginx_access_log_lines Access log lines read",
+            f"nginx_access_log_lines_total {snapshot['lines'] + snapshot['unparsed']}",
+            "# TYPE nginx_access_log_unparsed_lines counter",
+            "# HELP nginx_access_log_unparsed_lines Access log lines not matching the log_format",
+            f"nginx_access_log_unparsed_lines_total {snapshot['unparsed']}",
+            "# TYPE nginx_access_sent_bytes counter",
+            "# HELP nginx_access_sent_bytes Response body bytes sent",
+            f"nginx_access_sent_bytes_total {snapshot['bytes_sent']}",
+            "# TYPE nginx_access_responses counter",
+            "# HELP nginx_access_responses Responses by status code",
+        ]
+        for status, count in sorted(snapshot["status"].items()):
+            lines.append(f'nginx_access_responses_total{{status="{status}"}} {count}')
+        name = "nginx_access_request_duration_seconds"
+        lines += [
+            f"# TYPE {name} histogram",
+            f"# HELP {name} Request processing time",
+        ]
+        lines += self._render_histogram(name, snapshot["request_latency"])
+        name = "nginx_access_upstream_response_duration_seconds"
+        lines += [
+            f"# TYPE {name} histogram",
+            f"# HELP {name} Upstream response time of the most used upstreams",
+        ]
+        for upstream, histogram in snapshot["upstream_latency"].items():
+            upstream = upstream.replace("\\", "\\\\").replace('"', '\\"')
+            lines += self._render_histogram(name, histogram, f'upstream="{upstream}",')
+        return lines
+
+    async def handle_client(self, reader, writer):
+        """Minimal HTTP/1.1 handler serving GET /metrics, the connection is kept alive as HTTP/1.x asks."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                parts = request_line.decode("latin-1").split()
+                # HTTP/1.0 closes the connection unless keep-alive is asked
+                keep_alive = len(parts) >= 3 and parts[2] == "HTTP/1.1"
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+                    header = header.lower()
+                    if header.startswith(b"connection:"):
+                        if b"close" in header:
+                            keep_alive = False
+                        elif b"keep-alive" in header:
+                            keep_alive = True
+                if (
+                    len(parts) >= 2
+                    and parts[0] == "GET"
+                    and parts[1].split("?")[0] == "/metrics"
+                ):
+                    status, content_type, body = (
+                        "200 OK",
+                        OPENMETRICS_CONTENT_TYPE,
+                        self.render(),
+                    )
+                else:
+                    status, content_type, body = (
+                        "404 Not Found",
+                        "text/plain",
+                        "Not Found\n",
+                    )
+                data = body.encode("utf-8")
+                writer.write(
+                    (
+                        f"HTTP/1.1 {status}\r\n"
+                        f"Content-Type: {content_type}\r\n"
+                        f"Content-Length: {len(data)}\r\n"
+                        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+                    ).encode("latin-1")
+                    + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
@@ -1,13 +1,22 @@
 #!/bin/python3
-import time
+import asyncio
 import logging
+import json
 import os
-from threading import Thread
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Lock
 from pathlib import Path
 import signal
 import argparse
-from nginx import NginxUtils
-from nacos import NacosClient
+from nginx import NginxUtils, NginxRestartPolicy, NginxReloadScheduler
+from nacos import NacosClient, NacosConfigListener
+from sync import ConfigSync
+from source import ConfigSource, FileConfigSource, NacosConfigSource
+from metrics import DaemonMetrics
+from accesslog import AccessLogAnalyzer, ACCESS_LOG_FORMAT
+from registry import NacosRegistry, local_ip
+from upstream import UpstreamGenerator
 import config
 
 
@@ -15,6 +24,37 @@ BASE_PATH = Path(__file__).resolve().parent
 
 logger = logging.getLogger(__name__)
 
+# keys of nginxdaemon.ini hot updated by recreating the nacos client, the registry or the upstream generator
+NACOS_CLIENT_KEYS = frozenset(
+    (
+        "nacos_address",
+        "nacos_port",
+        "nacos_username",
+        "nacos_password",
+        "nacos_pool_size",
+        "nacos_timeout",
+        "nacos_retries",
+    )
+)
+NACOS_REGISTRY_KEYS = frozenset(
+    (
+        "nacos_register_service",
+        "nacos_register_ip",
+        "nacos_register_port",
+        "nacos_register_cluster",
+        "nacos_register_weight",
+        "nacos_group",
+        "nacos_namespace",
+    )
+)
+NACOS_UPSTREAM_KEYS = frozenset(
+    ("nacos_upstream_services", "nacos_group", "nacos_namespace")
+)
+CONFIG_SOURCE_KEYS = frozenset(("config_source_path",))
+NACOS_HOT_UPDATE_KEYS = (
+    NACOS_CLIENT_KEYS | NACOS_REGISTRY_KEYS | NACOS_UPSTREAM_KEYS | CONFIG_SOURCE_KEYS
+)
+
 
 class MonitorDaemon:
     def __init__(
@@ -22,20 +62,39 @@ class MonitorDaemon:
         nginx_runner_path: str,
         nginx_context_path: str,
         nginx_status_url: str = "http://127.0.0.1/status",
+        loop: asyncio.AbstractEventLoop = None,
     ):
         """Monitor daemon for nginx
 
+        The monitors run as tasks of an asyncio event loop, blocking calls run in a bounded thread pool.
+
         Args:
             nginx_runner_path (str): nginx runner path (bin file)
             nginx_context_path (str): nginx context path (conf dir, equal to nginx -p $nginx_context_path)
             nginx_status_url (_type_, optional): the access path for stub_status of nginx. Defaults to "http://127.0.0.1/status".
+            loop (asyncio.AbstractEventLoop, optional): event loop run by the caller, shared by several daemons. Defaults to None, the daemon runs its own loop in a thread.
         """
         self.daemon = False
         self.running = False
-        self.command_file = f"{BASE_PATH}/logs/cmd"
+        self.command_socket = f"{BASE_PATH}/logs/cmd.sock"
+        self.command_queue: asyncio.Queue = None
+        self.metrics = DaemonMetrics()
+        self.metrics_listen = ""
+        self.metrics_error = None  # bind error of the metrics exporter
         self.check_alive_interval = 5
-        self.check_command_interval = 1
         self.check_config_interval = 30
+        self.check_access_log_interval = 1
+        self.restart_probe_interval = 1  # probe interval while nginx is failing
+        self.restart_policy = NginxRestartPolicy()
+        self.reload_scheduler = NginxReloadScheduler()
+        self.reload_lock = Lock()  # the scheduler is requested from threads
+        self.reload_event: asyncio.Event = None  # set on a reload request
+        self.reload_waiters = []  # futures of the reload commands
+        self.reload_rollback = False  # a pending request applied custom configs
+        self.access_log_path = ""  # relative to nginx_context_path
+        self.access_log_format = ACCESS_LOG_FORMAT
+        self.access_log_top_n = 10
+        self.access_log: AccessLogAnalyzer = None
         self.nginx_runner_path = nginx_runner_path  # fixed value from function
         self.nginx_context_path = nginx_context_path  # fixed value from function
         self.nginx_status_url = nginx_status_url
@@ -44,60 +103,371 @@ class MonitorDaemon:
         self.nacos_port = None
         self.nacos_username = None
         self.nacos_password = None
+        self.nacos_pool_size = 10
+        self.nacos_timeout = 10
+        self.nacos_retries = 3
+        self.nacos_sync_concurrency = 4
         self.nacos: NacosClient = None
         self.config_dict = {}
-        self.nginx_status_monitoring_thread: Thread = None
-        self.command_input_monitoring_thread: Thread = None
-        self.config_status_monitoring_thread: Thread = None
+        self.config_source: ConfigSource = None
+        self.config_series = None  # (listener, series key, config names) watched
+        self.config_sync: ConfigSync = None
+        self.booted = False
+        self.registry: NacosRegistry = None
+        self.upstream: UpstreamGenerator = None
+        self.check_upstream_interval = 5
+        self.config_lock = Lock()  # apply, reload and rollback of the custom configs
+        self.daemon_threads = 16
+        self.executor: ThreadPoolExecutor = None  # runs the blocking calls
+        self.executor_threads = 0
+        self.loop = loop
+        self.loop_thread: Thread = None
+        self.nginx_status_monitoring_task: asyncio.Task = None
+        self.command_input_monitoring_task: asyncio.Task = None
+        self.metrics_exporting_task: asyncio.Task = None
+        self.registry_task: asyncio.Task = None
+        self.reload_monitoring_task: asyncio.Task = None
+        self.upstream_monitoring_task: asyncio.Task = None
+        self.config_status_monitoring_task: asyncio.Task = None
+        self.access_log_monitoring_task: asyncio.Task = None
         # load config
         self._load_config()
         self._load_daemon()
 
     def _load_config(self):
-        success, data = config.nginx_daemon_config_get()
-        if success:
-            if "check_alive_interval" in data:
-                self.check_alive_interval = int(data["check_alive_interval"])
-            if "check_command_interval" in data:
-                self.check_command_interval = int(data["check_command_interval"])
-            if "check_config_interval" in data:
-                self.check_config_interval = int(data["check_config_interval"])
-            if "nginx_status_url" in data:
-                self.nginx_status_url = data["nginx_status_url"]
-            if self.nginx is not None:
-                self.nginx.nginx_status_url = self.nginx_status_url
-            if "nacos_address" in data:
-                self.nacos_address = data["nacos_address"]
-            if "nacos_port" in data:
-                self.nacos_port = data["nacos_port"]
-            if "nacos_username" in data:
-                self.nacos_username = data["nacos_username"]
-            if "nacos_password" in data:
-                self.nacos_password = data["nacos_password"]
-            self.config_dict = data
-        logger.info(f"Load config: {self.config_dict}")
+        """load nginxdaemon.ini if the file changed and apply the changed keys
+
+        Returns:
+            list: keys changed since the last load
+        """
+        success, data = config.nginx_daemon_config_load()
+        if not success or data is self.config_dict:
+            return []
+        changed = config.nginx_daemon_config_changes(self.config_dict, data)
+        if data.get("check_alive_interval") is not None:
+            self.check_alive_interval = data["check_alive_interval"]
+        if data.get("check_config_interval") is not None:
+            self.check_config_interval = data["check_config_interval"]
+        if data.get("restart_probe_interval") is not None:
+            self.restart_probe_interval = data["restart_probe_interval"]
+        if data.get("restart_failure_threshold") is not None:
+            self.restart_policy.failure_threshold = data["restart_failure_threshold"]
+        if data.get("restart_backoff_max") is not None:
+            self.restart_policy.backoff_max = data["restart_backoff_max"]
+        if data.get("restart_crash_loop_limit") is not None:
+            self.restart_policy.crash_loop_limit = data["restart_crash_loop_limit"]
+        if data.get("restart_crash_loop_window") is not None:
+            self.restart_policy.crash_loop_window = data["restart_crash_loop_window"]
+        with self.reload_lock:
+            scheduler = self.reload_scheduler
+            if data.get("reload_debounce") is not None:
+                scheduler.debounce = data["reload_debounce"]
+            if data.get("reload_max_delay") is not None:
+                scheduler.max_delay = data["reload_max_delay"]
+            if data.get("reload_min_interval") is not None:
+                scheduler.min_interval = data["reload_min_interval"]
+            if data.get("reload_max_old_workers") is not None:
+                scheduler.max_old_workers = data["reload_max_old_workers"]
+            if data.get("reload_drain_timeout") is not None:
+                scheduler.drain_timeout = data["reload_drain_timeout"]
+        if data.get("daemon_threads") is not None:
+            self.daemon_threads = max(data["daemon_threads"], 1)
+        if data.get("check_upstream_interval") is not None:
+            self.check_upstream_interval = data["check_upstream_interval"]
+        if data.get("check_access_log_interval") is not None:
+            self.check_access_log_interval = data["check_access_log_interval"]
+        if "nginx_status_url" in data:
+            self.nginx_status_url = data["nginx_status_url"]
+        if "access_log_path" in data:
+            self.access_log_path = data["access_log_path"].strip()
+        if data.get("access_log_format", "").strip():
+            self.access_log_format = data["access_log_format"].strip()
+        if data.get("access_log_top_n") is not None:
+            self.access_log_top_n = data["access_log_top_n"]
+        if "metrics_listen" in data:
+            self.metrics_listen = data["metrics_listen"].strip()
+        if self.nginx is not None:
+            self.nginx.nginx_status_url = self.nginx_status_url
+        if "nacos_address" in data:
+            self.nacos_address = data["nacos_address"]
+        if "nacos_port" in data:
+            self.nacos_port = data["nacos_port"]
+        if "nacos_username" in data:
+            self.nacos_username = data["nacos_username"]
+        if "nacos_password" in data:
+            self.nacos_password = data["nacos_password"]
+        if data.get("nacos_pool_size") is not None:
+            self.nacos_pool_size = data["nacos_pool_size"]
+        if data.get("nacos_timeout") is not None:
+            self.nacos_timeout = data["nacos_timeout"]
+        if data.get("nacos_retries") is not None:
+            self.nacos_retries = data["nacos_retries"]
+        if data.get("nacos_sync_concurrency") is not None:
+            self.nacos_sync_concurrency = data["nacos_sync_concurrency"]
+        self.config_dict = data
+        logger.info(
+            f"Load config, changed: {config.nginx_daemon_config_mask({key: data.get(key) for key in changed})}"
+        )
+        if self.nginx is not None and NACOS_HOT_UPDATE_KEYS.intersection(changed):
+            self._load_nacos(changed)
+        if self.daemon and "metrics_listen" in changed:
+            self.loop.call_soon_threadsafe(self._start_metrics_exporter)
+        if self.running and {"access_log_path", "access_log_format"} & set(changed):
+            self.loop.call_soon_threadsafe(self._start_access_log_monitor)
+        return changed
+
+    def _load_nacos(self, changed: list = None):
+        """(re)create the nacos client, the registry and the upstream generator for the changed keys
+
+        Args:
+            changed (list, optional): keys changed. Defaults to None, all of them are created.
+        """
+        changed = set(NACOS_HOT_UPDATE_KEYS if changed is None else changed)
+        if changed & NACOS_CLIENT_KEYS:
+            previous = self.nacos
+            self.nacos = None
+            if self.nacos_address and self.nacos_port:
+                self.nacos = NacosClient(
+                    self.nacos_address,
+                    self.nacos_port,
+                    self.nacos_username,
+                    self.nacos_password,
+                    pool_size=self.nacos_pool_size,
+                    timeout=(3, self.nacos_timeout),
+                    retries=self.nacos_retries,
+                    snapshot_path=str(config.NGINX_DAEMON_SNAPSHOT_PATH),
+                )
+            if previous is not None:
+                # the config sync and listener follow self.nacos
+                previous.close()
+                logger.info("Nacos client reloaded")
+            changed |= NACOS_HOT_UPDATE_KEYS
+        if changed & CONFIG_SOURCE_KEYS:
+            self._load_config_source()
+        if changed & NACOS_REGISTRY_KEYS:
+            # the registry monitor deregisters the previous one
+            self.registry = None
+            service_name = (
+                self.config_dict.get("nacos_register_service") or ""
+            ).strip()
+            if self.nacos is not None and service_name:
+                self.registry = NacosRegistry(
+                    self.nacos,
+                    service_name,
+                    (self.config_dict.get("nacos_register_ip") or "").strip()
+                    or local_ip(self.nacos_address, self.nacos_port),
+                    self.config_dict.get("nacos_register_port") or 80,
+                    group_name=self.config_dict.get("nacos_group"),
+                    cluster_name=self.config_dict.get("nacos_register_cluster"),
+                    namespace_id=self.config_dict.get("nacos_namespace"),
+                    weight=self.config_dict.get("nacos_register_weight") or 1,
+                )
+        if changed & NACOS_UPSTREAM_KEYS:
+            self.upstream = None
+            services = UpstreamGenerator.parse_services(
+                self.config_dict.get("nacos_upstream_services") or ""
+            )
+            if self.nacos is not None and services:
+                self.upstream = UpstreamGenerator(
+                    self.nacos,
+                    services,
+                    group_name=self.config_dict.get("nacos_group"),
+                    namespace_id=self.config_dict.get("nacos_namespace"),
+                    validate=self.nginx.test_config,
+                )
+
+    def _load_config_source(self):
+        """configs synced from the config_source_path dir if set, from nacos otherwise"""
+        path = (self.config_dict.get("config_source_path") or "").strip()
+        if path:
+            self.config_source = FileConfigSource(str(BASE_PATH / path))
+        elif self.nacos is not None:
+            self.config_source = NacosConfigSource(self.nacos)
+        else:
+            self.config_source = None
+        # the config sync and listener follow self.config_source
 
     def _load_daemon(self):
         # init nginx tool
         self.nginx = NginxUtils(
             self.nginx_runner_path, self.nginx_context_path, self.nginx_status_url
         )
-        # init nacos client
-        if self.nacos_address and self.nacos_port:
-            self.nacos = NacosClient(
-                self.nacos_address,
-                self.nacos_port,
-                self.nacos_username,
-                self.nacos_password,
-            )
-        # add signal handler
-        signal.signal(signal.SIGTERM, self._handle_signal)  # kill
-        signal.signal(signal.SIGINT, self._handle_signal)  # ctrl+c
+        self.metrics.status_series = self.nginx.status_series
+        # init nacos client, the registry and the upstream generator
+        self._load_nacos()
+        # start the event loop
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+            self.loop_thread = Thread(target=self._run_loop)
+            self.loop_thread.start()
+            # add signal handler
+            signal.signal(signal.SIGTERM, self._handle_signal)  # kill
+            signal.signal(signal.SIGINT, self._handle_signal)  # ctrl+c
         # start the command daemon
+        self.loop.call_soon_threadsafe(self._start_daemon)
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.close()
+            logger.info("Monitor event loop stopped...")
+
+    def _executor(self):
+        """the thread pool of the blocking calls, recreated if daemon_threads changed"""
+        if self.executor is None or self.executor_threads != self.daemon_threads:
+            if self.executor is not None:
+                # the calls already running finish in the old pool
+                self.executor.shutdown(wait=False)
+            self.executor_threads = self.daemon_threads
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.daemon_threads, thread_name_prefix="nginxdaemon"
+            )
+        return self.executor
+
+    async def _in_thread(self, func, *args):
+        """run a blocking call in the thread pool, a cancelled task does not wait for it"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor(), func, *args)
+
+    async def _sleep_until_next(self, deadline: float, interval: float):
+        """sleep until deadline + interval, missed ticks are skipped so the timer never drifts"""
+        loop = asyncio.get_running_loop()
+        deadline += interval
+        now = loop.time()
+        if deadline < now:
+            deadline += ((now - deadline) // interval + 1) * interval
+        await asyncio.sleep(deadline - now)
+        return deadline
+
+    def _cancel_monitors(self):
+        for task in (
+            self.nginx_status_monitoring_task,
+            self.config_status_monitoring_task,
+            self.access_log_monitoring_task,
+            self.upstream_monitoring_task,
+        ):
+            if task is not None and not task.done():
+                task.cancel()
+        self.nginx_status_monitoring_task = None
+        self.config_status_monitoring_task = None
+        self.access_log_monitoring_task = None
+        self.upstream_monitoring_task = None
+
+    def _start_daemon(self):
         self.daemon = True
-        self.command_input_monitoring_thread = Thread(target=self.command_input_monitor)
-        self.command_input_monitoring_thread.start()
+        self.command_input_monitoring_task = self.loop.create_task(
+            self.command_input_monitor()
+        )
         logger.info("Command input monitor daemon started...")
+        self.reload_event = asyncio.Event()
+        self.reload_monitoring_task = self.loop.create_task(self.reload_monitor())
+        self._start_metrics_exporter()
+        self._start_nacos_monitors()
+
+    def _start_metrics_exporter(self):
+        """(re)start the metrics exporter on metrics_listen, e.g. changed by a hot update, stopped if empty"""
+        task = self.metrics_exporting_task
+        if task is not None and not task.done():
+            task.cancel()
+        self.metrics_exporting_task = None
+        self.metrics_error = None
+        if self.daemon and self.metrics_listen:
+            self.metrics_exporting_task = self.loop.create_task(self.metrics_exporter())
+
+    def _start(self):
+        if self.running:
+            return
+        self.running = True
+        self.nginx_status_monitoring_task = self.loop.create_task(
+            self.nginx_status_monitor()
+        )
+        logger.info("Nginx status monitor started...")
+        self.config_status_monitoring_task = self.loop.create_task(
+            self.config_status_monitor()
+        )
+        logger.info("Config status monitor started...")
+        self._start_access_log_monitor()
+        self._start_nacos_monitors()
+
+    def _start_access_log_monitor(self):
+        """start the access log monitor if access_log_path is set, e.g. by a hot update, stop it if emptied
+
+        A changed path or format is followed by the running monitor.
+        """
+        task = self.access_log_monitoring_task
+        running = task is not None and not task.done()
+        if running and not self.access_log_path:
+            task.cancel()
+            self.access_log_monitoring_task = None
+        elif not running and self.running and self.access_log_path:
+            self.access_log_monitoring_task = self.loop.create_task(
+                self.access_log_monitor()
+            )
+            logger.info("Access log monitor started...")
+
+    def _start_nacos_monitors(self):
+        """start the registry and upstream monitors not running yet, e.g. enabled by a hot update"""
+        if (
+            self.daemon
+            and self.registry is not None
+            and (self.registry_task is None or self.registry_task.done())
+        ):
+            self.registry_task = self.loop.create_task(self.registry_monitor())
+            logger.info("Nacos registry started...")
+        if (
+            self.running
+            and self.upstream is not None
+            and (
+                self.upstream_monitoring_task is None
+                or self.upstream_monitoring_task.done()
+            )
+        ):
+            self.upstream_monitoring_task = self.loop.create_task(
+                self.upstream_monitor()
+            )
+            logger.info("Upstream monitor started...")
+
+    def _stop(self):
+        self.running = False
+        self._cancel_monitors()
+
+    def _quit(self):
+        self.running = False
+        self.daemon = False
+        tasks = [
+            task
+            for task in (
+                self.nginx_status_monitoring_task,
+                self.config_status_monitoring_task,
+                self.access_log_monitoring_task,
+                self.upstream_monitoring_task,
+                self.command_input_monitoring_task,
+                self.metrics_exporting_task,
+                self.registry_task,
+                self.reload_monitoring_task,
+            )
+            if task is not None and not task.done()
+        ]
+        self._cancel_monitors()
+        for task in tasks:
+            task.cancel()
+        # stop once the tasks cleaned up, e.g. deregistered from nacos
+        asyncio.gather(*tasks, return_exceptions=True).add_done_callback(
+            self._quit_done
+        )
+
+    def _quit_done(self, _):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        if self.loop_thread is not None:
+            self.loop.stop()
 
     def _handle_signal(self, signum, frame):
         if signum == signal.SIGINT:
@@ -119,220 +489,659 @@ class MonitorDaemon:
         start the monitors
         """
         logger.info("Starting monitor...")
-        self.running = True
-        self.nginx_status_monitoring_thread = Thread(target=self.nginx_status_monitor)
-        self.nginx_status_monitoring_thread.start()
-        logger.info("Nginx status monitor started...")
-        self.config_status_monitoring_thread = Thread(target=self.config_status_monitor)
-        self.config_status_monitoring_thread.start()
-        logger.info("Config status monitor started...")
+        self.loop.call_soon_threadsafe(self._start)
 
     def stop(self):
         """
         stop the monitors
         """
         logger.info("Stopping monitors...")
-        self.running = False
+        self.loop.call_soon_threadsafe(self._stop)
 
     def quit(self):
         """
         stop the nginx monitor and monitor command daemon
         """
         logger.info("Quiting nginx monitor and command daemon...")
-        self.running = False
-        self.daemon = False
+        self.loop.call_soon_threadsafe(self._quit)
 
-    def nginx_status_monitor(self):
-        while self.running:
-            self.nginx.status()
-            if not self.nginx.nginx_alive:
-                logger.error(f"Nginx is not alive, restarting...")
-                self.nginx.restart()
-            else:
-                logger.info("Nginx is alive...")
-            time.sleep(self.check_alive_interval)
-        logger.info("Nginx monitor stopped...")
+    async def nginx_status_monitor(self):
+        try:
+            if not self.booted:
+                await self._in_thread(self._boot)
+            deadline = asyncio.get_running_loop().time()
+            while self.running:
+                await self._in_thread(self.nginx.status)
+                self.metrics.observe_status(self.nginx.nginx_status)
+                policy = self.restart_policy
+                if policy.observe(self.nginx.nginx_alive):
+                    logger.error(
+                        f"Nginx is not alive for {policy.failures} probes, recovering..."
+                    )
+                    self.metrics.inc("nginx_restarts")
+                    success, action = await self._in_thread(self._recover_nginx)
+                    policy.recovered(success)
+                    logger.info(f"Nginx recovery by {action}: {success}")
+                elif not self.nginx.nginx_alive:
+                    logger.warning(f"Nginx is not alive ({policy.state})...")
+                else:
+                    logger.debug("Nginx is alive...")
+                # failures are confirmed quickly, then probed at the normal pace
+                interval = (
+                    self.restart_probe_interval
+                    if policy.state == "suspect"
+                    else self.check_alive_interval
+                )
+                deadline = await self._sleep_until_next(deadline, interval)
+        finally:
+            logger.info("Nginx monitor stopped...")
 
-    def config_status_monitor(self):
+    async def config_status_monitor(self):
         """sync config from nacos"""
-        while self.running:
-            self._load_config()
-            try:
-                skip_sync = False
-                if self.nacos is None:
-                    logger.debug("Nacos is not initialized, skip sync config")
-                    skip_sync = True
-                if not skip_sync and (
-                    not self.nacos.alive()
-                    and not self.nacos.login()[0]
-                    and self.nacos.alive()
-                ):
-                    logger.debug("Nacos is not alive, skip sync config")
-                    skip_sync = True
-                if not skip_sync:
-                    namespace = self.config_dict["nacos_namespace"]
-                    group = self.config_dict["nacos_group"]
-                    conf_series_data_id = self.config_dict["nacos_conf_series_data_id"]
-                    conf_version_data_id = self.config_dict[
-                        "nacos_conf_version_data_id"
-                    ]
-                    auto_reload_nginx = bool(
-                        self.config_dict["nacos_auto_reload_nginx"]
-                    )
-                    conf_version_success, local_conf_version = (
-                        config.nginx_config_get_custom(conf_version_data_id)
+        try:
+            while self.running:
+                if self._load_config():
+                    self._start_nacos_monitors()
+                start = time.perf_counter()
+                synced = await self._in_thread(self._sync_config)
+                if synced is not None:
+                    self.metrics.observe(
+                        "nacos_sync_duration_seconds", time.perf_counter() - start
                     )
-                    if conf_version_success:
-                        local_conf_version = int(str(local_conf_version).strip())
-                    else:
-                        raise Exception("Get config version from local error")
-                    nacos_conf_version_success, nacos_conf_version = (
-                        self.nacos.config_get(conf_version_data_id, group, namespace)
-                    )
-                    if nacos_conf_version_success:
-                        nacos_conf_version = int(str(nacos_conf_version).strip())
-                        if nacos_conf_version == local_conf_version:
-                            logger.info("Nginx config is up to date")
-                            skip_sync = True
-                        upload = nacos_conf_version < local_conf_version
-                    else:
-                        upload = True
-                    if not skip_sync:
-                        if upload:
-                            logger.info(
-                                "Local config is newer than nacos, upload to nacos"
-                            )
-                            success, conf_series = config.nginx_config_get_custom(
-                                conf_series_data_id
+                    self.metrics.inc("nacos_syncs")
+                    if not synced:
+                        self.metrics.inc("nacos_sync_failures")
+                await self._wait_config_change()
+        finally:
+            logger.info("Config monitor stopped...")
+
+    def _load_access_log(self):
+        """(re)create the analyzer if the access log path or format changed"""
+        path = os.path.join(self.nginx_context_path, self.access_log_path)
+        if (
+            self.access_log is not None
+            and self.access_log.tailer.path == path
+            and self.access_log.log_format == self.access_log_format
+        ):
+            return
+        if self.access_log is not None:
+            self.access_log.close()
+        self.access_log = AccessLogAnalyzer(
+            path, self.access_log_format, top_n=self.access_log_top_n
+        )
+        self.metrics.access_log_stats = self.access_log.stats
+        logger.info(f"Analyzing access log: {path}")
+
+    async def access_log_monitor(self):
+        """tail and aggregate the access log of nginx"""
+        deadline = asyncio.get_running_loop().time()
+        try:
+            while self.running and self.access_log_path:
+                self._load_access_log()
+                try:
+                    await self._in_thread(self.access_log.poll)
+                except Exception as e:
+                    logger.error(f"Analyze access log error: {e}")
+                deadline = await self._sleep_until_next(
+                    deadline, self.check_access_log_interval
+                )
+        finally:
+            logger.info("Access log monitor stopped...")
+
+    def _sync_config(self):
+        """sync config from the config source (nacos) once (blocking)
+
+        Returns:
+            bool | None: sync success or not, None if the config source is not available
+        """
+        synced = None
+        source = self.config_source
+        try:
+            skip_sync = False
+            if source is None:
+                logger.debug("Config source is not initialized, skip sync config")
+                skip_sync = True
+            if not skip_sync and (
+                not source.alive() and not source.login()[0] and source.alive()
+            ):
+                logger.debug("Nacos is not alive, skip sync config")
+                skip_sync = True
+            if not skip_sync:
+                synced = True
+                namespace = self.config_dict["nacos_namespace"]
+                group = self.config_dict["nacos_group"]
+                conf_series_data_id = self.config_dict["nacos_conf_series_data_id"]
+                conf_version_data_id = self.config_dict["nacos_conf_version_data_id"]
+                auto_reload_nginx = bool(self.config_dict["nacos_auto_reload_nginx"])
+                conf_version_success, local_conf_version = (
+                    config.nginx_config_get_custom(conf_version_data_id)
+                )
+                if conf_version_success:
+                    local_conf_version = int(str(local_conf_version).strip())
+                else:
+                    raise Exception("Get config version from local error")
+                nacos_conf_version_success, nacos_conf_version = source.config_get(
+                    conf_version_data_id, group, namespace
+                )
+                if nacos_conf_version_success:
+                    nacos_conf_version = int(str(nacos_conf_version).strip())
+                    if nacos_conf_version == local_conf_version:
+                        logger.info("Nginx config is up to date")
+                        skip_sync = True
+                    upload = nacos_conf_version < local_conf_version
+                else:
+                    upload = True
+                if not skip_sync:
+                    self._load_config_sync(source)
+                    if upload:
+                        logger.info("Local config is newer than nacos, upload to nacos")
+                        success, conf_series = config.nginx_config_get_custom(
+                            conf_series_data_id
+                        )
+                        logger.debug(f"Get config series from local:{conf_series}")
+                        if not success:
+                            raise Exception(
+                                f"Get config series from local error: {conf_series}"
                             )
-                            logger.debug(f"Get config series from local:{conf_series}")
-                            if not success:
-                                raise Exception(
-                                    f"Get config series from local error: {conf_series}"
-                                )
-                            for config_name in conf_series.split("\n"):
-                                config_name = config_name.strip()
-                                success, content = config.nginx_config_get_custom(
-                                    config_name
-                                )
-                                if not success:
-                                    raise Exception(
-                                        f"Get config {config_name} from local error: {content}"
-                                    )
-                                logger.debug(
-                                    f"Upload config {config_name} to nacos:{content}"
-                                )
-                                success, result = self.nacos.config_publish(
-                                    data_id=config_name,
-                                    group=group,
-                                    content=content,
-                                    tenant=namespace,
-                                )
-                                if success and result:
-                                    logger.info(
-                                        f"Upload config {config_name} to nacos[{namespace}/{group}/{config_name}] success"
-                                    )
-                                else:
-                                    logger.error(
-                                        f"Upload config {config_name} to nacos error"
-                                    )
+                        success, result = self.config_sync.upload(
+                            ConfigSync.series_names(conf_series), group, namespace
+                        )
+                        synced = success
+                        if success:
                             logger.info("Upload config to nacos success")
                         else:
-                            logger.info(
-                                "Local config is older than nacos, download from nacos"
+                            logger.error(
+                                f"Upload config to nacos error: {result['failed']}"
+                            )
+                    else:
+                        logger.info(
+                            "Local config is older than nacos, download from nacos"
+                        )
+                        success, conf_series = source.config_series(
+                            conf_series_data_id, group, namespace
+                        )
+                        if not success:
+                            raise Exception("Get config series from nacos error")
+                        with self.config_lock:
+                            success, result = self.config_sync.download(
+                                conf_series, group, namespace
                             )
-                            success, conf_series = self.nacos.config_get(
-                                data_id=conf_series_data_id,
-                                group=group,
-                                tenant=namespace,
+                            if auto_reload_nginx and result["changed"]:
+                                # the downloaded config was tested before applied
+                                self._request_reload()
+                        synced = success
+                        if not success:
+                            logger.error(
+                                f"Download config from nacos error: {result['failed']}"
                             )
-                            if not success:
-                                raise Exception("Get config series from nacos error")
-                            for config_name in conf_series.split("\n"):
-                                config_name = config_name.strip()
-                                success, content = self.nacos.config_get(
-                                    data_id=config_name, group=group, tenant=namespace
-                                )
-                                result, msg = config.nginx_config_set_custom(
-                                    config_name, content
-                                )
-                                if success and result:
-                                    logger.info(
-                                        f"Download config {config_name} to local success"
-                                    )
-                                else:
-                                    logger.error(
-                                        f"Download config {config_name} to local error"
-                                    )
-                            if auto_reload_nginx:
-                                logger.info("Reloading nginx...")
-                                if self.nginx.test_config():
-                                    logger.info("Nginx config test success")
-                                    self.nginx.reload()
+                        if not result["changed"]:
+                            logger.info("Nginx config not changed, skip reload")
+                        if success:
                             logger.info("Download config from nacos success")
+        except Exception as e:
+            logger.error(f"Sync config from nacos error: {e}")
+            synced = False
+        return synced
+
+    def _load_config_sync(self, source: ConfigSource):
+        if (
+            self.config_sync is None
+            or self.config_sync.source is not source
+            or self.config_sync.concurrency != self.nacos_sync_concurrency
+        ):
+            self.config_sync = ConfigSync(
+                source,
+                self.nacos_sync_concurrency,
+                validate=self.nginx.test_config,
+            )
+        return self.config_sync
+
+    def _boot(self):
+        """restore the configs from the snapshot and start nginx, without waiting for nacos (blocking)"""
+        self.booted = True
+        if self.config_source is not None:
+            try:
+                with self.config_lock:
+                    self._restore_snapshot(self.config_source)
             except Exception as e:
-                logger.error(f"Sync config from nacos error: {e}")
-            time.sleep(self.check_config_interval)
-        logger.info("Config monitor stopped...")
+                logger.error(f"Restore config from snapshot error: {e}")
+        if self.nginx.master_pid() is None:
+            logger.info("Nginx is not running, starting...")
+            if self.nginx.start():
+                config.nginx_config_commit_custom()
+
+    def _restore_snapshot(self, source: ConfigSource):
+        """apply the configs last fetched from nacos if their version is newer than the local one (blocking)
+
+        Returns:
+            bool: restored or not
+        """
+        namespace = self.config_dict["nacos_namespace"]
+        group = self.config_dict["nacos_group"]
+        conf_series_data_id = self.config_dict["nacos_conf_series_data_id"]
+        conf_version_data_id = self.config_dict["nacos_conf_version_data_id"]
+        success, version = source.config_snapshot_get(
+            conf_version_data_id, group, namespace
+        )
+        if not success:
+            logger.info("No config snapshot, boot with the local config")
+            return False
+        success, local_conf_version = config.nginx_config_get_custom(
+            conf_version_data_id
+        )
+        local_conf_version = int(str(local_conf_version).strip()) if success else -1
+        if int(version["content"].strip()) <= local_conf_version:
+            logger.info("Local config is up to date with the snapshot")
+            return False
+        success, conf_series = source.config_snapshot_get(
+            conf_series_data_id, group, namespace
+        )
+        if not success:
+            raise Exception(f"Get config series from snapshot error: {conf_series}")
+        success, result = self._load_config_sync(source).restore(
+            ConfigSync.series_names(conf_series["content"]), group, namespace
+        )
+        if not success:
+            return False
+        if result["changed"] and self.nginx.master_pid() is not None:
+            self._request_reload()
+        return True
+
+    def _reload_or_rollback(self):
+        """reload nginx for the applied custom configs, rollback them if the reload failed (blocking)"""
+        logger.info("Reloading nginx...")
+        if self._reload_nginx():
+            return True
+        logger.error("Reload nginx failed, rollback the config")
+        config.nginx_config_rollback_custom()
+        return False
+
+    def _sync_upstream(self):
+        """render the upstreams from nacos and reload nginx if changed (blocking)"""
+        upstream = self.upstream
+        if upstream is None:
+            return False
+        with self.config_lock:
+            success, changed = upstream.sync()
+            if changed and self.config_dict.get("nacos_auto_reload_nginx"):
+                self._request_reload()
+        return success
+
+    async def upstream_monitor(self):
+        """follow the instances of the nacos services in the nginx upstreams"""
+        deadline = asyncio.get_running_loop().time()
+        try:
+            while self.running and self.upstream is not None:
+                try:
+                    await self._in_thread(self._sync_upstream)
+                except Exception as e:
+                    logger.error(f"Sync upstream from nacos error: {e}")
+                deadline = await self._sleep_until_next(
+                    deadline, self.check_upstream_interval
+                )
+        finally:
+            logger.info("Upstream monitor stopped...")
 
-    def command_input_monitor(self):
-        parser = argparse.ArgumentParser("")
+    def _request_reload(self, rollback: bool = True):
+        """request a reload of nginx, run by the reload monitor once the scheduler allows it (thread safe)
+
+        Args:
+            rollback (bool, optional): rollback the applied custom configs if the reload failed. Defaults to True.
+        """
+        with self.reload_lock:
+            self.reload_scheduler.request()
+            self.reload_rollback = self.reload_rollback or rollback
+        self.metrics.inc("nginx_reload_requests")
+        self.loop.call_soon_threadsafe(self._wake_reload_monitor)
+
+    def _wake_reload_monitor(self):
+        if self.reload_event is not None:
+            self.reload_event.set()
+
+    def _scheduled_reload(self, rollback: bool):
+        """reload nginx for the requests taken by the scheduler (blocking)
+
+        The custom configs applied since the last successful reload are rolled back
+        together if the reload failed, or committed once nginx runs them.
+        """
+        with self.config_lock:
+            success = self._reload_or_rollback() if rollback else self._reload_nginx()
+            if success:
+                config.nginx_config_commit_custom()
+            return success
+
+    async def reload_monitor(self):
+        """run the requested reloads of nginx, merged and spaced by the reload scheduler"""
+        scheduler = self.reload_scheduler
+        try:
+            while self.daemon:
+                # a request after this is not missed by the wait below
+                self.reload_event.clear()
+                with self.reload_lock:
+                    delay = scheduler.due()
+                if delay == 0:
+                    # the old workers are only counted once the reload is due
+                    old_workers = len(await self._in_thread(self.nginx.old_workers))
+                    with self.reload_lock:
+                        draining = scheduler.state == "draining"
+                        delay = scheduler.due(old_workers)
+                        if delay == 0:
+                            batch = scheduler.begin()
+                            rollback, self.reload_rollback = self.reload_rollback, False
+                    if delay == 0:
+                        waiters, self.reload_waiters = self.reload_waiters, []
+                        success = await self._in_thread(
+                            self._scheduled_reload, rollback
+                        )
+                        with self.reload_lock:
+                            scheduler.reloaded(success, batch)
+                        for waiter in waiters:
+                            if not waiter.done():
+                                waiter.set_result(success)
+                        continue
+                    if not draining:
+                        logger.warning(
+                            f"{old_workers} old workers of nginx are draining, reload delayed"
+                        )
+                try:
+                    await asyncio.wait_for(self.reload_event.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            logger.info("Reload monitor stopped...")
+
+    async def _reload_command(self):
+        """request a reload and wait for the reload serving it, None if it is still scheduled"""
+        future = self.loop.create_future()
+        self.reload_waiters.append(future)
+        self._request_reload(rollback=False)
+        scheduler = self.reload_scheduler
+        try:
+            return await asyncio.wait_for(
+                asyncio.shield(future), scheduler.debounce + scheduler.min_interval + 5
+            )
+        except asyncio.TimeoutError:
+            return None
+
+    def _recover_nginx(self):
+        """recover nginx, not while the custom configs are applied or the binary is upgraded (blocking)"""
+        with self.config_lock:
+            return self.nginx.recover()
+
+    def _upgrade_nginx(self):
+        """upgrade the nginx binary, the reloads and recoveries are suspended until it finished (blocking)"""
+        with self.reload_lock:
+            self.reload_scheduler.suspend()
+        self.restart_policy.suspend()
+        try:
+            # a reload or recovery already running is finished first
+            with self.config_lock:
+                return self.nginx.upgrade()
+        finally:
+            self.restart_policy.resume()
+            with self.reload_lock:
+                self.reload_scheduler.resume()
+            self.loop.call_soon_threadsafe(self._wake_reload_monitor)
+
+    def _reload_nginx(self):
+        """reload nginx and record the duration (blocking)"""
+        start = time.perf_counter()
+        success = self.nginx.reload()
+        self.metrics.observe(
+            "nginx_reload_duration_seconds", time.perf_counter() - start
+        )
+        self.metrics.inc("nginx_reloads")
+        if not success:
+            self.metrics.inc("nginx_reload_failures")
+        return success
+
+    def _config_listen_watch(self, source: ConfigSource, group: str, namespace: str):
+        """watch the version data id, the series data id and every file in the series
+
+        The listener of the config sync is shared, a config fetched on change is not
+        downloaded again. The series is only read again once it changed.
+        """
+        conf_series_data_id = self.config_dict["nacos_conf_series_data_id"]
+        conf_version_data_id = self.config_dict["nacos_conf_version_data_id"]
+        listener = self._load_config_sync(source).listener
+        series_key = NacosConfigListener.key(conf_series_data_id, group, namespace)
+        if self.config_series is None or self.config_series[:2] != (
+            listener,
+            series_key,
+        ):
+            success, conf_series = source.config_series(
+                conf_series_data_id, group, namespace
+            )
+            self.config_series = (listener, series_key, conf_series if success else [])
+        data_ids = [conf_version_data_id, conf_series_data_id] + self.config_series[2]
+        listener.watch(
+            (data_id, group, namespace, None) for data_id in dict.fromkeys(data_ids)
+        )
+        return listener, series_key
+
+    def _listen_config_change(self):
+        """block until configs changed on nacos or the long pulling timeout"""
+        try:
+            group = self.config_dict["nacos_group"]
+            namespace = self.config_dict["nacos_namespace"]
+            listener, series_key = self._config_listen_watch(
+                self.config_source, group, namespace
+            )
+            success, changed = listener.listen()
+            if success and series_key in changed:
+                content = listener.contents.get(series_key)
+                self.config_series = (
+                    None
+                    if content is None
+                    else (listener, series_key, ConfigSync.series_names(content))
+                )
+            return success, changed
+        except Exception as e:
+            return False, str(e)
+
+    async def _wait_config_change(self):
+        """wait for the next sync: until configs changed on nacos in listen mode, or check_config_interval in poll mode"""
+        sync_mode = self.config_dict.get("nacos_sync_mode", "listen")
+        if sync_mode != "listen" or self.config_source is None or not self.running:
+            await asyncio.sleep(self.check_config_interval)
+            return
+        success, changed = await self._in_thread(self._listen_config_change)
+        if not success:
+            logger.warning(
+                f"Listen config from nacos error, fallback to poll: {changed}"
+            )
+            await asyncio.sleep(self.check_config_interval)
+            return
+        if changed:
+            logger.info(f"Config changed on nacos: {[c[0] for c in changed]}")
+
+    def _command_parser(self):
+        parser = argparse.ArgumentParser("", exit_on_error=False)
         parser.add_argument(
             "-n",
             dest="nginx",
             type=str,
-            choices=["start", "stop", "restart", "reload", "reopen", "quit"],
+            choices=[
+                "start",
+                "stop",
+                "restart",
+                "reload",
+                "reopen",
+                "upgrade",
+                "quit",
+                "status",
+            ],
             help="nginx command",
         )
         parser.add_argument(
             "-m",
             dest="monitor",
             type=str,
-            choices=["start", "stop", "quit"],
+            choices=["start", "stop", "quit", "status"],
             help="monitor command",
         )
-        if os.path.exists(self.command_file):
-            # remove the existed file
-            os.remove(self.command_file)
-        while self.daemon:
-            logger.debug("Checking command: %s", self.command_file)
-            if os.path.exists(self.command_file):
-                try:
-                    with open(self.command_file, "r") as f:
-                        # only one line cmd is available
-                        command = f.readline().strip()
-                        f.close()
-                        logger.info(f"Received command: '{command}'")
-                        args = parser.parse_args(
-                            [item for item in command.split(" ") if item.strip() != ""]
-                        )
-                        if args.nginx == "start":
-                            self.nginx.start()
-                        elif args.nginx == "restart":
-                            self.nginx.restart()
-                        elif args.nginx == "reload":
-                            self.nginx.reload()
-                        elif args.nginx == "reopen":
-                            self.nginx.reopen()
-                        elif args.nginx == "stop":
-                            self.nginx.stop()
-                        elif args.nginx == "quit":
-                            self.nginx.quit()
-                        if args.monitor == "start":
-                            self.start()
-                        elif args.monitor == "stop":
-                            self.stop()
-                        elif args.monitor == "quit":
-                            self.quit()
-                except SystemExit as e:
-                    logger.error(
-                        f"Error while parsing command, unrecognized arguments: {command}"
-                    )
-                except Exception as e:
-                    logger.error(f"Error while parsing command: {e}")
-                try:
-                    os.remove(self.command_file)  # remove file
-                except Exception as e:
-                    pass
-            time.sleep(self.check_command_interval)
-        logger.info("Nginx monitor command daemon stopped...")
+        parser.add_argument(
+            "-l",
+            dest="log",
+            type=str,
+            choices=["access"],
+            help="log analysis",
+        )
+        return parser
+
+    async def _execute_command(self, parser: argparse.ArgumentParser, command: str):
+        """execute one command, return the result to acknowledge and the action to run after it"""
+        try:
+            args = parser.parse_args(
+                [item for item in command.split(" ") if item.strip() != ""]
+            )
+        except (SystemExit, argparse.ArgumentError) as e:
+            msg = f"Error while parsing command, unrecognized arguments: {command}"
+            logger.error(msg)
+            return {"success": False, "result": msg}, None
+        result = {}
+        after = None
+        success = True
+        if args.nginx == "status":
+            success, result["nginx"] = await self._in_thread(self.nginx.status)
+        elif args.nginx == "reload":
+            # merged with the reloads of config changes
+            success = await self._reload_command()
+            result["nginx"] = args.nginx if success is not None else "reload scheduled"
+            success = success is not False
+        elif args.nginx == "upgrade":
+            success = await self._in_thread(self._upgrade_nginx)
+            result["nginx"] = args.nginx
+        elif args.nginx is not None:
+            success = await self._in_thread(getattr(self.nginx, args.nginx))
+            result["nginx"] = args.nginx
+        if args.log == "access":
+            if self.access_log is None:
+                success = False
+                result["log"] = "Access log is not analyzed"
+            else:
+                result["log"] = self.access_log.stats.snapshot()
+        if args.monitor == "start":
+            logger.info("Starting monitor...")
+            self._start()
+        elif args.monitor == "stop":
+            logger.info("Stopping monitors...")
+            self._stop()
+        elif args.monitor == "quit":
+            logger.info("Quiting nginx monitor and command daemon...")
+            after = self._quit
+        if args.monitor is not None:
+            result["monitor"] = {
+                "running": self.running,
+                "daemon": self.daemon,
+                "metrics_exporter": {
+                    "listen": self.metrics_listen,
+                    "listening": self.metrics_exporting_task is not None
+                    and not self.metrics_exporting_task.done(),
+                    "error": self.metrics_error,
+                },
+            }
+        return {"success": bool(success), "result": result}, after
+
+    async def _command_worker(self):
+        """execute the queued commands one by one"""
+        parser = self._command_parser()
+        while True:
+            command, future = await self.command_queue.get()
+            after = None
+            try:
+                logger.info(f"Received command: '{command}'")
+                response, after = await self._execute_command(parser, command)
+            except Exception as e:
+                logger.error(f"Error while executing command: {e}")
+                response = {"success": False, "result": str(e)}
+            if not future.done():
+                future.set_result(response)
+            if after is not None:
+                # scheduled behind the client waiting for the acknowledgement
+                self.loop.call_soon(after)
+
+    async def _handle_command_client(self, reader, writer):
+        """one command per line, each is acknowledged with one line of json result"""
+        try:
+            while self.daemon:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode("utf-8").strip()
+                if command == "":
+                    continue
+                future = self.loop.create_future()
+                await self.command_queue.put((command, future))
+                response = await future
+                writer.write((json.dumps(response) + "\n").encode("utf-8"))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def command_input_monitor(self):
+        """serve commands on the unix domain socket"""
+        self.command_queue = asyncio.Queue()
+        worker = self.loop.create_task(self._command_worker())
+        if os.path.exists(self.command_socket):
+            # remove the stale socket
+            os.remove(self.command_socket)
+        os.makedirs(os.path.dirname(self.command_socket), exist_ok=True)
+        server = await asyncio.start_unix_server(
+            self._handle_command_client, path=self.command_socket
+        )
+        os.chmod(self.command_socket, 0o660)
+        logger.info(f"Command socket listening: {self.command_socket}")
+        try:
+            await server.serve_forever()
+        finally:
+            worker.cancel()
+            server.close()
+            try:
+                os.remove(self.command_socket)
+            except OSError:
+                pass
+            logger.info("Nginx monitor command daemon stopped...")
+
+    async def metrics_exporter(self):
+        """serve the metrics for prometheus on metrics_listen (host:port)"""
+        host, _, port = self.metrics_listen.rpartition(":")
+        try:
+            server = await asyncio.start_server(
+                self.metrics.handle_client, host or "127.0.0.1", int(port)
+            )
+        except (OSError, ValueError) as e:
+            # reported by -m status until metrics_listen changes
+            self.metrics_error = str(e)
+            logger.error(f"Metrics exporter listen {self.metrics_listen} error: {e}")
+            return
+        logger.info(f"Metrics exporter listening: {self.metrics_listen}")
+        try:
+            await server.serve_forever()
+        finally:
+            server.close()
+            logger.info("Metrics exporter stopped...")
+
+    async def registry_monitor(self):
+        """keep this proxy registered on nacos with the health of nginx, deregister on quit
+
+        A registry replaced by a hot update is deregistered before the new one registers.
+        """
+        registry: NacosRegistry = None
+        try:
+            while self.registry is not None:
+                if registry is not self.registry:
+                    if registry is not None:
+                        await self._in_thread(registry.deregister)
+                    registry = self.registry
+                if not self.running:
+                    # the status monitor is stopped, probe nginx here
+                    await self._in_thread(self.nginx.status)
+                await self._in_thread(registry.beat, self.nginx.nginx_alive)
+                await asyncio.sleep(registry.beat_interval)
+        finally:
+            if registry is not None:
+                await self._in_thread(registry.deregister)
+            logger.info("Nacos registry stopped...")
@@ -1,16 +1,153 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import logging
 import time
 import hashlib
 import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Lock, Timer
+from urllib.parse import unquote
 
 logger = logging.getLogger(__name__)
 
+# data id, group and tenant allowed by nacos, used as path components of the snapshot
+NACOS_SNAPSHOT_NAME = re.compile(r"[\w\-.:]+")
+
+
+class NacosTokenManager:
+    def __init__(self, login, refresh_ratio: float = 0.8, retry_interval: float = 5):
+        """Access token of a nacos client, refreshed in the background before it expires
+
+        Nothing is requested until the first get. After a login, a daemon timer
+        logs in again once refresh_ratio of the ttl elapsed, so requests never
+        wait for a login nor fail with an expired token. Concurrent refreshes
+        are coalesced into one login, the waiting threads share its result.
+        A failed login is retried by the timer every retry_interval seconds,
+        get does not block on it again before.
+
+        Args:
+            login (callable): login() -> (success, data), data is the login result of nacos
+            refresh_ratio (float, optional): part of the ttl after which the token is refreshed. Defaults to 0.8.
+            retry_interval (float, optional): seconds between retries of a failed login. Defaults to 5.
+        """
+        self.login = login
+        self.refresh_ratio = refresh_ratio
+        self.retry_interval = retry_interval
+        self.lock = Lock()
+        self.access_token = None
+        self.access_token_ttl = 0  # seconds
+        self.global_admin = False
+        self.login_timestamp = 0  # seconds
+        self.expires = 0  # time.monotonic() of the expiry
+        self.retry_after = 0  # time.monotonic() before which get does not login
+        self.generation = 0  # logins done, to coalesce the concurrent refreshes
+        self.timer: Timer = None
+        self.closed = False
+
+    def valid(self):
+        return self.access_token is not None and time.monotonic() < self.expires
+
+    def get(self):
+        """Get the access token, login first if there is none (blocking).
+
+        Returns:
+            str | None: access token, None if the login failed
+        """
+        if self.valid():
+            return self.access_token
+        if time.monotonic() < self.retry_after:
+            return None
+        self.refresh(self.generation)
+        return self.access_token if self.valid() else None
+
+    def refresh(self, generation: int = None):
+        """Login again, joining a login done by another thread since generation was read.
+
+        Args:
+            generation (int, optional): generation seen by the caller. Defaults to None, always login.
+
+        Returns:
+            success, data: True and login result or False and msg
+        """
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                # coalesced with the login done while waiting for the lock
+                return self.valid(), None
+            started = time.monotonic()
+            login_timestamp = int(time.time())
+            success, data = self.login()
+            self.generation += 1
+            if success:
+                self.access_token = data["accessToken"]
+                self.access_token_ttl = data["tokenTtl"]
+                self.global_admin = data.get("globalAdmin", False)
+                self.login_timestamp = login_timestamp
+                self.expires = started + self.access_token_ttl
+                self.retry_after = 0
+                self._schedule(self.access_token_ttl * self.refresh_ratio)
+            else:
+                self.retry_after = time.monotonic() + self.retry_interval
+                self._schedule(self.retry_interval)
+            return success, data
+
+    def _schedule(self, delay: float):
+        if self.timer is not None:
+            self.timer.cancel()
+        if self.closed:
+            return
+        self.timer = Timer(delay, self._refresh_in_background)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def _refresh_in_background(self):
+        if self.closed:
+            return
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.error(f"Refresh access token error: {e}")
+
+    def close(self):
+        """Stop refreshing the token."""
+        # a login in progress is not waited for, it schedules nothing once closed
+        self.closed = True
+        if self.timer is not None:
+            self.timer.cancel()
+
 
 class NacosClient:
     def __init__(
-        self, ip, port, username: str = None, password: str = None, https: bool = False
+        self,
+        ip,
+        port,
+        username: str = None,
+        password: str = None,
+        https: bool = False,
+        pool_size: int = 10,
+        timeout: float | tuple = (3, 10),
+        retries: int = 3,
+        backoff_factor: float = 0.5,
+        snapshot_path: str = None,
     ):
+        """Nacos open api client
+
+        Nothing is requested on construction, the first request logs in.
+
+        Args:
+            ip (str): nacos address
+            port (int): nacos port
+            username (str, optional): username. Defaults to None.
+            password (str, optional): password. Defaults to None.
+            https (bool, optional): use https or not. Defaults to False.
+            pool_size (int, optional): max kept-alive connections of the session. Defaults to 10.
+            timeout (float | tuple, optional): default (connect, read) timeout of requests in seconds. Defaults to (3, 10).
+            retries (int, optional): retry times on connection error or 502/503/504. Defaults to 3.
+            backoff_factor (float, optional): retry backoff, sleep {backoff_factor} * (2 ** retry) seconds. Defaults to 0.5.
+            snapshot_path (str, optional): dir of the local snapshots of the fetched configs, see config_snapshot_get. Defaults to None (no snapshot).
+        """
         self.openapi_nacos_version = "2.3.2"
         self.ip = ip
         self.port = port
@@ -18,30 +155,88 @@ class NacosClient:
         self.username = username
         self.password = password
         self.base_url = f"{'https' if https else 'http'}://{ip}:{port}/nacos/v1"
-        self.access_token = None
-        self.access_token_ttl = 0  # seconds
-        self.global_admin = False
-        self.login_timestamp = 0  # seconds
+        self.token_manager = NacosTokenManager(self._login)
         self.status_green = False
-        self.login()
+        self.timeout = timeout
+        self.request_count = 0
+        self.request_count_lock = Lock()
+        self.snapshot_path = snapshot_path
+        self.snapshot_md5 = (
+            {}
+        )  # (data_id, group, tenant) -> md5 of the snapshot written
+        self.session = requests.Session()
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(502, 503, 504),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, max_retries=retry
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # 502/503/504 are only retried for the idempotent methods, and for the POSTs
+        # of login and listener which change nothing (same connection pool)
+        post_adapter = HTTPAdapter(max_retries=retry.new(allowed_methods=None))
+        post_adapter.poolmanager = adapter.poolmanager
+        for uri in ("auth/login", "cs/configs/listener"):
+            self.session.mount(f"{self.base_url}/{uri}", post_adapter)
+
+    def close(self):
+        """Close the kept-alive connections and stop refreshing the token."""
+        self.token_manager.close()
+        self.session.close()
+
+    def connection_stats(self):
+        """Get the statistics of connection reuse.
+
+        Returns:
+            dict: {"requests": requests sent, "connections": connections opened, "reused": requests sent over a reused connection}
+        """
+        connections = 0
+        # the adapters share the same pool manager
+        poolmanagers = {
+            id(a.poolmanager): a.poolmanager for a in self.session.adapters.values()
+        }
+        for poolmanager in poolmanagers.values():
+            pools = poolmanager.pools
+            for key in pools.keys():
+                connections += pools[key].num_connections
+        return {
+            "requests": self.request_count,
+            "connections": connections,
+            "reused": max(self.request_count - connections, 0),
+        }
 
-    def _request(self, method, uri, ret_type: str = "json", **kwargs):
+    def _request(
+        self, method, uri, ret_type: str = "json", retry_login: bool = True, **kwargs
+    ):
         # check params
         if "params" not in kwargs:
             kwargs["params"] = {}
         # add access token
-        if self.access_token is not None:
-            kwargs["params"]["accessToken"] = self.access_token
+        generation = self.token_manager.generation
+        if uri != "auth/login" and self.username is not None:
+            access_token = self.token_manager.get()
+            if access_token is not None:
+                kwargs["params"]["accessToken"] = access_token
         # check bool params
         kwargs["params"] = {
             k: (str(v).lower() if isinstance(v, bool) else v)
             for k, v in kwargs["params"].items()
         }
         logger.debug(f"Requesting {method} {uri} with params {kwargs}")
+        timeout = kwargs.pop("timeout", self.timeout)
         # do request
         try:
-            response = requests.request(
-                method=method, url=f"{self.base_url}/{uri}", **kwargs
+            with self.request_count_lock:
+                self.request_count += 1
+            response = self.session.request(
+                method=method, url=f"{self.base_url}/{uri}", timeout=timeout, **kwargs
             )
         except Exception as e:
             logger.error(f"Request failed with error: {e}")
@@ -52,12 +247,24 @@ class NacosClient:
             msg = f"Request failed with status code [{response.status_code}] and response: [{response.text}]"
             logger.error(msg)
             self.status_green = False
-            # check access token timeout
-            if self.login_timestamp + self.access_token_ttl <= int(time.time()):
-                logger.warning("Access token expired, retrying login...")
-                success, data = self.login()
+            # the token is refreshed ahead of its expiry, a rejected token was revoked by nacos
+            if (
+                retry_login
+                and uri != "auth/login"
+                and self.username is not None
+                and response.status_code in (401, 403)
+            ):
+                logger.warning("Access token rejected, retrying login...")
+                success, data = self.token_manager.refresh(generation)
                 if success:
-                    return self._request(method, uri, **kwargs)
+                    return self._request(
+                        method,
+                        uri,
+                        ret_type=ret_type,
+                        retry_login=False,
+                        timeout=timeout,
+                        **kwargs,
+                    )
             return False, msg
         logger.debug(response)
         # parse response
@@ -68,47 +275,49 @@ class NacosClient:
         self.status_green = True
         return True, data
 
+    def _login(self):
+        """request a new access token (blocking), called by the token manager"""
+        method = "POST"
+        uri = "auth/login"
+        params = {"username": self.username, "password": self.password}
+        # connection errors are retried with backoff by the session
+        success, data = self._request(method, uri, params=params)
+        logger.debug(f"Login result: {success}")
+        if not success:
+            logger.error(f"Login failed: {data}")
+        return success, data
+
     def login(self, username: str = None, password: str = None):
+        """Login now, a login in progress in another thread is joined instead.
+
+        Returns:
+            success, data: True and login result or False and msg
+        """
         if username is not None and password is not None:
             self.username = username
             self.password = password
         if self.username is None or self.password is None:
             return False, "Username and password are required for login"
-        self.login_timestamp = 0
-        self.access_token = None
-        self.access_token_ttl = 0
-        self.global_admin = False
-        method = "POST"
-        uri = "auth/login"
-        params = {"username": self.username, "password": self.password}
-        login_timestamp = int(time.time())
-        success, data = self._request(method, uri, params=params)
-        logger.debug(f"Login result: {success}, data: {data}")
-        count = 1
-        while not success and count <= 3:
-            logger.error(f"Login failed [the {count} time(s)]: {data}")
-            time.sleep(3)
-            count += 1
-            logger.warning(f"Retry login [the {count} time(s)]...")
-            login_timestamp = int(time.time())
-            success, data = self._request(method, uri, params=params)
-        if success:
-            self.login_timestamp = login_timestamp
-            self.access_token = data["accessToken"]
-            self.access_token_ttl = data["tokenTtl"]
-            self.global_admin = data["globalAdmin"]
-            self.status_green = True
-        else:
-            logger.error(f"Login failed [the {count} time(s)]: {data}")
-            self.login_timestamp = login_timestamp
-            self.access_token = None
-            self.access_token_ttl = 0
-            self.global_admin = False
-        return success, data
+        return self.token_manager.refresh()
+
+    @property
+    def access_token(self):
+        return self.token_manager.access_token
+
+    @property
+    def global_admin(self):
+        return self.token_manager.global_admin
 
     def alive(self):
         return self.status_green
 
+    def _listen_timeout(self, pulling_timeout: int):
+        """Request timeout of long pulling, the read timeout must outlast the pulling timeout."""
+        connect_timeout, read_timeout = (
+            self.timeout if isinstance(self.timeout, tuple) else (self.timeout,) * 2
+        )
+        return (connect_timeout, pulling_timeout / 1000 + read_timeout)
+
     def config_get(self, data_id: str, group: str, tenant: str = None):
         """get config from nacos
 
@@ -125,8 +334,79 @@ class NacosClient:
         params = {"dataId": data_id, "group": group, "tenant": tenant}
         success, data = self._request(method, uri, ret_type="text", params=params)
         logger.debug(f"Get config result: {success}, data: {data}")
+        if success and self.snapshot_path is not None:
+            self._config_snapshot_set(data_id, group, tenant, data)
         return success, data
 
+    def _config_snapshot_file(self, data_id: str, group: str, tenant: str = None):
+        names = (tenant or "public", group, data_id)
+        if not all(NACOS_SNAPSHOT_NAME.fullmatch(name) for name in names) or any(
+            name in (".", "..") for name in names
+        ):
+            return None
+        return os.path.join(self.snapshot_path, *names[:2], f"{data_id}.json")
+
+    def _config_snapshot_set(self, data_id: str, group: str, tenant: str, content: str):
+        """write the snapshot of a fetched config, skipped if its md5 is unchanged"""
+        key = (data_id, group, tenant or None)
+        md5 = hashlib.md5(content.encode("utf-8")).hexdigest()
+        if self.snapshot_md5.get(key) == md5:
+            return
+        filepath = self._config_snapshot_file(data_id, group, tenant)
+        if filepath is None:
+            logger.warning(f"Skip snapshot of config {tenant}/{group}/{data_id}")
+            return
+        snapshot = {
+            "dataId": data_id,
+            "group": group,
+            "tenant": tenant or "",
+            "md5": md5,
+            "timestamp": int(time.time()),
+            "content": content,
+        }
+        try:
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            tmp_file = f"{filepath}.tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_file, filepath)
+            self.snapshot_md5[key] = md5
+        except OSError as e:
+            logger.error(f"Write snapshot of config {data_id} error: {e}")
+
+    def config_snapshot_get(self, data_id: str, group: str, tenant: str = None):
+        """get the local snapshot of a config, the content last fetched from nacos
+
+        Args:
+            data_id (str): config id
+            group (str): config group
+            tenant (str, optional): tenant namespace. Defaults to None.
+
+        Returns:
+            success, data: True and {"content", "md5", "timestamp"} or False and msg
+        """
+        if self.snapshot_path is None:
+            return False, "Snapshot is disabled"
+        filepath = self._config_snapshot_file(data_id, group, tenant)
+        if filepath is None or not os.path.isfile(filepath):
+            return False, f"No snapshot of config {data_id}"
+        try:
+            with open(filepath, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            content = snapshot["content"]
+            if hashlib.md5(content.encode("utf-8")).hexdigest() != snapshot["md5"]:
+                return False, f"Snapshot of config {data_id} is corrupted"
+            self.snapshot_md5[(data_id, group, tenant or None)] = snapshot["md5"]
+            return True, {
+                "content": content,
+                "md5": snapshot["md5"],
+                "timestamp": snapshot["timestamp"],
+            }
+        except Exception as e:
+            msg = f"Read snapshot of config {data_id} error: {e}"
+            logger.error(msg)
+            return False, msg
+
     def config_listen(
         self,
         data_id: str,
@@ -166,13 +446,24 @@ class NacosClient:
             )
         params = {"Listening-Configs": listening_configs}
         headers = {"Long-Pulling-Timeout": str(pulling_timeout)}
+        timeout = self._listen_timeout(pulling_timeout)
         success, data = self._request(
-            method, uri, ret_type="text", params=params, headers=headers
+            method,
+            uri,
+            ret_type="text",
+            params=params,
+            headers=headers,
+            timeout=timeout,
         )
         logger.debug(f"Listen config result: {success}, data: {data}")
         while listen_until_change and success and data == "":
             success, data = self._request(
-                method, uri, ret_type="text", params=params, headers=headers
+                method,
+                uri,
+                ret_type="text",
+                params=params,
+                headers=headers,
+                timeout=timeout,
             )
             logger.debug(f"Listen config result: {success}, data: {data}")
         if success and data != "":
@@ -180,6 +471,58 @@ class NacosClient:
                 return self.config_get(data_id, group, tenant)
         return success, data
 
+    def config_listen_batch(
+        self, configs: list, pulling_timeout: int = 30000, no_hangup: bool = False
+    ):
+        """Listen changes of several configs in one long pulling. (Thread blocking)
+
+        Args:
+            configs (list): configs to listen, list of (data_id, group, content_md5, tenant), tenant can be None
+            pulling_timeout (int, optional): Long rotation training waiting for 30 seconds, fill in 30000 here. Defaults to 30000.
+            no_hangup (bool, optional): return immediately even if no config changed. Defaults to False.
+
+        Returns:
+            success, data: True and changed configs (list of (data_id, group, tenant), empty if no change before timeout) or False and msg
+        """
+        method = "POST"
+        uri = "cs/configs/listener"
+        char2 = chr(2)
+        char1 = chr(1)
+        listening_configs = ""
+        for data_id, group, content_md5, tenant in configs:
+            if tenant:
+                listening_configs += (
+                    f"{data_id}{char2}{group}{char2}{content_md5}{char2}{tenant}{char1}"
+                )
+            else:
+                listening_configs += (
+                    f"{data_id}{char2}{group}{char2}{content_md5}{char1}"
+                )
+        # sent as a form, thousands of configs overflow the url limit of nacos
+        form = {"Listening-Configs": listening_configs}
+        headers = {"Long-Pulling-Timeout": str(pulling_timeout)}
+        if no_hangup:
+            headers["Long-Pulling-No-Hangup"] = "true"
+        success, data = self._request(
+            method,
+            uri,
+            ret_type="text",
+            data=form,
+            headers=headers,
+            timeout=self._listen_timeout(pulling_timeout),
+        )
+        logger.debug(f"Listen configs result: {success}, data: {data}")
+        if not success:
+            return success, data
+        changed = []
+        for item in unquote(data.strip()).split(char1):
+            if item == "":
+                continue
+            fields = item.split(char2)
+            tenant = fields[2] if len(fields) > 2 and fields[2] != "" else None
+            changed.append((fields[0], fields[1], tenant))
+        return True, changed
+
     def config_publish(
         self,
         data_id: str,
@@ -635,7 +978,7 @@ class NacosClient:
             service_name (str): service name
             ip (str): ip
             port (int): port
-            beat (str): Instance heartbeat content, is the "instance detail" in fact, str of json or dict
+            beat (str): Instance heartbeat content, is the "instance detail" in fact, str of json or dict, None for a light beat (lightBeatEnabled)
             ephemeral (bool, optional): ephemeral. Defaults to None.
             group_name (str, optional): group name. Defaults to None.
             namespace_id (str, optional): namespace id. Defaults to None.
@@ -654,7 +997,7 @@ class NacosClient:
             "serviceName": service_name,
             "ip": ip,
             "port": port,
-            "beat": beat if type(beat) == str else json.dumps(beat),
+            "beat": beat if beat is None or type(beat) == str else json.dumps(beat),
             "ephemeral": ephemeral,
             "groupName": group_name,
             "namespaceId": namespace_id,
@@ -1124,3 +1467,170 @@ class NacosClient:
             data = data == "true"
         logger.debug(f"Namespace delete result: {success}, data: {data}")
         return success, data
+
+
+class NacosConfigListener:
+    def __init__(
+        self, nacos: NacosClient, batch_size: int = 3000, concurrency: int = 1
+    ):
+        """Batched listener of config changes, which keeps the md5 table of the watched configs.
+
+        Args:
+            nacos (NacosClient): nacos client
+            batch_size (int, optional): max configs in one long pulling, the per-request limit of nacos server. Defaults to 3000.
+            concurrency (int, optional): max concurrent requests to fetch configs. Defaults to 1.
+        """
+        self.nacos = nacos
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.md5 = {}  # (data_id, group, tenant) -> md5 of the config on nacos
+        self.contents = {}  # (data_id, group, tenant) -> content fetched on change
+        self.polls = {}  # chunk -> future of its long pulling in flight
+
+    @staticmethod
+    def key(data_id: str, group: str, tenant: str = None):
+        return (data_id, group, tenant or None)
+
+    def _fetch_md5(self, key):
+        data_id, group, tenant = key
+        success, content = self.nacos.config_get(data_id, group, tenant)
+        if not success:
+            # nacos takes empty md5 as the md5 of a config not existed
+            self.contents.pop(key, None)
+            return ""
+        self.contents[key] = content
+        return hashlib.md5(content.encode("utf-8")).hexdigest()
+
+    def _fetch_md5_many(self, keys: list):
+        """Fetch the md5 of configs with at most concurrency requests in flight."""
+        if self.concurrency <= 1 or len(keys) <= 1:
+            return [self._fetch_md5(key) for key in keys]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            return list(executor.map(self._fetch_md5, keys))
+
+    def watch(self, entries, unwatch: bool = True):
+        """Set the watched configs.
+
+        Args:
+            entries (iterable): (data_id, group, tenant, md5), md5 can be None to fetch it from nacos
+            unwatch (bool, optional): unwatch the configs not in entries. Defaults to True.
+        """
+        md5 = {}
+        for data_id, group, tenant, content_md5 in entries:
+            key = self.key(data_id, group, tenant)
+            if content_md5 is not None:
+                md5[key] = content_md5
+            elif key in self.md5:
+                md5[key] = self.md5[key]
+            else:
+                md5[key] = None
+        missing = [key for key, value in md5.items() if value is None]
+        md5.update(zip(missing, self._fetch_md5_many(missing)))
+        if not unwatch:
+            self.md5.update(md5)
+            return
+        self.md5 = md5
+        self.contents = {k: v for k, v in self.contents.items() if k in md5}
+
+    def fetch(self, keys: list):
+        """Fetch the content and refresh the md5 of watched configs."""
+        keys = [key for key in keys if key in self.md5]
+        self.md5.update(zip(keys, self._fetch_md5_many(keys)))
+
+    def _long_pull(self, chunks: list, pulling_timeout: int):
+        """long pull the chunks at once, return on the first changes, a failure or all timed out"""
+        polls = {}
+        for chunk in chunks:
+            future = self.polls.get(chunk)
+            # reuse the long pulling in flight, or finished with a result not consumed yet
+            if future is None or (future.done() and future.result() == (True, [])):
+                future = None
+            polls[chunk] = future
+        requests = [chunk for chunk, future in polls.items() if future is None]
+        if requests:
+            executor = ThreadPoolExecutor(max_workers=len(requests))
+            for chunk in requests:
+                polls[chunk] = executor.submit(
+                    self.nacos.config_listen_batch, list(chunk), pulling_timeout
+                )
+            executor.shutdown(wait=False)
+        for future in as_completed(polls.values()):
+            success, data = future.result()
+            if not success or data:
+                break
+        self.polls = {chunk: f for chunk, f in polls.items() if not f.done()}
+        if not success:
+            return False, data
+        changed = []
+        for future in polls.values():
+            if future.done():
+                success, data = future.result()
+                if success:
+                    changed += [self.key(*item) for item in data]
+        return True, changed
+
+    def update(self, data_id: str, group: str, tenant: str = None, content: str = None):
+        """Update the md5 of a watched config from its content known by the caller."""
+        key = self.key(data_id, group, tenant)
+        self.md5[key] = (
+            "" if content is None else hashlib.md5(content.encode("utf-8")).hexdigest()
+        )
+        self.contents.pop(key, None)
+
+    def check(self, fetch: bool = True):
+        """Check the watched configs without hangup.
+
+        Args:
+            fetch (bool, optional): fetch the changed configs and refresh their md5. Defaults to True.
+
+        Returns:
+            success, data: True and changed keys (list of (data_id, group, tenant)) or False and msg
+        """
+        return self.listen(no_hangup=True, fetch=fetch)
+
+    def listen(
+        self, pulling_timeout: int = 30000, no_hangup: bool = False, fetch: bool = True
+    ):
+        """Listen the watched configs until any of them changed or timeout. (Thread blocking)
+
+        Configs are chunked by batch_size and all chunks are long pulled at once, it returns
+        as soon as one of them reports changes. The long pullings still in flight are kept and
+        reused by the next listen while their chunk is unchanged, so at most one long pulling
+        per chunk is in flight. The md5 (and content) of changed configs are refreshed.
+
+        Args:
+            pulling_timeout (int, optional): Long rotation training waiting for 30 seconds, fill in 30000 here. Defaults to 30000.
+            no_hangup (bool, optional): check the chunks one by one without long pulling. Defaults to False.
+            fetch (bool, optional): fetch the changed configs and refresh their md5. Defaults to True.
+
+        Returns:
+            success, data: True and changed keys (list of (data_id, group, tenant)) or False and msg
+        """
+        configs = [
+            (data_id, group, md5, tenant)
+            for (data_id, group, tenant), md5 in self.md5.items()
+        ]
+        if not configs:
+            return (True, []) if no_hangup else (False, "No config to listen")
+        chunks = [
+            tuple(configs[i : i + self.batch_size])
+            for i in range(0, len(configs), self.batch_size)
+        ]
+        changed = []
+        if no_hangup:
+            for chunk in chunks:
+                success, data = self.nacos.config_listen_batch(
+                    list(chunk), pulling_timeout, no_hangup=True
+                )
+                if not success:
+                    return False, data
+                changed += [self.key(*item) for item in data]
+        else:
+            success, data = self._long_pull(chunks, pulling_timeout)
+            if not success:
+                return False, data
+            changed = data
+        changed = [key for key in dict.fromkeys(changed) if key in self.md5]
+        if fetch:
+            self.md5.update(zip(changed, self._fetch_md5_many(changed)))
+        return True, changed
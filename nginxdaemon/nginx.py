@@ -2,11 +2,546 @@
 import time
 import subprocess
 import logging
-import re
+import os
+import signal
+import http.client
+from array import array
+from threading import Lock, RLock
+from urllib.parse import urlsplit
 
 
 logger = logging.getLogger(__name__)
 
+NGINX_SIGNALS = {
+    "stop": signal.SIGTERM,
+    "quit": signal.SIGQUIT,
+    "reopen": signal.SIGUSR1,
+    "reload": signal.SIGHUP,
+}
+
+# signals of the binary upgrade, sent to a given master
+NGINX_UPGRADE_SIGNALS = {
+    "upgrade": signal.SIGUSR2,  # exec the new binary as a new master
+    "winch": signal.SIGWINCH,  # shut down the workers of the old master gracefully
+    "respawn": signal.SIGHUP,  # start the workers of the old master again, without re-reading the config
+    "quit": signal.SIGQUIT,
+    "stop": signal.SIGTERM,
+}
+
+# windows of NginxStatusSeries: name -> seconds
+STATUS_SERIES_WINDOWS = {"1m": 60, "5m": 300, "15m": 900}
+
+
+def parse_stub_status(body: str):
+    """Parse the body of nginx stub_status without regex.
+
+    The layout of stub_status is fixed:
+        Active connections: 291
+        server accepts handled requests
+         16630948 16630948 31070465
+        Reading: 6 Writing: 179 Waiting: 106
+
+    Args:
+        body (str): response body of stub_status
+
+    Returns:
+        dict | None: parsed counters, None if the body is not a stub_status page
+    """
+    lines = body.strip().splitlines()
+    if len(lines) < 4 or not lines[0].startswith("Active connections:"):
+        return None
+    counters = lines[2].split()
+    states = lines[3].split()
+    if len(counters) != 3 or len(states) != 6:
+        return None
+    try:
+        return {
+            "active_connections": int(lines[0][19:]),
+            "server_accepts": int(counters[0]),
+            "server_handled": int(counters[1]),
+            "server_requests": int(counters[2]),
+            "reading": int(states[1]),
+            "writing": int(states[3]),
+            "waiting": int(states[5]),
+        }
+    except ValueError:
+        return None
+
+
+class NginxStatusPoller:
+    def __init__(self, nginx_status_url: str, timeout: float = 2):
+        """In-process poller of nginx stub_status over a keep-alive connection
+
+        The connection is shared by the callers, a fetch holds it until the response is read.
+
+        Args:
+            nginx_status_url (str): the access path for stub_status of nginx
+            timeout (float, optional): connect/read timeout in seconds. Defaults to 2.
+        """
+        self.nginx_status_url = nginx_status_url
+        self.timeout = timeout
+        self.latency = -1  # seconds, latency of the last probe
+        self._conn: http.client.HTTPConnection = None
+        self._conn_url = None
+        self._path = "/"
+        self._lock = RLock()
+
+    def _connect(self):
+        url = urlsplit(self.nginx_status_url)
+        conn_class = (
+            http.client.HTTPSConnection
+            if url.scheme == "https"
+            else http.client.HTTPConnection
+        )
+        self._conn = conn_class(url.hostname, url.port, timeout=self.timeout)
+        self._conn_url = self.nginx_status_url
+        self._path = url.path or "/"
+        if url.query:
+            self._path = f"{self._path}?{url.query}"
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def fetch(self):
+        """Fetch the stub_status page, reconnect once if the kept-alive connection was dropped.
+
+        Returns:
+            success, data: True and response body or False and msg
+        """
+        with self._lock:
+            if self._conn is None or self._conn_url != self.nginx_status_url:
+                self.close()
+                self._connect()
+            start = time.perf_counter()
+            for attempt in range(2):
+                try:
+                    self._conn.request("GET", self._path)
+                    response = self._conn.getresponse()
+                    body = response.read().decode("utf-8", "replace")
+                    self.latency = time.perf_counter() - start
+                    if response.will_close:
+                        self.close()
+                    if response.status != 200:
+                        return False, f"Status code [{response.status}]: {body}"
+                    return True, body
+                except (http.client.HTTPException, OSError) as e:
+                    self.close()
+                    if attempt == 0:
+                        self._connect()
+                        continue
+                    self.latency = time.perf_counter() - start
+                    return False, str(e)
+
+
+class NginxStatusSeries:
+    COUNTERS = ("accepts", "handled", "requests")
+    GAUGES = ("active", "latency")
+
+    def __init__(self, capacity: int = 1024):
+        """Fixed-size ring buffer of timestamped nginx status samples
+
+        The counters are stored cumulatively across nginx restarts (a counter
+        lower than the previous sample means nginx restarted from zero),
+        so the rate of any window is the difference of two samples.
+
+        Args:
+            capacity (int, optional): max samples kept, the oldest is overwritten. Defaults to 1024 (85 minutes at 5s interval).
+        """
+        self.capacity = max(int(capacity), 2)
+        self.lock = Lock()
+        self.timestamps = array("d", bytes(8 * self.capacity))
+        self.columns = {
+            name: array("d", bytes(8 * self.capacity))
+            for name in self.COUNTERS + self.GAUGES
+        }
+        self.scratch = array("d", bytes(8 * self.capacity))  # values of a percentile
+        self.head = 0  # next index to write
+        self.size = 0
+        self.resets = 0
+        self.last_counters = None  # raw counters of the last sample
+
+    def _index(self, i: int):
+        """ring index of the i-th oldest sample"""
+        return (self.head - self.size + i) % self.capacity
+
+    def append(self, nginx_status: dict, timestamp: float = None):
+        """Append a sample of NginxUtils.nginx_status, samples of a dead nginx are skipped.
+
+        Args:
+            nginx_status (dict): nginx status
+            timestamp (float, optional): monotonic timestamp in seconds. Defaults to time.monotonic().
+
+        Returns:
+            bool: appended or not
+        """
+        counters = [nginx_status.get(f"server_{name}", -1) for name in self.COUNTERS]
+        if not nginx_status.get("alive") or min(counters) < 0:
+            return False
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        with self.lock:
+            if self.size and timestamp <= self.timestamps[self._index(self.size - 1)]:
+                return False
+            last = self._index(self.size - 1) if self.size else None
+            reset = self.last_counters is not None and any(
+                current < previous
+                for current, previous in zip(counters, self.last_counters)
+            )
+            if reset:
+                self.resets += 1
+            for name, current, previous in zip(
+                self.COUNTERS, counters, self.last_counters or counters
+            ):
+                column = self.columns[name]
+                base = column[last] if last is not None else 0
+                column[self.head] = base + (current if reset else current - previous)
+            self.columns["active"][self.head] = nginx_status.get(
+                "active_connections", 0
+            )
+            self.columns["latency"][self.head] = max(nginx_status.get("latency", 0), 0)
+            self.timestamps[self.head] = timestamp
+            self.last_counters = counters
+            self.head = (self.head + 1) % self.capacity
+            self.size = min(self.size + 1, self.capacity)
+        return True
+
+    def _bisect(self, timestamp: float, right: bool = False):
+        """first logical index whose timestamp is >= (> if right) timestamp"""
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = self.timestamps[self._index(mid)]
+            if value < timestamp or (right and value == timestamp):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _window(self, window: float, now: float = None):
+        """logical range [first, last] of the samples in [now - window, now]"""
+        now = time.monotonic() if now is None else now
+        return self._bisect(now - window), self._bisect(now, right=True) - 1
+
+    def increase(self, name: str, window: float, now: float = None):
+        """Increase of a counter (accepts/handled/requests) in the window."""
+        with self.lock:
+            first, last = self._window(window, now)
+            if last <= first:
+                return 0
+            column = self.columns[name]
+            return int(column[self._index(last)] - column[self._index(first)])
+
+    def rate(self, name: str, window: float, now: float = None):
+        """Per second rate of a counter (accepts/handled/requests) in the window, 0 with less than 2 samples."""
+        with self.lock:
+            first, last = self._window(window, now)
+            if last <= first:
+                return 0.0
+            first, last = self._index(first), self._index(last)
+            column = self.columns[name]
+            elapsed = self.timestamps[last] - self.timestamps[first]
+            return (column[last] - column[first]) / elapsed
+
+    def percentile(self, name: str, q: float, window: float, now: float = None):
+        """Nearest-rank percentile of a gauge (active/latency) or of the per-interval rates of a counter in the window.
+
+        Args:
+            name (str): gauge or counter name
+            q (float): percentile in [0, 100]
+            window (float): window in seconds
+            now (float, optional): end of the window. Defaults to time.monotonic().
+
+        Returns:
+            float: percentile, 0 without samples
+        """
+        with self.lock:
+            first, last = self._window(window, now)
+            column, values = self.columns[name], self.scratch
+            n = 0
+            if name in self.COUNTERS:
+                for i in range(first + 1, last + 1):
+                    current, previous = self._index(i), self._index(i - 1)
+                    elapsed = self.timestamps[current] - self.timestamps[previous]
+                    values[n] = (column[current] - column[previous]) / elapsed
+                    n += 1
+            else:
+                for i in range(first, last + 1):
+                    values[n] = column[self._index(i)]
+                    n += 1
+            if n == 0:
+                return 0.0
+            rank = max(int(-(-q * n // 100)), 1)  # ceil
+            return self._select(n, min(rank, n) - 1)
+
+    def _select(self, n: int, k: int):
+        """k-th smallest of the first n values of the scratch buffer, partitioned in place (quickselect)"""
+        values = self.scratch
+        lo, hi = 0, n - 1
+        while lo < hi:
+            pivot = values[(lo + hi) // 2]
+            i, j = lo, hi
+            while i <= j:
+                while values[i] < pivot:
+                    i += 1
+                while values[j] > pivot:
+                    j -= 1
+                if i <= j:
+                    values[i], values[j] = values[j], values[i]
+                    i += 1
+                    j -= 1
+            if k <= j:
+                hi = j
+            elif k >= i:
+                lo = i
+            else:
+                break
+        return values[k]
+
+    def summary(self, now: float = None):
+        """Rates, dropped connections and percentiles for every window of STATUS_SERIES_WINDOWS."""
+        now = time.monotonic() if now is None else now
+        summary = {}
+        for window_name, window in STATUS_SERIES_WINDOWS.items():
+            summary[window_name] = {
+                "requests_per_second": self.rate("requests", window, now),
+                "accepts_per_second": self.rate("accepts", window, now),
+                "dropped": self.increase("accepts", window, now)
+                - self.increase("handled", window, now),
+                "requests_per_second_p50": self.percentile("requests", 50, window, now),
+                "requests_per_second_p99": self.percentile("requests", 99, window, now),
+                "active_connections_p99": self.percentile("active", 99, window, now),
+                "latency_p50": self.percentile("latency", 50, window, now),
+                "latency_p99": self.percentile("latency", 99, window, now),
+            }
+        return summary
+
+
+class NginxRestartPolicy:
+    def __init__(
+        self,
+        failure_threshold: int = 3,
+        backoff_base: float = 1,
+        backoff_max: float = 60,
+        crash_loop_limit: int = 5,
+        crash_loop_window: float = 300,
+    ):
+        """Decide when a failing nginx is recovered
+
+        A failure is confirmed by failure_threshold consecutive failed probes,
+        recoveries are spaced by an exponential backoff, and after crash_loop_limit
+        recoveries within crash_loop_window the circuit opens: nothing is tried
+        until the window has passed, then one attempt is allowed (half open).
+
+        Args:
+            failure_threshold (int, optional): consecutive failed probes to confirm a failure. Defaults to 3.
+            backoff_base (float, optional): backoff in seconds after the first recovery. Defaults to 1.
+            backoff_max (float, optional): max backoff in seconds. Defaults to 60.
+            crash_loop_limit (int, optional): recoveries within the window to open the circuit. Defaults to 5.
+            crash_loop_window (float, optional): window in seconds. Defaults to 300.
+        """
+        self.failure_threshold = max(int(failure_threshold), 1)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.crash_loop_limit = max(int(crash_loop_limit), 1)
+        self.crash_loop_window = crash_loop_window
+        self.state = "healthy"  # healthy, suspect, backoff, open
+        self.failures = 0
+        self.recoveries = []  # timestamps of the recoveries within the window
+        self.next_attempt = 0
+        self.open_until = 0
+        self.suspended = False  # e.g. while the binary is upgraded
+
+    def _prune(self, now: float):
+        self.recoveries = [
+            t for t in self.recoveries if now - t < self.crash_loop_window
+        ]
+
+    def observe(self, alive: bool, now: float = None):
+        """Record a probe.
+
+        Args:
+            alive (bool): nginx is serving or not
+            now (float, optional): monotonic timestamp. Defaults to time.monotonic().
+
+        Returns:
+            bool: nginx should be recovered now or not
+        """
+        now = time.monotonic() if now is None else now
+        if self.suspended:
+            return False
+        if alive:
+            self.failures = 0
+            if self.state != "open" or now >= self.open_until:
+                self.state = "healthy"
+            return False
+        self.failures += 1
+        if self.state == "open" and now < self.open_until:
+            return False
+        if self.failures < self.failure_threshold:
+            self.state = "suspect"
+            return False
+        if now < self.next_attempt:
+            self.state = "backoff"
+            return False
+        return True
+
+    def recovered(self, success: bool, now: float = None):
+        """Record a recovery attempt, schedule the next one and open the circuit on a crash loop."""
+        now = time.monotonic() if now is None else now
+        half_open = self.state == "open"
+        self._prune(now)
+        self.recoveries.append(now)
+        backoff = self.backoff_base * 2 ** (len(self.recoveries) - 1)
+        self.next_attempt = now + min(backoff, self.backoff_max)
+        if len(self.recoveries) >= self.crash_loop_limit or (half_open and not success):
+            self.state = "open"
+            self.open_until = now + self.crash_loop_window
+            logger.error(
+                f"Nginx recovered {len(self.recoveries)} times in {self.crash_loop_window}s, "
+                f"stop recovering for {self.crash_loop_window}s"
+            )
+        elif success:
+            self.state = "healthy"
+            self.failures = 0
+        else:
+            self.state = "backoff"
+
+    def suspend(self):
+        """Ignore the probes until resume, e.g. while the binary is upgraded."""
+        self.suspended = True
+
+    def resume(self):
+        """Count the failed probes again, from zero."""
+        self.suspended = False
+        self.failures = 0
+
+    def snapshot(self):
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "recoveries": len(self.recoveries),
+            "suspended": self.suspended,
+        }
+
+
+class NginxReloadScheduler:
+    def __init__(
+        self,
+        debounce: float = 1,
+        min_interval: float = 5,
+        max_delay: float = 30,
+        max_old_workers: int = 16,
+        drain_timeout: float = 300,
+        drain_interval: float = 1,
+    ):
+        """Decide when the requested reloads of nginx are run
+
+        Every reload starts a new worker generation while the old workers drain
+        their connections, so a burst of requests is merged into one reload:
+        it runs debounce seconds after the last request (but at most max_delay
+        after the first one), at least min_interval after the previous reload,
+        and only once at most max_old_workers old workers are still draining,
+        unless they have not drained within drain_timeout.
+
+        Args:
+            debounce (float, optional): quiet seconds after the last request. Defaults to 1.
+            min_interval (float, optional): min seconds between two reloads. Defaults to 5.
+            max_delay (float, optional): max seconds a request is debounced. Defaults to 30.
+            max_old_workers (int, optional): max draining old workers to allow a reload. Defaults to 16.
+            drain_timeout (float, optional): max seconds a request waits for the old workers. Defaults to 300.
+            drain_interval (float, optional): seconds between two checks of the old workers. Defaults to 1.
+        """
+        self.debounce = debounce
+        self.min_interval = min_interval
+        self.max_delay = max_delay
+        self.max_old_workers = max_old_workers
+        self.drain_timeout = drain_timeout
+        self.drain_interval = drain_interval
+        self.state = "idle"  # idle, debounce, throttled, draining, suspended
+        self.suspended = False  # e.g. while the binary is upgraded
+        self.pending = 0  # requests waiting for the next reload
+        self.first_request = None
+        self.last_request = None
+        self.last_reload = None
+        self.reloads = 0
+        self.merged = 0  # requests served by the reload of another one
+
+    def request(self, now: float = None):
+        """Request a reload."""
+        now = time.monotonic() if now is None else now
+        if self.pending == 0:
+            self.first_request = now
+        self.pending += 1
+        self.last_request = now
+
+    def due(self, old_workers: int = 0, now: float = None):
+        """Check if the requested reload can run.
+
+        Args:
+            old_workers (int, optional): old workers still draining. Defaults to 0.
+            now (float, optional): monotonic timestamp. Defaults to time.monotonic().
+
+        Returns:
+            float | None: 0 to reload now, seconds to wait before checking again, None if no reload is requested
+        """
+        now = time.monotonic() if now is None else now
+        if self.pending == 0:
+            self.state = "idle"
+            return None
+        if self.suspended:
+            self.state = "suspended"
+            return self.drain_interval
+        settled = min(
+            self.last_request + self.debounce, self.first_request + self.max_delay
+        )
+        allowed = settled
+        if self.last_reload is not None:
+            allowed = max(settled, self.last_reload + self.min_interval)
+        if now < allowed:
+            self.state = "debounce" if allowed == settled else "throttled"
+            return allowed - now
+        if (
+            old_workers > self.max_old_workers
+            and now < self.first_request + self.drain_timeout
+        ):
+            self.state = "draining"
+            return self.drain_interval
+        return 0
+
+    def suspend(self):
+        """Hold the requested reloads until resume, e.g. while the binary is upgraded."""
+        self.suspended = True
+
+    def resume(self):
+        self.suspended = False
+
+    def begin(self):
+        """Take the pending requests for the reload about to run, return their number."""
+        batch = self.pending
+        self.pending = 0
+        self.first_request = None
+        return batch
+
+    def reloaded(self, success: bool, batch: int, now: float = None):
+        """Record a reload run for batch requests, the requests during the reload wait for the next one."""
+        now = time.monotonic() if now is None else now
+        self.last_reload = now
+        self.reloads += 1
+        self.merged += max(batch - 1, 0)
+        self.state = "idle" if self.pending == 0 else "debounce"
+        if batch > 1:
+            logger.info(f"Merged {batch} reload requests into one reload: {success}")
+
+    def snapshot(self):
+        return {
+            "state": self.state,
+            "pending": self.pending,
+            "reloads": self.reloads,
+            "merged": self.merged,
+        }
+
 
 class NginxUtils:
     def __init__(
@@ -14,6 +549,8 @@ class NginxUtils:
         nginx_runner_path,
         nginx_context_path,
         nginx_status_url: str = "http://localhost/status",
+        nginx_pid_path: str = None,
+        nginx_error_log_path: str = None,
     ):
         """_summary_
 
@@ -21,6 +558,8 @@ class NginxUtils:
             nginx_runner_path (str): nginx runner path (bin file)
             nginx_context_path (str): nginx context path (conf dir, equal to nginx -p $nginx_context_path)
             nginx_status_url (_type_, optional): the access path for stub_status of nginx. Defaults to "http://127.0.0.1/status".
+            nginx_pid_path (str, optional): pid file of nginx master. Defaults to $nginx_context_path/logs/nginx.pid.
+            nginx_error_log_path (str, optional): error log of nginx, where a rejected reload is reported. Defaults to $nginx_context_path/logs/error.log.
         """
         self.nginx = nginx_runner_path
         self.nginx_context_path = nginx_context_path
@@ -37,6 +576,16 @@ class NginxUtils:
         self.nginx_writing = -1
         self.nginx_waiting = -1
         self.nginx_status_url = nginx_status_url
+        self.nginx_status_latency = -1  # seconds
+        self.status_poller = NginxStatusPoller(nginx_status_url)
+        self.status_series = NginxStatusSeries()
+        self.nginx_pid_path = nginx_pid_path or os.path.join(
+            nginx_context_path, "logs", "nginx.pid"
+        )
+        self.nginx_error_log_path = nginx_error_log_path or os.path.join(
+            nginx_context_path, "logs", "error.log"
+        )
+        self.nginx_pid = None  # cached pid of nginx master
 
     def _run_command(self, command):
         """Run an Nginx command and return the output."""
@@ -48,6 +597,95 @@ class NginxUtils:
         except Exception as e:
             return False, str(e)
 
+    def _read_pid(self):
+        """Read the pid of nginx master from the pid file."""
+        try:
+            with open(self.nginx_pid_path, "r") as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def _is_master(self, pid):
+        """Check the pid is a running nginx master rather than a reused pid."""
+        if pid is None or pid <= 0:
+            return False
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                return f.read().startswith(b"nginx: master process")
+        except FileNotFoundError:
+            if os.path.isdir("/proc/self"):
+                return False
+        except OSError:
+            return False
+        # no procfs, fallback to check the pid exists only
+        try:
+            os.kill(pid, 0)
+            return True
+        except OSError:
+            return False
+
+    def master_pid(self):
+        """Get the pid of nginx master, the pid file is only re-read when the cached pid is stale."""
+        if self._is_master(self.nginx_pid):
+            return self.nginx_pid
+        pid = self._read_pid()
+        self.nginx_pid = pid if self._is_master(pid) else None
+        return self.nginx_pid
+
+    def _workers(self, pid):
+        """(pid, title) of the workers of the master pid, empty without procfs"""
+        try:
+            entries = os.listdir("/proc")
+        except OSError:
+            return []
+        workers = []
+        for entry in entries:
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat", "rb") as f:
+                    stat = f.read()
+                # pid (comm) state ppid ..., comm may contain spaces
+                if int(stat[stat.rindex(b")") + 1 :].split()[1]) != pid:
+                    continue
+                with open(f"/proc/{entry}/cmdline", "rb") as f:
+                    title = f.read().split(b"\0", 1)[0]
+                if title.startswith(b"nginx: worker process"):
+                    workers.append((int(entry), title))
+            except (OSError, ValueError):
+                continue
+        return workers
+
+    def old_workers(self):
+        """pids of the workers of the previous generations still draining, empty without procfs"""
+        pid = self.master_pid()
+        if pid is None:
+            return []
+        return [
+            worker
+            for worker, title in self._workers(pid)
+            if title.startswith(b"nginx: worker process is shutting down")
+        ]
+
+    def _signal(self, name):
+        """Send a signal (stop, quit, reopen, reload) to nginx master.
+
+        The signal is sent by os.kill to the pid cached from the pid file,
+        the command line "nginx -s" is only used when the pid is stale.
+        """
+        pid = self.master_pid()
+        if pid is not None:
+            try:
+                os.kill(pid, NGINX_SIGNALS[name])
+                logger.debug(f"==== signal  ==== {name} -> {pid}")
+                if name in ("stop", "quit"):
+                    self.nginx_pid = None
+                return True, ""
+            except OSError as e:
+                logger.warning(f"Failed to signal Nginx master {pid}: {e}")
+                self.nginx_pid = None
+        return self._run_command(f"{self.nginx_cmd} -s {name}")
+
     def start(self):
         """Start the Nginx service."""
         success, output = self._run_command(f"{self.nginx_cmd}")
@@ -59,7 +697,7 @@ class NginxUtils:
 
     def stop(self):
         """Stop the Nginx service."""
-        success, output = self._run_command(f"{self.nginx_cmd} -s stop")
+        success, output = self._signal("stop")
         if success:
             logger.info("Nginx stopped successfully.")
         else:
@@ -73,33 +711,147 @@ class NginxUtils:
         so it will ensure that all buffer data is sent,
         all logs are written, and all resources are properly released.
         """
-        success, output = self._run_command(f"{self.nginx_cmd} -s quit")
+        success, output = self._signal("quit")
         if success:
             logger.info("Nginx quit successfully.")
         else:
             logger.error(f"Failed to quit Nginx: {output}")
         return success
 
-    def restart(self):
-        """Restart the Nginx service."""
+    def _wait(self, predicate, timeout: float, interval: float = 0.05):
+        """Poll predicate until it is true or timeout, return the last result."""
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(interval)
+        return True
+
+    def _serving(self):
+        success, output = self.status_poller.fetch()
+        return success and "Active" in output
+
+    def wait_stopped(self, pid=None, timeout: float = 10):
+        """Wait until the nginx master exited.
+
+        Args:
+            pid (int, optional): pid of the master. Defaults to the current master.
+            timeout (float, optional): timeout in seconds. Defaults to 10.
+
+        Returns:
+            bool: stopped or not
+        """
+        pid = self.master_pid() if pid is None else pid
+        return self._wait(lambda: not self._is_master(pid), timeout)
+
+    def wait_ready(self, timeout: float = 10):
+        """Wait until the nginx master is running and stub_status answers.
+
+        Args:
+            timeout (float, optional): timeout in seconds. Defaults to 10.
+
+        Returns:
+            bool: ready or not
+        """
+        self.status_poller.nginx_status_url = self.nginx_status_url
+        return self._wait(
+            lambda: self.master_pid() is not None and self._serving(), timeout
+        )
+
+    def restart(self, timeout: float = 10):
+        """Restart the Nginx service, waiting for the old master to exit and the new one to serve."""
         logger.info("Restarting Nginx...")
-        s1 = self.stop()
-        time.sleep(3)  # Wait for Nginx to fully stop
-        s2 = self.start()
-        return s2
-
-    def reload(self):
-        """Reload the Nginx configuration."""
-        success, output = self._run_command(f"{self.nginx_cmd} -s reload")
+        pid = self.master_pid()
+        if pid is not None:
+            self.stop()
+            if not self.wait_stopped(pid, timeout):
+                logger.error(f"Nginx master {pid} did not stop in {timeout}s")
+                return False
+        if not self.start():
+            return False
+        ready = self.wait_ready(timeout)
+        if not ready:
+            logger.error(f"Nginx is not ready in {timeout}s after start")
+        return ready
+
+    def recover(self, timeout: float = 10):
+        """Recover a nginx which is not serving, with the cheapest action first.
+
+        A running master is reloaded (the workers are respawned), nginx is started
+        if the master is gone, and restarted only if it is still not serving.
+
+        Args:
+            timeout (float, optional): readiness timeout in seconds of each action. Defaults to 10.
+
+        Returns:
+            success, action: ready or not and the last action tried (reload, start or restart)
+        """
+        if self.master_pid() is not None:
+            if self.reload() and self.wait_ready(min(timeout, 2)):
+                logger.info("Nginx recovered by reload")
+                return True, "reload"
+            return self.restart(timeout), "restart"
+        if self.start() and self.wait_ready(timeout):
+            logger.info("Nginx recovered by start")
+            return True, "start"
+        # a stale master may still hold the listening sockets
+        return self.restart(timeout), "restart"
+
+    def _error_log_offset(self):
+        try:
+            return os.path.getsize(self.nginx_error_log_path)
+        except OSError:
+            return 0
+
+    def _error_log_emerg(self, offset: int):
+        """[emerg] lines written to the error log since offset"""
+        try:
+            with open(self.nginx_error_log_path, "rb") as f:
+                f.seek(offset)
+                lines = f.read().splitlines()
+        except OSError:
+            return []
+        return [line.decode(errors="replace") for line in lines if b"[emerg]" in line]
+
+    def reload(self, timeout: float = 10):
+        """Reload the Nginx configuration and check the master took it.
+
+        The reload failed if the master logged [emerg] since the signal, e.g. a config
+        it rejected, and succeeded once a new generation of workers listens.
+        Without visible workers (no procfs) only the error log is checked.
+
+        Args:
+            timeout (float, optional): timeout in seconds for the new workers. Defaults to 10.
+        """
+        pid = self.master_pid()
+        workers = set(self._listening_workers(pid)) if pid is not None else set()
+        offset = self._error_log_offset()
+        success, output = self._signal("reload")
+        deadline = time.monotonic() + timeout
+        while success:
+            emerg = self._error_log_emerg(offset)
+            if emerg:
+                success, output = False, emerg[-1]
+            elif not workers or set(self._listening_workers(pid)) - workers:
+                break
+            elif time.monotonic() >= deadline:
+                success, output = False, f"no new workers in {timeout}s"
+            else:
+                time.sleep(0.05)
         if success:
             logger.info("Nginx configuration reloaded successfully.")
         else:
             logger.error(f"Failed to reload Nginx configuration: {output}")
         return success
 
-    def test_config(self):
-        """Test the Nginx configuration."""
-        success, output = self._run_command(f"{self.nginx_cmd} -t")
+    def test_config(self, conf_file: str = None):
+        """Test the Nginx configuration.
+
+        Args:
+            conf_file (str, optional): configuration file to test instead of conf/nginx.conf. Defaults to None.
+        """
+        conf_arg = f" -c {conf_file}" if conf_file is not None else ""
+        success, output = self._run_command(f"{self.nginx_cmd} -t{conf_arg}")
         if "successful" in output:
             logger.info("Nginx configuration test passed.")
             return True
@@ -107,9 +859,109 @@ class NginxUtils:
             logger.error(f"Nginx configuration test failed: {output}")
         return False
 
+    def _upgrade_signal(self, pid, name):
+        try:
+            os.kill(pid, NGINX_UPGRADE_SIGNALS[name])
+            logger.debug(f"==== signal  ==== {name} -> {pid}")
+            return True
+        except OSError as e:
+            logger.error(f"Failed to signal {name} to Nginx master {pid}: {e}")
+            return False
+
+    def _new_master_pid(self, old_pid):
+        """pid of the new master once both pid files are written by the upgrade"""
+        try:
+            with open(f"{self.nginx_pid_path}.oldbin", "r") as f:
+                if int(f.read().strip()) != old_pid:
+                    return None
+        except (OSError, ValueError):
+            return None
+        pid = self._read_pid()
+        return pid if pid != old_pid and self._is_master(pid) else None
+
+    def _healthy(self, pid, timeout: float):
+        """the master keeps running and stub_status answers"""
+        return self.wait_ready(timeout) and self._is_master(pid)
+
+    def _listening_workers(self, pid):
+        """pids of the workers of the master pid still accepting connections"""
+        return [
+            worker
+            for worker, title in self._workers(pid)
+            if title == b"nginx: worker process"
+        ]
+
+    def upgrade(self, timeout: float = 10):
+        """Upgrade to the nginx binary on disk without dropping connections.
+
+        USR2 starts the new binary as a new master, WINCH drains the workers
+        of the old master, and the old master is quit once the new one serves.
+        The new master is only probed after the old workers closed their
+        listening sockets, as they would answer the probe on the shared sockets.
+        The old master takes over again (HUP) and the new one is quit if the
+        new master fails to start or to serve.
+
+        Args:
+            timeout (float, optional): timeout in seconds of each step. Defaults to 10.
+
+        Returns:
+            bool: upgraded or not
+        """
+        old_pid = self.master_pid()
+        if old_pid is None:
+            logger.error("Failed to upgrade Nginx: Nginx is not running")
+            return False
+        logger.info(f"Upgrading Nginx master {old_pid}...")
+        if not self._upgrade_signal(old_pid, "upgrade"):
+            return False
+        new_pid = None
+
+        def started():
+            nonlocal new_pid
+            new_pid = self._new_master_pid(old_pid)
+            return new_pid is not None
+
+        if not self._wait(started, timeout):
+            logger.error(f"Failed to upgrade Nginx: no new master in {timeout}s")
+            return self._rollback_upgrade(old_pid, None, drained=False)
+        logger.info(f"New Nginx master {new_pid} started")
+        self._upgrade_signal(old_pid, "winch")
+        # only the new workers serve from now on
+        self.nginx_pid = new_pid
+        if not self._wait(lambda: not self._listening_workers(old_pid), timeout):
+            logger.error(
+                f"Failed to upgrade Nginx: old workers of {old_pid} still listening"
+            )
+            return self._rollback_upgrade(old_pid, new_pid, drained=True)
+        if not self._healthy(new_pid, timeout):
+            logger.error(f"Failed to upgrade Nginx: new master {new_pid} not serving")
+            return self._rollback_upgrade(old_pid, new_pid, drained=True)
+        self._upgrade_signal(old_pid, "quit")
+        if not self.wait_stopped(old_pid, timeout):
+            logger.warning(f"Old Nginx master {old_pid} is still draining")
+        logger.info(f"Nginx upgraded successfully, master {old_pid} -> {new_pid}")
+        return True
+
+    def _rollback_upgrade(self, old_pid, new_pid, drained: bool):
+        """give the service back to the old master, return False"""
+        logger.info(f"Rolling back Nginx upgrade to master {old_pid}...")
+        if drained:
+            self._upgrade_signal(old_pid, "respawn")
+        if new_pid is None:
+            new_pid = self._new_master_pid(old_pid)
+        if new_pid is not None:
+            self._upgrade_signal(new_pid, "quit")
+            if not self.wait_stopped(new_pid, 5):
+                self._upgrade_signal(new_pid, "stop")
+        # the old master renames nginx.pid.oldbin back once the new master exited
+        self.nginx_pid = old_pid if self._is_master(old_pid) else None
+        if self.nginx_pid is None:
+            logger.error(f"Old Nginx master {old_pid} is gone after rollback")
+        return False
+
     def reopen(self):
         """Reopen the Nginx logs."""
-        success, output = self._run_command(f"{self.nginx_cmd} -s reopen")
+        success, output = self._signal("reopen")
         if success:
             logger.info("Nginx logs reopened successfully.")
         else:
@@ -138,7 +990,9 @@ class NginxUtils:
 
     def alive(self):
         """Check if Nginx is alive."""
-        success, output = self._run_command(f"curl {self.nginx_status_url}")
+        self.status_poller.nginx_status_url = self.nginx_status_url
+        success, output = self.status_poller.fetch()
+        self.nginx_status_latency = self.status_poller.latency
         if success:
             if output.count("Active") > 0:
                 self.nginx_alive = True
@@ -153,18 +1007,19 @@ class NginxUtils:
 
     def status(self):
         """Get the Nginx status."""
-        success, output = self._run_command(f"curl {self.nginx_status_url}")
+        self.status_poller.nginx_status_url = self.nginx_status_url
+        success, output = self.status_poller.fetch()
+        self.nginx_status_latency = self.status_poller.latency
         if success:
-            pattern = r"Active connections: (\d+)\s*.*\s*server accepts handled requests\s*(\d+)\s*(\d+)\s*(\d+)\s*Reading: (\d+)\s*Writing: (\d+)\s*Waiting: (\d+)"
-            match = re.search(pattern, output)
-            if match:
-                active_connections = int(match.group(1))
-                server_accepts = int(match.group(2))
-                server_handled = int(match.group(3))
-                server_requests = int(match.group(4))
-                reading = int(match.group(5))
-                writing = int(match.group(6))
-                waiting = int(match.group(7))
+            data = parse_stub_status(output)
+            if data:
+                active_connections = data["active_connections"]
+                server_accepts = data["server_accepts"]
+                server_handled = data["server_handled"]
+                server_requests = data["server_requests"]
+                reading = data["reading"]
+                writing = data["writing"]
+                waiting = data["waiting"]
 
                 self.nginx_alive = True
                 self.nginx_active_connections = active_connections
@@ -175,14 +1030,17 @@ class NginxUtils:
                 self.nginx_writing = writing
                 self.nginx_waiting = waiting
 
-                logger.info(f"Alive: {self.nginx_alive}")
-                logger.info(f"Active connections: {active_connections}")
-                logger.info(f"Server accepts: {server_accepts}")
-                logger.info(f"Server handled: {server_handled}")
-                logger.info(f"Server requests: {server_requests}")
-                logger.info(f"Reading: {reading}")
-                logger.info(f"Writing: {writing}")
-                logger.info(f"Waiting: {waiting}")
+                logger.debug(
+                    f"Alive: {self.nginx_alive}, "
+                    f"Active connections: {active_connections}, "
+                    f"Server accepts: {server_accepts}, "
+                    f"Server handled: {server_handled}, "
+                    f"Server requests: {server_requests}, "
+                    f"Reading: {reading}, "
+                    f"Writing: {writing}, "
+                    f"Waiting: {waiting}, "
+                    f"Latency: {self.nginx_status_latency:.6f}s"
+                )
             else:
                 self.nginx_alive = self.alive()
                 self.nginx_active_connections = -1
@@ -214,5 +1072,7 @@ class NginxUtils:
             "reading": self.nginx_reading,
             "writing": self.nginx_writing,
             "waiting": self.nginx_waiting,
+            "latency": self.nginx_status_latency,
         }
+        self.status_series.append(self.nginx_status)
         return success, self.nginx_status
@@ -0,0 +1,218 @@
+#!/bin/python3
+import logging
+import socket
+from nacos import NacosClient
+
+
+logger = logging.getLogger(__name__)
+
+# code of the beat response if the instance is not registered (expired)
+NACOS_RESOURCE_NOT_FOUND = 20404
+
+
+def local_ip(remote_address: str, remote_port: int = 80):
+    """ip of the local interface routing to the remote address, 127.0.0.1 if unknown"""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            # no packet is sent by connecting a udp socket
+            sock.connect((remote_address, int(remote_port)))
+            return sock.getsockname()[0]
+    except OSError as e:
+        logger.error(f"Failed to get local ip to {remote_address}: {e}")
+        return "127.0.0.1"
+
+
+class NacosRegistry:
+    def __init__(
+        self,
+        nacos: NacosClient,
+        service_name: str,
+        ip: str,
+        port: int,
+        group_name: str = None,
+        cluster_name: str = None,
+        namespace_id: str = None,
+        weight: float = 1.0,
+        metadata: dict = None,
+        ephemeral: bool = True,
+    ):
+        """Registration of this proxy as an instance of a nacos service
+
+        The instance is registered on the first beat and re-registered if nacos
+        forgot it. Beats follow the clientBeatInterval returned by nacos, and
+        the full instance is only sent until nacos enables light beats.
+        An unhealthy nginx disables an ephemeral instance (the health of an
+        ephemeral instance is owned by its beats), or marks a persistent
+        instance unhealthy.
+
+        Args:
+            nacos (NacosClient): nacos client
+            service_name (str): service name
+            ip (str): instance ip
+            port (int): instance port
+            group_name (str, optional): service group name. Defaults to None.
+            cluster_name (str, optional): cluster name. Defaults to None.
+            namespace_id (str, optional): namespace id. Defaults to None.
+            weight (float, optional): instance weight. Defaults to 1.0.
+            metadata (dict, optional): instance metadata. Defaults to None.
+            ephemeral (bool, optional): ephemeral instance kept alive by beats. Defaults to True.
+        """
+        self.nacos = nacos
+        self.service_name = service_name
+        self.ip = ip
+        self.port = int(port)
+        self.group_name = group_name or None
+        self.cluster_name = cluster_name or None
+        self.namespace_id = namespace_id or None
+        self.weight = weight
+        self.metadata = metadata or {}
+        self.ephemeral = ephemeral
+        self.registered = False
+        self.healthy = None  # health reported to nacos
+        self.beat_interval = 5  # seconds, updated by the beat response
+        self.light_beat = False
+
+    def _service(self):
+        # nacos expects the grouped service name in beats
+        if self.group_name:
+            return f"{self.group_name}@@{self.service_name}"
+        return self.service_name
+
+    def register(self, healthy: bool = True):
+        """Register the instance.
+
+        Returns:
+            success, data: True and register result or False and msg
+        """
+        success, data = self.nacos.instance_register(
+            service_name=self.service_name,
+            ip=self.ip,
+            port=self.port,
+            enabled=healthy,
+            healthy=healthy,
+            ephemeral=self.ephemeral,
+            weight=self.weight,
+            metadata=self.metadata,
+            group_name=self.group_name,
+            cluster_name=self.cluster_name,
+            namespace_id=self.namespace_id,
+        )
+        if success and data:
+            self.registered = True
+            self.healthy = healthy
+            self.light_beat = False
+            logger.info(
+                f"Registered instance {self.ip}:{self.port} to service {self.service_name}"
+            )
+        else:
+            logger.error(f"Failed to register instance to nacos: {data}")
+        return success and data, data
+
+    def deregister(self):
+        """Deregister the instance.
+
+        Returns:
+            success, data: True and deregister result or False and msg
+        """
+        if not self.registered:
+            return True, None
+        success, data = self.nacos.instance_deregister(
+            service_name=self.service_name,
+            ip=self.ip,
+            port=self.port,
+            ephemeral=self.ephemeral,
+            group_name=self.group_name,
+            cluster_name=self.cluster_name,
+            namespace_id=self.namespace_id,
+        )
+        self.registered = False
+        if success and data:
+            logger.info(
+                f"Deregistered instance {self.ip}:{self.port} from service {self.service_name}"
+            )
+        else:
+            logger.error(f"Failed to deregister instance from nacos: {data}")
+        return success and data, data
+
+    def set_healthy(self, healthy: bool):
+        """Report the health of nginx to nacos if it changed."""
+        if healthy == self.healthy:
+            return True, None
+        if self.ephemeral:
+            success, data = self.nacos.instance_modify(
+                service_name=self.service_name,
+                ip=self.ip,
+                port=self.port,
+                enabled=healthy,
+                ephemeral=self.ephemeral,
+                weight=self.weight,
+                metadata=self.metadata,
+                group_name=self.group_name,
+                cluster_name=self.cluster_name,
+                namespace_id=self.namespace_id,
+            )
+        else:
+            success, data = self.nacos.instance_update_healthy(
+                service_name=self.service_name,
+                ip=self.ip,
+                port=self.port,
+                healthy=healthy,
+                group_name=self.group_name,
+                cluster_name=self.cluster_name,
+                namespace_id=self.namespace_id,
+            )
+        if success and data:
+            self.healthy = healthy
+            logger.info(f"Reported instance healthy to nacos: {healthy}")
+        else:
+            logger.error(f"Failed to report instance healthy to nacos: {data}")
+        return success and data, data
+
+    def beat(self, healthy: bool):
+        """Send a beat (registering first if needed) and report the health.
+
+        Args:
+            healthy (bool): nginx is serving or not
+
+        Returns:
+            success, data: True and beat result or False and msg
+        """
+        if not self.registered:
+            success, data = self.register(healthy)
+            if not success:
+                return False, data
+        if not self.ephemeral:
+            # persistent instances are checked by nacos, no beat
+            return self.set_healthy(healthy)
+        beat = None
+        if not self.light_beat:
+            beat = {
+                "serviceName": self._service(),
+                "ip": self.ip,
+                "port": self.port,
+                "cluster": self.cluster_name or "DEFAULT",
+                "weight": self.weight,
+                "metadata": self.metadata,
+                "scheduled": True,
+            }
+        success, data = self.nacos.instance_beat_send(
+            service_name=self.service_name,
+            ip=self.ip,
+            port=self.port,
+            beat=beat,
+            ephemeral=self.ephemeral,
+            group_name=self.group_name,
+            namespace_id=self.namespace_id,
+        )
+        if not success or not isinstance(data, dict):
+            logger.error(f"Failed to send beat to nacos: {data}")
+            return False, data
+        if data.get("code") == NACOS_RESOURCE_NOT_FOUND:
+            logger.warning("Instance expired on nacos, registering again...")
+            self.registered = False
+            return self.register(healthy)
+        if data.get("clientBeatInterval"):
+            self.beat_interval = max(data["clientBeatInterval"] / 1000, 1)
+        self.light_beat = bool(data.get("lightBeatEnabled"))
+        success, msg = self.set_healthy(healthy)
+        return success, data
@@ -0,0 +1,213 @@
+#!/bin/python3
+import hashlib
+import logging
+import os
+import re
+import time
+from abc import ABC, abstractmethod
+from nacos import NacosClient
+
+
+logger = logging.getLogger(__name__)
+
+# data id, group and tenant allowed as path components of the file source
+CONFIG_SOURCE_NAME = re.compile(r"[\w\-.:]+")
+
+
+class ConfigSource(ABC):
+    """Backend of the configs synced by the daemon
+
+    The methods are named after NacosClient, a source can be given to ConfigSync
+    and NacosConfigListener in place of a nacos client.
+    """
+
+    @abstractmethod
+    def config_get(self, data_id: str, group: str, tenant: str = None):
+        """get a config
+
+        Returns:
+            success, data: True and config content or False and msg
+        """
+
+    @abstractmethod
+    def config_publish(
+        self,
+        data_id: str,
+        group: str,
+        content: str,
+        type: str = None,
+        tenant: str = None,
+    ):
+        """publish a config
+
+        Returns:
+            success, data: True and publish result (bool) or False and msg
+        """
+
+    @abstractmethod
+    def config_listen_batch(
+        self, configs: list, pulling_timeout: int = 30000, no_hangup: bool = False
+    ):
+        """wait until any of the configs changed or timeout (thread blocking)
+
+        Args:
+            configs (list): list of (data_id, group, content_md5, tenant), tenant can be None
+            pulling_timeout (int, optional): timeout in milliseconds. Defaults to 30000.
+            no_hangup (bool, optional): return immediately even if no config changed. Defaults to False.
+
+        Returns:
+            success, data: True and changed configs (list of (data_id, group, tenant)) or False and msg
+        """
+
+    def config_series(self, series_data_id: str, group: str, tenant: str = None):
+        """get the config names listed in a series config, one name per line
+
+        Returns:
+            success, data: True and config names or False and msg
+        """
+        success, data = self.config_get(series_data_id, group, tenant)
+        if not success:
+            return False, data
+        return True, [name.strip() for name in data.split("\n") if name.strip() != ""]
+
+    def config_snapshot_get(self, data_id: str, group: str, tenant: str = None):
+        """get the local snapshot of a config, see NacosClient.config_snapshot_get"""
+        return False, "Snapshot is not supported"
+
+    def address(self):
+        """where the configs are stored, e.g. the url of the nacos server"""
+        return ""
+
+    def login(self):
+        return True, None
+
+    def alive(self):
+        return True
+
+    def close(self):
+        pass
+
+
+class NacosConfigSource(ConfigSource):
+    def __init__(self, nacos: NacosClient):
+        """Configs of a nacos server
+
+        Args:
+            nacos (NacosClient): nacos client, not closed by the source
+        """
+        self.nacos = nacos
+
+    def config_get(self, data_id: str, group: str, tenant: str = None):
+        return self.nacos.config_get(data_id, group, tenant)
+
+    def config_publish(
+        self,
+        data_id: str,
+        group: str,
+        content: str,
+        type: str = None,
+        tenant: str = None,
+    ):
+        return self.nacos.config_publish(
+            data_id=data_id, group=group, content=content, type=type, tenant=tenant
+        )
+
+    def config_listen_batch(
+        self, configs: list, pulling_timeout: int = 30000, no_hangup: bool = False
+    ):
+        return self.nacos.config_listen_batch(configs, pulling_timeout, no_hangup)
+
+    def config_snapshot_get(self, data_id: str, group: str, tenant: str = None):
+        return self.nacos.config_snapshot_get(data_id, group, tenant)
+
+    def address(self):
+        return self.nacos.base_url
+
+    def login(self):
+        return self.nacos.login()
+
+    def alive(self):
+        return self.nacos.alive()
+
+
+class FileConfigSource(ConfigSource):
+    def __init__(self, path: str, poll_interval: float = 0.5):
+        """Configs stored as files, {path}/{tenant or public}/{group}/{data_id}
+
+        A stand-in for nacos without any server, e.g. a dir shared by several
+        proxies or deployed by a configuration management tool.
+        Changes are listened by polling the md5 of the files.
+
+        Args:
+            path (str): root dir of the configs
+            poll_interval (float, optional): seconds between two checks while listening. Defaults to 0.5.
+        """
+        self.path = path
+        self.poll_interval = poll_interval
+
+    def address(self):
+        return f"file://{os.path.abspath(self.path)}"
+
+    def _file(self, data_id: str, group: str, tenant: str = None):
+        names = (tenant or "public", group, data_id)
+        if not all(CONFIG_SOURCE_NAME.fullmatch(name) for name in names) or any(
+            name in (".", "..") for name in names
+        ):
+            return None
+        return os.path.join(self.path, *names)
+
+    def config_get(self, data_id: str, group: str, tenant: str = None):
+        filepath = self._file(data_id, group, tenant)
+        if filepath is None:
+            return False, f"Invalid config {tenant}/{group}/{data_id}"
+        try:
+            with open(filepath, "r", encoding="utf-8") as f:
+                return True, f.read()
+        except FileNotFoundError:
+            return False, "config data not exist"
+        except OSError as e:
+            msg = f"Read config {data_id} error: {e}"
+            logger.error(msg)
+            return False, msg
+
+    def config_publish(
+        self,
+        data_id: str,
+        group: str,
+        content: str,
+        type: str = None,
+        tenant: str = None,
+    ):
+        filepath = self._file(data_id, group, tenant)
+        if filepath is None:
+            return False, f"Invalid config {tenant}/{group}/{data_id}"
+        try:
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            tmp_file = f"{filepath}.tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                f.write(content)
+            os.replace(tmp_file, filepath)
+            return True, True
+        except OSError as e:
+            msg = f"Write config {data_id} error: {e}"
+            logger.error(msg)
+            return False, msg
+
+    def _changed(self, configs: list):
+        changed = []
+        for data_id, group, content_md5, tenant in configs:
+            success, content = self.config_get(data_id, group, tenant)
+            md5 = hashlib.md5(content.encode("utf-8")).hexdigest() if success else ""
+            if md5 != (content_md5 or ""):
+                changed.append((data_id, group, tenant or None))
+        return changed
+
+    def config_listen_batch(
+        self, configs: list, pulling_timeout: int = 30000, no_hangup: bool = False
+    ):
+        deadline = time.monotonic() + pulling_timeout / 1000
+        while True:
+            changed = self._changed(configs)
+            if changed or no_hangup or time.monotonic() >= deadline:
+                return True, changed
+            time.sleep(min(self.poll_interval, max(deadline - time.monotonic(), 0)))
@@ -0,0 +1,225 @@
+#!/bin/python3
+import logging
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from nacos import NacosClient, NacosConfigListener
+from source import ConfigSource, NacosConfigSource
+import config
+
+
+logger = logging.getLogger(__name__)
+
+
+def content_md5(content: str):
+    return hashlib.md5(content.encode("utf-8")).hexdigest()
+
+
+class ConfigSync:
+    def __init__(self, source: ConfigSource, concurrency: int = 4, validate=None):
+        """Incremental config sync between the config source (nacos) and local conf dir
+
+        The md5 of every synced config is kept in a local manifest,
+        only configs whose md5 differs are downloaded or uploaded,
+        and local files with the same content are not rewritten.
+
+        Args:
+            source (ConfigSource): config source, a NacosClient is wrapped in a NacosConfigSource
+            concurrency (int, optional): max concurrent requests to the source, should not exceed the pool size of nacos client. Defaults to 4.
+            validate (callable, optional): validate(staged nginx.conf path) -> bool, downloaded configs are applied only if it returns True. Defaults to None.
+        """
+        if isinstance(source, NacosClient):
+            source = NacosConfigSource(source)
+        self.source = source
+        self.concurrency = max(int(concurrency), 1)
+        self.validate = validate
+        self.listener = NacosConfigListener(source, concurrency=self.concurrency)
+
+    @staticmethod
+    def series_names(conf_series: str):
+        """config names in the series, one name per line"""
+        return [name.strip() for name in conf_series.split("\n") if name.strip() != ""]
+
+    @staticmethod
+    def _local_md5(config_name: str):
+        success, content = config.nginx_config_get_custom(config_name)
+        if not success:
+            return None
+        return content_md5(content)
+
+    def _manifest(self, group: str, tenant: str):
+        """the manifest and its entries of the group, per source as another server has other configs"""
+        success, manifest = config.nginx_config_manifest_get()
+        if not success:
+            manifest = {}
+        entries = manifest.setdefault(self.source.address(), {})
+        return manifest, entries.setdefault(tenant or "", {}).setdefault(group, {})
+
+    def download(self, config_names: list, group: str, tenant: str = None):
+        """Download the configs whose md5 differs from the manifest.
+
+        Args:
+            config_names (list): config names (data id)
+            group (str): config group
+            tenant (str, optional): tenant namespace. Defaults to None.
+
+        Returns:
+            success, data: success is False if any config failed, data is {"changed": names of local files changed, "failed": names of configs failed}
+        """
+        manifest, entries = self._manifest(group, tenant)
+        listener = self.listener
+        watch, known = [], set()
+        for name in config_names:
+            key = NacosConfigListener.key(name, group, tenant)
+            entry = entries.get(name, {})
+            md5 = entry.get("md5")
+            if entry.get("rejected") is not None:
+                # rolled back on reload failure, kept until the remote config changes
+                md5 = entry["rejected"]
+            elif md5 is not None and self._local_md5(name) != md5:
+                # the remote config must be fetched if the local file is missing or edited
+                md5 = None
+            if md5 is None:
+                known.add(key)
+            elif key in listener.contents and listener.md5.get(key) != md5:
+                # already fetched on change by the listener, e.g. while long pulling
+                md5 = listener.md5[key]
+                known.add(key)
+            watch.append((name, group, tenant, md5))
+        listener.watch(watch, unwatch=False)
+        success, changed = listener.check()
+        if not success:
+            logger.error(f"Check config changes from nacos error: {changed}")
+            return False, {"changed": [], "failed": list(config_names)}
+        fetched = known.union(changed)
+        listener.fetch([key for key in known if key not in listener.contents])
+        updated, failed = [], []
+        staged = {}
+        for name in config_names:
+            key = NacosConfigListener.key(name, group, tenant)
+            if key not in fetched:
+                continue
+            content = listener.contents.get(key)
+            if content is None:
+                logger.error(f"Download config {name} to local error: not found")
+                failed.append(name)
+                continue
+            md5 = content_md5(content)
+            if self._local_md5(name) != md5:
+                staged[name] = content
+            entries[name] = {"md5": md5, "timestamp": int(time.time())}
+        if staged:
+            # all or nothing, the manifest is kept if the staged configs are rejected
+            result, msg = config.nginx_config_apply_custom(staged, self.validate)
+            if not result:
+                logger.error(f"Download config {list(staged)} to local error: {msg}")
+                return False, {"changed": [], "failed": failed + list(staged)}
+            updated = list(staged)
+            logger.info(f"Download config {updated} to local success")
+        config.nginx_config_manifest_set(manifest)
+        logger.info(
+            f"Download config: {len(fetched)} fetched, {len(updated)} changed, {len(failed)} failed, {len(config_names)} total"
+        )
+        return len(failed) == 0, {"changed": updated, "failed": failed}
+
+    def restore(self, config_names: list, group: str, tenant: str = None):
+        """Apply the local snapshots of the configs, without any request to nacos.
+
+        Used to boot with the last configs fetched from nacos while it is unreachable,
+        configs without snapshot are kept as they are.
+
+        Args:
+            config_names (list): config names (data id)
+            group (str): config group
+            tenant (str, optional): tenant namespace. Defaults to None.
+
+        Returns:
+            success, data: success is False if the snapshots were rejected, data is {"changed": names of local files changed, "failed": names of configs without snapshot}
+        """
+        manifest, entries = self._manifest(group, tenant)
+        staged, failed = {}, []
+        for name in config_names:
+            success, snapshot = self.source.config_snapshot_get(name, group, tenant)
+            if not success:
+                failed.append(name)
+                continue
+            if self._local_md5(name) != snapshot["md5"]:
+                staged[name] = snapshot["content"]
+            entries[name] = {"md5": snapshot["md5"], "timestamp": snapshot["timestamp"]}
+        if staged:
+            result, msg = config.nginx_config_apply_custom(staged, self.validate)
+            if not result:
+                logger.error(
+                    f"Restore config {list(staged)} from snapshot error: {msg}"
+                )
+                return False, {"changed": [], "failed": failed + list(staged)}
+            logger.info(f"Restore config {list(staged)} from snapshot success")
+        config.nginx_config_manifest_set(manifest)
+        return True, {"changed": list(staged), "failed": failed}
+
+    def upload(self, config_names: list, group: str, tenant: str = None):
+        """Upload the local configs whose md5 differs from the source.
+
+        Uploaded when the source is older than local, which may have lost its configs,
+        so the local md5 are checked against the source rather than the manifest.
+
+        Args:
+            config_names (list): config names (data id)
+            group (str): config group
+            tenant (str, optional): tenant namespace. Defaults to None.
+
+        Returns:
+            success, data: success is False if any config failed, data is {"changed": names of configs uploaded, "failed": names of configs failed}
+        """
+        manifest, entries = self._manifest(group, tenant)
+        uploaded, failed = [], []
+        local = []
+        for name in config_names:
+            success, content = config.nginx_config_get_custom(name)
+            if not success:
+                logger.error(f"Get config {name} from local error: {content}")
+                failed.append(name)
+                continue
+            local.append((name, content, content_md5(content)))
+        self.listener.watch(
+            ((name, group, tenant, md5) for name, _, md5 in local), unwatch=False
+        )
+        # the configs to overwrite are not fetched
+        success, changed = self.listener.check(fetch=False)
+        if not success:
+            logger.error(f"Check config changes from nacos error: {changed}")
+            return False, {"changed": [], "failed": list(config_names)}
+        changed = set(changed)
+        pending = []
+        for name, content, md5 in local:
+            if NacosConfigListener.key(name, group, tenant) in changed:
+                pending.append((name, content, md5))
+            elif entries.get(name, {}).get("md5") != md5:
+                # already on the source, e.g. uploaded by another proxy
+                entries[name] = {"md5": md5, "timestamp": int(time.time())}
+
+        def publish(item):
+            name, content, _ = item
+            logger.debug(f"Upload config {name} to nacos:{content}")
+            return self.source.config_publish(
+                data_id=name, group=group, content=content, tenant=tenant
+            )
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            results = list(executor.map(publish, pending))
+        for (name, content, md5), (success, result) in zip(pending, results):
+            if success and result:
+                logger.info(
+                    f"Upload config {name} to nacos[{tenant}/{group}/{name}] success"
+                )
+                entries[name] = {"md5": md5, "timestamp": int(time.time())}
+                self.listener.update(name, group, tenant, content)
+                uploaded.append(name)
+            else:
+                logger.error(f"Upload config {name} to nacos error: {result}")
+                failed.append(name)
+        config.nginx_config_manifest_set(manifest)
+        logger.info(
+            f"Upload config: {len(uploaded)} uploaded, {len(failed)} failed, {len(config_names)} total"
+        )
+        return len(failed) == 0, {"changed": uploaded, "failed": failed}
@@ -0,0 +1,148 @@
+#!/bin/python3
+import logging
+import tempfile
+import os, sys
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from accesslog import (
+    AccessLogAnalyzer,
+    AccessLogTailer,
+    SpaceSaving,
+    compile_log_format,
+    ACCESS_LOG_FORMAT,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def access_log_line(
+    path="/", status=200, client="10.0.0.1", upstream="-", upstream_time="-"
+):
+    return (
+        f'{client} - - [17/Oct/2026:10:00:00 +0800] "GET {path}?a=1 HTTP/1.1" '
+        f'{status} 612 "-" "curl/8.0 (x86_64)" "-" '
+        f'0.012 "{upstream}" {upstream_time}\n'
+    )
+
+
+def test_compile_log_format():
+    logger.info("======= Testing compile_log_format =======")
+    parser = compile_log_format(ACCESS_LOG_FORMAT)
+    fields = parser.match(
+        access_log_line(
+            upstream="10.0.0.2:80, 10.0.0.3:80", upstream_time="0.500, 0.010"
+        ).rstrip("\n")
+    ).groupdict()
+    logger.info(fields)
+    assert fields["remote_addr"] == "10.0.0.1"
+    assert fields["time_local"] == "17/Oct/2026:10:00:00 +0800"
+    assert fields["request"] == "GET /?a=1 HTTP/1.1"
+    assert fields["status"] == "200"
+    assert fields["http_user_agent"] == "curl/8.0 (x86_64)"
+    assert fields["upstream_addr"] == "10.0.0.2:80, 10.0.0.3:80"
+    assert fields["upstream_response_time"] == "0.500, 0.010"
+    assert parser.match("garbage") is None
+    parser = compile_log_format("$remote_addr ${status}$body_bytes_sent")
+    assert parser.match("1.2.3.4 200").groupdict()["remote_addr"] == "1.2.3.4"
+
+
+def test_space_saving():
+    logger.info("======= Testing SpaceSaving =======")
+    counter = SpaceSaving(capacity=3)
+    for key in ["a"] * 10 + ["b"] * 5 + ["c", "d", "e", "f"]:
+        counter.add(key)
+    assert len(counter.counters) == 3
+    top = counter.top(2)
+    assert top[0] == ("a", 10, 0)
+    assert top[1] == ("b", 5, 0)
+
+
+def test_access_log_tailer_rotation():
+    logger.info("======= Testing AccessLogTailer rotation =======")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "access.log")
+        tailer = AccessLogTailer(path, from_end=True)
+        assert tailer.read_lines() == []
+        with open(path, "w") as f:
+            f.write("created\n")
+        # created after the tailer, read from the start
+        assert tailer.read_lines() == ["created"]
+        tailer.close()
+        with open(path, "a") as f:
+            f.write("old\n")
+        # existing content is skipped
+        tailer = AccessLogTailer(path, from_end=True)
+        assert tailer.read_lines() == []
+        with open(path, "a") as f:
+            f.write("line 1\nline ")
+        assert tailer.read_lines() == ["line 1"]
+        # rotated like logrotate + nginx -s reopen
+        with open(path, "a") as f:
+            f.write("2\n")
+        os.rename(path, path + ".1")
+        assert tailer.read_lines() == ["line 2"]
+        with open(path + ".1", "a") as f:
+            f.write("line 3\n")
+        with open(path, "w") as f:
+            f.write("line 4\n")
+        assert tailer.read_lines() == ["line 3", "line 4"]
+        # truncated
+        with open(path, "w") as f:
+            f.write("5\n")
+        assert tailer.read_lines() == ["5"]
+        tailer.close()
+
+
+def test_access_log_analyzer():
+    logger.info("======= Testing AccessLogAnalyzer =======")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "access.log")
+        open(path, "w").close()
+        analyzer = AccessLogAnalyzer(path, top_n=2, capacity=10)
+        with open(path, "a") as f:
+            for i in range(100):
+                f.write(
+                    access_log_line(path=f"/api/{i % 20}", client=f"10.0.0.{i % 3}")
+                )
+            for _ in range(5):
+                f.write(
+                    access_log_line(
+                        status=502,
+                        upstream="10.0.1.1:80 : 10.0.1.2:80",
+                        upstream_time="3.000 : 0.004",
+                    )
+                )
+            f.write("not an access log line\n")
+        assert analyzer.poll() == 106
+        snapshot = analyzer.stats.snapshot()
+        logger.info(snapshot)
+        assert snapshot["lines"] == 105
+        assert snapshot["unparsed"] == 1
+        assert snapshot["status"] == {"200": 100, "502": 5}
+        assert snapshot["bytes_sent"] == 105 * 612
+        assert len(analyzer.stats.paths.counters) == 10
+        assert snapshot["top_paths"][0][0] == "/"
+        assert len(snapshot["top_clients"]) == 2
+        slow = snapshot["upstream_latency"]["10.0.1.1:80"]
+        assert slow["count"] == 5
+        assert slow["buckets"][-2] == [10, 5]
+        assert slow["buckets"][-4][1] == 0  # 1s
+        assert snapshot["upstream_latency"]["10.0.1.2:80"]["buckets"][0] == [0.005, 5]
+        assert snapshot["request_latency"]["count"] == 105
+        analyzer.close()
+
+
+def test():
+    logger.info("Tests starting...")
+    test_compile_log_format()
+    test_space_saving()
+    test_access_log_tailer_rotation()
+    test_access_log_analyzer()
+    logger.info("Tests finished.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="[%(asctime)s - %(levelname)s]: %(message)s"
+    )
+    test()
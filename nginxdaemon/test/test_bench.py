@@ -0,0 +1,83 @@
+#!/bin/python3
+import logging
+import json
+from http.server import ThreadingHTTPServer
+from threading import Thread
+import os, sys
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+import config
+from bench import LoadGenerator, StubStatusHandler, run_benchmarks, summarize_samples
+
+
+logger = logging.getLogger(__name__)
+
+
+def test_bench_summarize_samples():
+    logger.info("======= Testing summarize_samples")
+    result = summarize_samples([0.3, 0.1, 0.2])
+    assert result["count"] == 3 and result["min"] == 0.1 and result["max"] == 0.3
+    assert result["p50"] == 0.2 and abs(result["avg"] - 0.2) < 1e-9
+    assert summarize_samples([]) == {"count": 0}
+    logger.info(f"======= Test result: {result}")
+
+
+def test_bench_load_generator():
+    logger.info("======= Testing LoadGenerator")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubStatusHandler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        load = LoadGenerator(f"http://127.0.0.1:{server.server_address[1]}/", 2)
+        load.start()
+        load.stopped.wait(0.3)
+        load.stop()
+        result = load.summary()
+        assert result["requests"] > 0 and result["errors"] == 0
+        assert 0 < result["max_gap_seconds"] < 0.3
+    finally:
+        server.shutdown()
+        server.server_close()
+    logger.info(f"======= Test result: {result}")
+
+
+def test_bench_run_benchmarks():
+    logger.info("======= Testing run_benchmarks")
+    config_base_path = config.CONFIG_BASE_PATH
+    # benchmarks needing nginx are skipped
+    result = run_benchmarks(
+        ["status", "sync", "publish", "reload"],
+        nginx_runner_path="/nonexistent/nginx",
+        configs=20,
+        rounds=2,
+        duration=0.2,
+    )
+    assert config.CONFIG_BASE_PATH == config_base_path
+    results = result["results"]
+    assert results["status"]["target"] == "stub" and results["status"]["probes"] > 0
+    assert results["status"]["failures"] == 0
+    sync = results["sync"]
+    assert sync["full"]["count"] == 1 and sync["unchanged"]["count"] == 2
+    # the unchanged cycle only gets the version, the one changed cycle fetches it and the file
+    assert sync["unchanged"]["requests"] == 1
+    assert sync["one_changed"]["requests"] < sync["full"]["requests"]
+    assert results["publish"] == {"skipped": "nginx is not available"}
+    assert results["reload"] == {"skipped": "nginx is not available"}
+    json.dumps(result)
+    logger.info(f"======= Test result: {result}")
+
+
+def test():
+    logger.info("Tests starting...")
+    logger.info("Testing bench...")
+    test_bench_summarize_samples()
+    test_bench_load_generator()
+    test_bench_run_benchmarks()
+    logger.info("Tests finished.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="[%(asctime)s - %(levelname)s]: %(message)s"
+    )
+    test()
@@ -1,6 +1,9 @@
 #!/bin/python3
 import logging
+import hashlib
+import time
 from pathlib import Path
+import tempfile
 import os, sys
 
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
@@ -68,6 +71,179 @@ def test_config_nginx_config_get_custom():
     logger.info(f"======= Test result: {success}, data:{data.keys()}, detail:{data}")
 
 
+def test_config_nginx_config_apply_custom():
+    logger.info("======= Testing config.nginx_config_apply_custom")
+    config_base_path = config.CONFIG_BASE_PATH
+    manifest_file = config.NGINX_DAEMON_MANIFEST_FILE
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            config.CONFIG_BASE_PATH = Path(tmp) / "conf"
+            config.NGINX_DAEMON_MANIFEST_FILE = Path(tmp) / "manifest.json"
+            os.makedirs(config.CONFIG_BASE_PATH)
+            (config.CONFIG_BASE_PATH / "nginx.conf").write_text("include a.conf;")
+            (config.CONFIG_BASE_PATH / "a.conf").write_text("a")
+            a_md5 = hashlib.md5(b"a").hexdigest()
+            config.nginx_config_manifest_set(
+                {"s": {"": {"G": {"a.conf": {"md5": a_md5}}}}}
+            )
+            staged = []
+
+            def validate(conf_file):
+                conf_dir = Path(conf_file).parent
+                staged.append((conf_dir / "a.conf").read_text())
+                return (conf_dir / "a.conf").read_text() != "broken"
+
+            # rejected configs are not applied
+            success, msg = config.nginx_config_apply_custom(
+                {"a.conf": "broken", "b.conf": "b"}, validate
+            )
+            assert not success
+            assert staged == ["broken"]
+            assert (config.CONFIG_BASE_PATH / "a.conf").read_text() == "a"
+            assert not (config.CONFIG_BASE_PATH / "b.conf").exists()
+            # accepted configs are swapped in together
+            success, msg = config.nginx_config_apply_custom(
+                {"a.conf": "a2", "b.conf": "b"}, validate
+            )
+            assert success
+            assert (config.CONFIG_BASE_PATH / "a.conf").read_text() == "a2"
+            assert (config.CONFIG_BASE_PATH / "b.conf").read_text() == "b"
+            assert not (Path(tmp) / "conf.staging").exists()
+            # rollback restores the previous generation
+            success, msg = config.nginx_config_rollback_custom()
+            assert success
+            assert (config.CONFIG_BASE_PATH / "a.conf").read_text() == "a"
+            assert not (config.CONFIG_BASE_PATH / "b.conf").exists()
+            assert (
+                config.CONFIG_BASE_PATH / "nginx.conf"
+            ).read_text() == "include a.conf;"
+            # the applies until a commit are rolled back together with the manifest
+            for cfgs in ({"a.conf": "a2"}, {"a.conf": "a3", "b.conf": "b"}):
+                success, msg = config.nginx_config_apply_custom(cfgs, validate)
+                assert success
+                a3_md5 = hashlib.md5(cfgs["a.conf"].encode()).hexdigest()
+                config.nginx_config_manifest_set(
+                    {"s": {"": {"G": {"a.conf": {"md5": a3_md5}}}}}
+                )
+            success, msg = config.nginx_config_rollback_custom()
+            assert success
+            assert (config.CONFIG_BASE_PATH / "a.conf").read_text() == "a"
+            assert not (config.CONFIG_BASE_PATH / "b.conf").exists()
+            success, manifest = config.nginx_config_manifest_get()
+            assert manifest["s"][""]["G"]["a.conf"] == {
+                "md5": a_md5,
+                "rejected": a3_md5,
+            }
+            assert not config.nginx_config_rollback_custom()[0]
+            # nothing is rolled back after a commit
+            success, msg = config.nginx_config_apply_custom({"a.conf": "a2"}, validate)
+            assert success
+            config.nginx_config_commit_custom()
+            assert not config.nginx_config_rollback_custom()[0]
+            assert (config.CONFIG_BASE_PATH / "a.conf").read_text() == "a2"
+    finally:
+        config.CONFIG_BASE_PATH = config_base_path
+        config.NGINX_DAEMON_MANIFEST_FILE = manifest_file
+    logger.info(f"======= Test result: {True}")
+
+
+def test_config_nginx_config_index():
+    logger.info("======= Testing config.NginxConfigIndex")
+    config_base_path = config.CONFIG_BASE_PATH
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            config.CONFIG_BASE_PATH = Path(tmp) / "conf"
+            os.makedirs(config.CONFIG_BASE_PATH / "subdir")
+            for i in range(100):
+                (config.CONFIG_BASE_PATH / f"{i}.conf").write_text(f"conf {i}")
+            # out of the racy window of the scan
+            os.utime(config.CONFIG_BASE_PATH, ns=(0, time.time_ns() - 10**10))
+            index = config.nginx_config_index()
+            assert config.nginx_config_get_custom("7.conf") == (True, "conf 7")
+            assert config.nginx_config_get_custom("99.conf") == (True, "conf 99")
+            assert not config.nginx_config_get_custom("subdir")[0]
+            assert not config.nginx_config_get_custom("100.conf")[0]
+            assert index.scans == 1
+            # the listing reads nothing until accessed
+            success, files = config.nginx_config_get_custom()
+            assert success and len(files) == 100 and "subdir" not in files
+            assert files["42.conf"] == "conf 42"
+            assert index.scans == 1
+            # a created file changes the dir mtime
+            (config.CONFIG_BASE_PATH / "100.conf").write_text("conf 100")
+            assert config.nginx_config_get_custom("100.conf") == (True, "conf 100")
+            assert index.scans == 2
+            # an in-place write is read without rescanning
+            os.utime(config.CONFIG_BASE_PATH, ns=(0, time.time_ns() - 10**10))
+            assert config.nginx_config_get_custom("100.conf")[0]
+            (config.CONFIG_BASE_PATH / "100.conf").write_text("conf 100 changed")
+            assert config.nginx_config_get_custom("100.conf") == (
+                True,
+                "conf 100 changed",
+            )
+            assert index.scans == 3
+            os.remove(config.CONFIG_BASE_PATH / "100.conf")
+            assert not config.nginx_config_get_custom("100.conf")[0]
+            assert "100.conf" not in config.nginx_config_get_custom()[1]
+    finally:
+        config.CONFIG_BASE_PATH = config_base_path
+    logger.info(f"======= Test result: {index.scans}")
+
+
+def test_config_nginx_daemon_config_load():
+    logger.info("======= Testing config.nginx_daemon_config_load")
+    daemon_config_file = config.NGINX_DAEMON_CONFIG_FILE
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            config.NGINX_DAEMON_CONFIG_FILE = Path(tmp) / "nginxdaemon.ini"
+            config.NGINX_DAEMON_CONFIG_FILE.write_text(
+                "[default]\ncheck_alive_interval=5\nnacos_port=\n"
+                "nacos_auto_reload_nginx=true\nnacos_password=secret\n"
+            )
+            success, first = config.nginx_daemon_config_load()
+            assert success
+            assert first["check_alive_interval"] == 5
+            assert first["nacos_port"] is None
+            assert first["nacos_auto_reload_nginx"] is True
+            try:
+                first["check_alive_interval"] = 1
+                assert False, "the config is read only"
+            except TypeError:
+                pass
+            # unchanged file, the same snapshot without parsing
+            success, second = config.nginx_daemon_config_load()
+            assert second is first
+            # the raw copy is still a dict of str
+            success, raw = config.nginx_daemon_config_get()
+            assert raw["check_alive_interval"] == "5"
+            raw["check_alive_interval"] = "1"
+            assert config.nginx_daemon_config_load()[1] is first
+            # changed file, only the changed keys are reported
+            config.NGINX_DAEMON_CONFIG_FILE.write_text(
+                "[default]\ncheck_alive_interval=10\nnacos_port=8848\n"
+                "nacos_auto_reload_nginx=true\nnacos_username=nacos\n"
+            )
+            success, third = config.nginx_daemon_config_load()
+            assert success and third is not first
+            assert config.nginx_daemon_config_changes(first, third) == [
+                "check_alive_interval",
+                "nacos_password",
+                "nacos_port",
+                "nacos_username",
+            ]
+            assert config.nginx_daemon_config_mask(first)["nacos_password"] == "******"
+            # invalid typed field, the error is reported and nothing cached
+            config.NGINX_DAEMON_CONFIG_FILE.write_text(
+                "[default]\ncheck_alive_interval=five\n"
+            )
+            success, msg = config.nginx_daemon_config_load()
+            assert not success and "check_alive_interval" in msg
+    finally:
+        config.NGINX_DAEMON_CONFIG_FILE = daemon_config_file
+        config._daemon_config_cache["key"] = None
+    logger.info(f"======= Test result: {True}")
+
+
 def test():
     logger.info("Tests starting...")
     logger.info("Testing config...")
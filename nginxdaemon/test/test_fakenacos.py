@@ -0,0 +1,108 @@
+#!/bin/python3
+import logging
+import time
+from threading import Timer
+import os, sys
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from nacos import NacosClient
+from registry import NacosRegistry
+from fakenacos import FakeNacosServer
+
+
+logger = logging.getLogger(__name__)
+
+
+def test_fake_nacos_config():
+    logger.info("======= Testing FakeNacosServer config")
+    with FakeNacosServer(username="nacos", password="nacos") as server:
+        nacos = NacosClient("127.0.0.1", server.port, "nacos", "nacos", timeout=5)
+        try:
+            success, result = nacos.config_get("a.conf", "DEFAULT_GROUP")
+            assert not success and "404" in result
+            assert nacos.config_publish("a.conf", "DEFAULT_GROUP", "a") == (True, True)
+            assert nacos.config_get("a.conf", "DEFAULT_GROUP") == (True, "a")
+            assert nacos.config_publish("a.conf", "G", "ta", tenant="t") == (True, True)
+            assert nacos.config_get("a.conf", "G", "t") == (True, "ta")
+            # a revoked token is refreshed by the client
+            server.revoke_tokens()
+            assert nacos.config_get("a.conf", "DEFAULT_GROUP") == (True, "a")
+            assert server.requests[("POST", "auth/login")] == 2
+            # no hangup returns the changed configs at once
+            success, changed = nacos.config_listen_batch(
+                [("a.conf", "DEFAULT_GROUP", "", None), ("a.conf", "G", "", "t")],
+                no_hangup=True,
+            )
+            assert success
+            assert changed == [("a.conf", "DEFAULT_GROUP", None), ("a.conf", "G", "t")]
+            # the long pulling is held until a config changed
+            md5 = "0cc175b9c0f1b6a831c399e269772661"  # md5 of "a"
+            Timer(0.3, server.publish, ("a.conf", "DEFAULT_GROUP", "b")).start()
+            start = time.monotonic()
+            success, changed = nacos.config_listen_batch(
+                [("a.conf", "DEFAULT_GROUP", md5, None)], pulling_timeout=5000
+            )
+            assert success and changed == [("a.conf", "DEFAULT_GROUP", None)]
+            assert 0.2 < time.monotonic() - start < 4
+            # or the timeout
+            success, changed = nacos.config_listen_batch(
+                [("a.conf", "G", "", "t")], pulling_timeout=0
+            )
+            assert success and changed == [("a.conf", "G", "t")]
+            assert nacos.config_delete("a.conf", "DEFAULT_GROUP") == (True, True)
+            assert not nacos.config_get("a.conf", "DEFAULT_GROUP")[0]
+        finally:
+            nacos.close()
+    # wrong password
+    with FakeNacosServer(username="nacos", password="nacos") as server:
+        nacos = NacosClient("127.0.0.1", server.port, "nacos", "wrong", timeout=5)
+        success, result = nacos.config_get("a.conf", "DEFAULT_GROUP")
+        assert not success and "403" in result
+        nacos.close()
+    logger.info(f"======= Test result: {result}")
+
+
+def test_fake_nacos_instance():
+    logger.info("======= Testing FakeNacosServer instance")
+    with FakeNacosServer() as server:
+        nacos = NacosClient("127.0.0.1", server.port, None, None, timeout=5)
+        try:
+            registry = NacosRegistry(
+                nacos, "ssh", "10.0.0.1", 22, group_name="G", metadata={"a": "1"}
+            )
+            success, result = registry.beat(True)
+            assert success and result["lightBeatEnabled"]
+            success, result = nacos.instance_list("ssh", group_name="G")
+            assert success and [h["ip"] for h in result["hosts"]] == ["10.0.0.1"]
+            assert result["hosts"][0]["metadata"] == {"a": "1"}
+            # disabled instances are not listed
+            assert registry.set_healthy(False)[0]
+            success, result = nacos.instance_list("ssh", group_name="G")
+            assert success and result["hosts"] == []
+            # a forgotten instance is registered again by the light beat
+            server.instances.clear()
+            success, result = registry.beat(True)
+            assert success and registry.registered
+            success, result = nacos.instance_list("ssh", group_name="G")
+            assert success and len(result["hosts"]) == 1
+            assert registry.deregister()[0]
+            success, result = nacos.instance_list("ssh", group_name="G")
+            assert success and result["hosts"] == []
+        finally:
+            nacos.close()
+    logger.info(f"======= Test result: {result}")
+
+
+def test():
+    logger.info("Tests starting...")
+    logger.info("Testing FakeNacosServer...")
+    test_fake_nacos_config()
+    test_fake_nacos_instance()
+    logger.info("Tests finished.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="[%(asctime)s - %(levelname)s]: %(message)s"
+    )
+    test()
@@ -0,0 +1,126 @@
+#!/bin/python3
+import gzip
+import logging
+import tempfile
+import os, sys
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from loganalyze import analyze_logs, split_chunks
+
+
+logger = logging.getLogger(__name__)
+
+
+def access_log_line(minute, status=200, request_time="0.012", upstream_time="-"):
+    return (
+        f'10.0.0.1 - - [17/Oct/2026:10:{minute:02d}:30 +0800] "GET /api HTTP/1.1" '
+        f'{status} 100 "-" "curl/8.0" "-" '
+        f'{request_time} "10.0.1.1:80" {upstream_time}\n'
+    )
+
+
+def write_access_log(path):
+    with open(path, "w") as f:
+        for minute in range(5):
+            for i in range(200):
+                f.write(access_log_line(minute, 200 if i % 10 else 502))
+            f.write(access_log_line(minute, request_time="3.000", upstream_time="2.9"))
+        f.write("not an access log line\n")
+        # a truncated line is not matched in the middle
+        f.write("truncated " + access_log_line(4))
+
+
+def test_split_chunks():
+    logger.info("======= Testing split_chunks =======")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "access.log")
+        write_access_log(path)
+        chunks = split_chunks(path, chunk_size=10000)
+        assert len(chunks) > 1
+        assert chunks[0][0] == 0 and chunks[-1][1] == os.path.getsize(path)
+        with open(path, "rb") as f:
+            data = f.read()
+        for (_, end), (start, _) in zip(chunks, chunks[1:]):
+            assert end == start and data[end - 1 : end] == b"\n"
+
+
+def test_analyze_access_logs():
+    logger.info("======= Testing analyze_logs access =======")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "access.log")
+        write_access_log(path)
+        with open(path, "rb") as f, gzip.open(path + ".1.gz", "wb") as gz:
+            gz.write(f.read())
+        success, single = analyze_logs([path], workers=1)
+        assert success
+        success, result = analyze_logs(
+            [path, path + ".1.gz"], workers=2, chunk_size=10000
+        )
+        assert success
+        logger.info(result["minutes"][0])
+        assert result["lines"] == 2 * 1007
+        assert result["matched"] == 2 * 1005
+        assert len(result["minutes"]) == 5
+        minute = result["minutes"][0]
+        assert minute["minute"] == "2026-10-17 10:00"
+        assert minute["requests"] == 2 * 201
+        assert minute["status"] == {"200": 2 * 181, "502": 2 * 20}
+        assert minute["bytes"] == 2 * 201 * 100
+        assert minute["latency_max"] == 3.0
+        assert minute["upstream_latency_max"] == 2.9
+        assert minute["latency_p50"] == 0.025
+        assert minute["latency_p99"] == 0.025  # 1 of 201 is slow
+        # the chunks merge to the same aggregates
+        assert single["minutes"][0]["requests"] * 2 == minute["requests"]
+        success, result = analyze_logs(
+            [path], since="2026-10-17 10:01", until="2026-10-17 10:03"
+        )
+        assert [m["minute"] for m in result["minutes"]] == [
+            "2026-10-17 10:01",
+            "2026-10-17 10:02",
+        ]
+        success, result = analyze_logs([os.path.join(tmp, "missing.log")])
+        assert not success
+        # the lines are grouped by $time_local, a format without it is rejected
+        success, result = analyze_logs([path], log_format="$remote_addr $status")
+        assert not success and "time_local" in result
+        success, result = analyze_logs(
+            [path],
+            log_format='$remote_addr - $remote_user [$time_local] "$request" $rest',
+        )
+        assert success and result["matched"] == result["lines"] - 2
+        assert result["minutes"][0]["status"] == {}
+        assert result["minutes"][0]["latency_max"] == 0.0
+
+
+def test_analyze_error_logs():
+    logger.info("======= Testing analyze_logs error =======")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "error.log")
+        with open(path, "w") as f:
+            f.write("2026/10/17 10:00:01 [error] 1#0: *1 connect() failed\n")
+            f.write("2026/10/17 10:00:02 [warn] 1#0: *2 upstream slow\n")
+            f.write("2026/10/17 10:01:00 [error] 1#0: *3 upstream timed out\n")
+        success, result = analyze_logs([path], kind="error")
+        assert success
+        assert result["minutes"][0] == {
+            "minute": "2026-10-17 10:00",
+            "lines": 2,
+            "levels": {"error": 1, "warn": 1},
+        }
+        assert result["minutes"][1]["levels"] == {"error": 1}
+
+
+def test():
+    logger.info("Tests starting...")
+    test_split_chunks()
+    test_analyze_access_logs()
+    test_analyze_error_logs()
+    logger.info("Tests finished.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="[%(asctime)s - %(levelname)s]: %(message)s"
+    )
+    test()
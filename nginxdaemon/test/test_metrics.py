@@ -0,0 +1,141 @@
+#!/bin/python3
+import asyncio
+import logging
+import http.client
+import socket
+import os, sys
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from metrics import DaemonMetrics, OPENMETRICS_CONTENT_TYPE
+from nginx import NginxStatusSeries
+from accesslog import AccessLogStats
+
+
+logger = logging.getLogger(__name__)
+
+NGINX_STATUS = {
+    "alive": True,
+    "active_connections": 2,
+    "server_accepts": 100,
+    "server_handled": 98,
+    "server_requests": 200,
+    "reading": 0,
+    "writing": 1,
+    "waiting": 1,
+    "latency": 0.001,
+}
+
+
+def test_daemon_metrics_render():
+    logger.info("======= Testing DaemonMetrics render =======")
+    metrics = DaemonMetrics()
+    text = metrics.render()
+    assert "nginx_up 0" in text
+    assert "\nnginx_connections_active " not in text
+    assert text.endswith("# EOF\n")
+    metrics.observe_status(NGINX_STATUS, timestamp=100)
+    metrics.observe_status(
+        dict(NGINX_STATUS, server_requests=400, server_accepts=110), timestamp=110
+    )
+    metrics.inc("nginx_reloads")
+    metrics.observe("nginx_reload_duration_seconds", 0.25)
+    text = metrics.render()
+    logger.info(text)
+    assert "nginx_up 1" in text
+    assert "nginx_connections_active 2" in text
+    assert "nginx_http_requests_total 400" in text
+    assert "nginx_connections_dropped 12" in text
+    assert "nginx_http_requests_per_second 20.000000" in text
+    assert "nginx_connections_accepted_per_second 1.000000" in text
+    assert "nginxdaemon_nginx_reloads_total 1" in text
+    assert "nginxdaemon_nginx_reload_duration_seconds_count 1" in text
+    assert "nginxdaemon_nginx_reload_duration_seconds_sum 0.250000" in text
+    # nginx restarted, the counters start from zero
+    metrics.observe_status(dict(NGINX_STATUS, server_requests=50), timestamp=120)
+    assert "nginx_http_requests_per_second 5.000000" in metrics.render()
+    assert "nginx_http_requests_rate" not in metrics.render()
+    metrics.status_series = NginxStatusSeries()
+    metrics.status_series.append(NGINX_STATUS)
+    text = metrics.render()
+    assert 'nginx_http_requests_rate{window="1m"} 0.000000' in text
+    assert (
+        'nginx_status_probe_latency_quantile_seconds{window="15m",quantile="0.99"} 0.001000'
+        in text
+    )
+    metrics.access_log_stats = AccessLogStats()
+    metrics.access_log_stats.add(
+        {
+            "status": "502",
+            "request_time": "0.3",
+            "upstream_addr": "10.0.0.1:80",
+            "upstream_response_time": "0.3",
+        }
+    )
+    text = metrics.render()
+    assert 'nginx_access_responses_total{status="502"} 1' in text
+    assert 'nginx_access_request_duration_seconds_bucket{le="0.25"} 0' in text
+    assert 'nginx_access_request_duration_seconds_bucket{le="0.5"} 1' in text
+    assert (
+        'nginx_access_upstream_response_duration_seconds_bucket{upstream="10.0.0.1:80",le="+Inf"} 1'
+        in text
+    )
+    assert (
+        'nginx_access_upstream_response_duration_seconds_count{upstream="10.0.0.1:80"} 1'
+        in text
+    )
+
+
+def test_daemon_metrics_scrape():
+    logger.info("======= Testing DaemonMetrics scrape =======")
+    metrics = DaemonMetrics()
+    metrics.observe_status(NGINX_STATUS)
+
+    def scrape(port):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+        results = []
+        for path in ("/metrics", "/metrics", "/"):
+            conn.request("GET", path)
+            response = conn.getresponse()
+            results.append(
+                (response.status, response.getheader("Content-Type"), response.read())
+            )
+        conn.close()
+        # HTTP/1.0 without keep-alive is closed after the response
+        with socket.create_connection(("127.0.0.1", port), timeout=5) as sock:
+            sock.sendall(b"GET /metrics HTTP/1.0\r\n\r\n")
+            data = b""
+            while chunk := sock.recv(65536):
+                data += chunk
+        results.append(data)
+        return results
+
+    async def run():
+        server = await asyncio.start_server(metrics.handle_client, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            return await asyncio.get_running_loop().run_in_executor(None, scrape, port)
+        finally:
+            server.close()
+
+    results = asyncio.run(run())
+    assert results[0][0] == 200
+    assert results[0][1] == OPENMETRICS_CONTENT_TYPE
+    assert b"nginx_up 1" in results[0][2]
+    assert results[1][0] == 200
+    assert results[2][0] == 404
+    assert results[3].startswith(b"HTTP/1.1 200 OK\r\n")
+    assert b"Connection: close\r\n" in results[3] and b"nginx_up 1" in results[3]
+
+
+def test():
+    logger.info("Tests starting...")
+    test_daemon_metrics_render()
+    test_daemon_metrics_scrape()
+    logger.info("Tests finished.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="[%(asctime)s - %(levelname)s]: %(message)s"
+    )
+    test()
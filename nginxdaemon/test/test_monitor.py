@@ -1,10 +1,17 @@
 #!/bin/python3
 import logging
+import time
+import tempfile
+import subprocess
+import socket
+import urllib.request
 from pathlib import Path
 import os, sys
 
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 from monitor import MonitorDaemon
+from control import send_command
+import config
 
 
 BASE_PATH = Path(__file__).resolve().parent.parent
@@ -21,6 +28,221 @@ def test_nginx_monitor_daemon():
     nmd.start()
 
 
+def test_nginx_monitor_daemon_quit():
+    nmd = MonitorDaemon(
+        nginx_runner_path=f"{PROJ_PATH}/nginx/nginx",
+        nginx_context_path=f"{PROJ_PATH}/nginx/",
+    )
+    nmd.start()
+    time.sleep(1)
+    start = time.time()
+    nmd.quit()
+    nmd.loop_thread.join(5)
+    # quit does not wait for the sleeping monitors
+    assert not nmd.loop_thread.is_alive()
+    assert time.time() - start < 1
+    assert nmd.loop.is_closed()
+
+
+def test_nginx_monitor_daemon_command():
+    nmd = MonitorDaemon(
+        nginx_runner_path=f"{PROJ_PATH}/nginx/nginx",
+        nginx_context_path=f"{PROJ_PATH}/nginx/",
+    )
+    for _ in range(50):
+        if os.path.exists(nmd.command_socket):
+            break
+        time.sleep(0.1)
+    success, data = send_command("-m status", nmd.command_socket)
+    assert success
+    assert data["monitor"] == {
+        "running": False,
+        "daemon": True,
+        "metrics_exporter": {"listen": "", "listening": False, "error": None},
+    }
+    success, data = send_command("-x unknown", nmd.command_socket)
+    assert not success
+    # the access log is analyzed by the started monitors only
+    success, data = send_command("-l access", nmd.command_socket)
+    assert not success
+    success, data = send_command("-m quit", nmd.command_socket)
+    assert success
+    nmd.loop_thread.join(5)
+    assert not nmd.loop_thread.is_alive()
+    assert not os.path.exists(nmd.command_socket)
+
+
+def test_nginx_monitor_daemon_hot_update():
+    daemon_config_file = config.NGINX_DAEMON_CONFIG_FILE
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            config.NGINX_DAEMON_CONFIG_FILE = Path(tmp) / "nginxdaemon.ini"
+            config.NGINX_DAEMON_CONFIG_FILE.write_text(
+                "[default]\nnacos_address=127.0.0.1\nnacos_port=18848\n"
+                "nacos_username=nacos\nnacos_password=nacos\nnacos_group=test\n"
+            )
+            nmd = MonitorDaemon(
+                nginx_runner_path=f"{PROJ_PATH}/nginx/nginx",
+                nginx_context_path=f"{PROJ_PATH}/nginx/",
+            )
+            nacos = nmd.nacos
+            assert nacos.port == 18848 and nmd.registry is None
+            # nothing is parsed nor applied while the file is unchanged
+            assert nmd._load_config() == []
+            assert nmd.nacos is nacos
+            daemon_config = (
+                "[default]\nnacos_address=127.0.0.1\nnacos_port=8848\n"
+                "nacos_username=nacos\nnacos_password=changed\nnacos_group=test\n"
+                "nacos_register_service=proxy\ncheck_alive_interval=7\n"
+            )
+            config.NGINX_DAEMON_CONFIG_FILE.write_text(daemon_config)
+            changed = nmd._load_config()
+            assert changed == [
+                "check_alive_interval",
+                "nacos_password",
+                "nacos_port",
+                "nacos_register_service",
+            ]
+            assert nmd.check_alive_interval == 7
+            assert nmd.nacos is not nacos and nmd.nacos.port == 8848
+            assert nmd.nacos.password == "changed"
+            assert nmd.registry is not None and nmd.registry.nacos is nmd.nacos
+            # the metrics exporter follows metrics_listen, bind errors are kept
+            for _ in range(50):
+                if nmd.daemon:
+                    break
+                time.sleep(0.1)
+            with socket.socket() as busy:
+                busy.bind(("127.0.0.1", 0))
+                port = busy.getsockname()[1]
+            config.NGINX_DAEMON_CONFIG_FILE.write_text(
+                f"{daemon_config}metrics_listen=127.0.0.1:{port}\n"
+            )
+            assert nmd._load_config() == ["metrics_listen"]
+            body = None
+            for _ in range(50):
+                try:
+                    with urllib.request.urlopen(
+                        f"http://127.0.0.1:{port}/metrics", timeout=1
+                    ) as response:
+                        body = response.read()
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            assert body is not None and nmd.metrics_error is None
+            with socket.socket() as busy:
+                busy.bind(("127.0.0.1", 0))
+                busy.listen()
+                config.NGINX_DAEMON_CONFIG_FILE.write_text(
+                    f"{daemon_config}metrics_listen=127.0.0.1:{busy.getsockname()[1]}\n"
+                )
+                assert nmd._load_config() == ["metrics_listen"]
+                for _ in range(50):
+                    if nmd.metrics_error is not None:
+                        break
+                    time.sleep(0.1)
+                assert nmd.metrics_error is not None
+            # the access log is tailed once its path is set, until it is emptied
+            nmd.start()
+            for _ in range(50):
+                if nmd.running:
+                    break
+                time.sleep(0.1)
+            assert nmd.access_log_monitoring_task is None
+            access_log = Path(tmp) / "access.log"
+            config.NGINX_DAEMON_CONFIG_FILE.write_text(
+                f"{daemon_config}access_log_path={access_log}\n"
+            )
+            nmd._load_config()
+            for _ in range(50):
+                if nmd.access_log is not None:
+                    break
+                time.sleep(0.1)
+            assert nmd.access_log.tailer.path == str(access_log)
+            task = nmd.access_log_monitoring_task
+            config.NGINX_DAEMON_CONFIG_FILE.write_text(
+                f"{daemon_config}access_log_path=\n"
+            )
+            nmd._load_config()
+            for _ in range(50):
+                if task.done():
+                    break
+                time.sleep(0.1)
+            assert task.done() and nmd.access_log_monitoring_task is None
+            nmd.quit()
+            nmd.loop_thread.join(5)
+            assert not nmd.loop_thread.is_alive()
+    finally:
+        config.NGINX_DAEMON_CONFIG_FILE = daemon_config_file
+
+
+def test_nginx_monitor_daemon_reload():
+    daemon_config_file = config.NGINX_DAEMON_CONFIG_FILE
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(f"{tmp}/logs")
+        hup_file = f"{tmp}/hup"
+        # fake nginx master which records every SIGHUP
+        master = subprocess.Popen(
+            [
+                "bash",
+                "-c",
+                "exec -a 'nginx: master process' python3 -c \""
+                "import signal, time; "
+                f"signal.signal(signal.SIGHUP, lambda *a: open('{hup_file}', 'a').write('HUP\\n')); "
+                'time.sleep(20)"',
+            ]
+        )
+        try:
+            with open(f"{tmp}/logs/nginx.pid", "w") as f:
+                f.write(f"{master.pid}\n")
+            config.NGINX_DAEMON_CONFIG_FILE = Path(tmp) / "nginxdaemon.ini"
+            config.NGINX_DAEMON_CONFIG_FILE.write_text(
+                "[default]\nreload_debounce=0.2\nreload_min_interval=1\n"
+            )
+            nmd = MonitorDaemon(
+                nginx_runner_path=f"{tmp}/nginx", nginx_context_path=tmp
+            )
+            for _ in range(50):
+                if os.path.exists(nmd.command_socket) and nmd.nginx.master_pid():
+                    break
+                time.sleep(0.1)
+
+            def reloads():
+                if not os.path.exists(hup_file):
+                    return 0
+                with open(hup_file) as f:
+                    return len(f.readlines())
+
+            # a burst of requests is merged into one reload
+            for _ in range(5):
+                nmd._request_reload(rollback=False)
+                time.sleep(0.05)
+            for _ in range(50):
+                if reloads():
+                    break
+                time.sleep(0.05)
+            first = time.monotonic()
+            time.sleep(0.3)
+            assert reloads() == 1
+            assert nmd.reload_scheduler.snapshot()["merged"] == 4
+            # the command waits for the next reload, after the min interval
+            success, data = send_command("-n reload", nmd.command_socket)
+            assert success and data["nginx"] == "reload"
+            assert time.monotonic() - first >= 0.9
+            for _ in range(50):
+                if reloads() == 2:
+                    break
+                time.sleep(0.05)
+            assert reloads() == 2
+            assert nmd.metrics.counters["nginx_reload_requests"] == 6
+            success, data = send_command("-m quit", nmd.command_socket)
+            nmd.loop_thread.join(5)
+            assert not nmd.loop_thread.is_alive()
+        finally:
+            master.kill()
+            config.NGINX_DAEMON_CONFIG_FILE = daemon_config_file
+
+
 def test():
     logger.info("Tests starting...")
     logger.info("Testing NginxDaemon...")
@@ -1,10 +1,17 @@
 import logging
 import time
+import json
+import hashlib
+import tempfile
 import sys
 import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Timer
+from urllib.parse import urlsplit, parse_qs
 
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
-from nacos import NacosClient
+from nacos import NacosClient, NacosConfigListener
+from fakenacos import FakeNacosServer
 
 logger = logging.getLogger(__name__)
 
@@ -14,6 +21,325 @@ nacos_username = "nacos"
 nacos_password = "nacos"
 
 
+class LocalNacosHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self, body: str):
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        # drain the form, the connection is kept alive
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.path.startswith("/nacos/v1/cs/configs/listener"):
+            self._reply("test%02DEFAULT_GROUP%01test2%02DEFAULT_GROUP%02ns%01\n")
+            return
+        token = {"accessToken": "token", "tokenTtl": 18000, "globalAdmin": True}
+        self._reply(json.dumps(token))
+
+    def do_GET(self):
+        self._reply("content")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_nacosclient_connection_reuse():
+    logger.info("======= Testing NacosClient connection reuse")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), LocalNacosHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        nacos = NacosClient(
+            "127.0.0.1", server.server_address[1], nacos_username, nacos_password
+        )
+        for i in range(20):
+            success, data = nacos.config_get(f"test{i}", "DEFAULT_GROUP")
+            assert success and data == "content"
+        assert nacos.alive()
+        stats = nacos.connection_stats()
+        assert stats["requests"] == 21
+        assert stats["connections"] == 1
+        assert stats["reused"] == 20
+        nacos.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+    logger.info(f"======= Test result: {stats}")
+
+
+def test_nacosclient_config_listen_batch():
+    logger.info("======= Testing NacosClient.config_listen_batch")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), LocalNacosHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        nacos = NacosClient(
+            "127.0.0.1", server.server_address[1], nacos_username, nacos_password
+        )
+        success, data = nacos.config_listen_batch(
+            [
+                ("test", "DEFAULT_GROUP", "", None),
+                ("test2", "DEFAULT_GROUP", "", "ns"),
+            ]
+        )
+        assert success
+        assert data == [
+            ("test", "DEFAULT_GROUP", None),
+            ("test2", "DEFAULT_GROUP", "ns"),
+        ]
+        nacos.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+    logger.info(f"======= Test result: {data}")
+
+
+def test_nacosconfiglistener():
+    logger.info("======= Testing NacosConfigListener")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), LocalNacosHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        nacos = NacosClient(
+            "127.0.0.1", server.server_address[1], nacos_username, nacos_password
+        )
+        listener = NacosConfigListener(nacos, batch_size=2)
+        listener.watch(
+            [
+                ("test", "DEFAULT_GROUP", None, "old"),
+                ("test2", "DEFAULT_GROUP", "ns", "old"),
+                ("test3", "DEFAULT_GROUP", None, None),
+            ]
+        )
+        content_md5 = "9a0364b9e99bb480dd25e1f0284c8555"  # md5 of "content"
+        assert listener.md5[("test3", "DEFAULT_GROUP", None)] == content_md5
+        success, changed = listener.listen()
+        assert success
+        assert changed == [
+            ("test", "DEFAULT_GROUP", None),
+            ("test2", "DEFAULT_GROUP", "ns"),
+        ]
+        assert listener.md5[("test", "DEFAULT_GROUP", None)] == content_md5
+        assert listener.contents[("test2", "DEFAULT_GROUP", "ns")] == "content"
+        listener.watch([("test3", "DEFAULT_GROUP", None, None)])
+        assert list(listener.md5) == [("test3", "DEFAULT_GROUP", None)]
+        success, changed = listener.listen()
+        assert success and changed == []
+        nacos.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+    logger.info(f"======= Test result: {changed}")
+
+
+def test_nacosconfiglistener_chunks():
+    logger.info("======= Testing NacosConfigListener with several chunks")
+    with FakeNacosServer(username="nacos", password="nacos") as server:
+        for name in ("a", "b", "c"):
+            server.publish(f"{name}.conf", "DEFAULT_GROUP", name)
+        nacos = NacosClient("127.0.0.1", server.port, "nacos", "nacos", timeout=10)
+        listener = NacosConfigListener(nacos, batch_size=1)
+        listener.watch(
+            (f"{name}.conf", "DEFAULT_GROUP", None, None) for name in ("a", "b", "c")
+        )
+        try:
+            # a change in the first chunk ends the long pulling of all chunks
+            Timer(0.3, server.publish, ("a.conf", "DEFAULT_GROUP", "a2")).start()
+            start = time.monotonic()
+            success, changed = listener.listen(pulling_timeout=5000)
+            assert success and changed == [("a.conf", "DEFAULT_GROUP", None)]
+            assert time.monotonic() - start < 2
+            assert listener.contents[("a.conf", "DEFAULT_GROUP", None)] == "a2"
+            assert len(listener.polls) == 2
+            # the long pullings of the unchanged chunks in flight are reused
+            Timer(0.3, server.publish, ("c.conf", "DEFAULT_GROUP", "c2")).start()
+            success, changed = listener.listen(pulling_timeout=5000)
+            assert success and changed == [("c.conf", "DEFAULT_GROUP", None)]
+            assert server.requests[("POST", "cs/configs/listener")] == 4
+        finally:
+            nacos.close()
+    logger.info(f"======= Test result: {changed}")
+
+
+class UnavailableNacosHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    requests = []  # (method, path) received, every first request of a path gets 503
+
+    def _reply(self, body: str, code: int = 200):
+        data = body.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, method: str):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        path = urlsplit(self.path).path
+        self.requests.append((method, path))
+        if self.requests.count((method, path)) == 1:
+            self._reply("unavailable", 503)
+        elif path.endswith("/listener"):
+            self._reply("")
+        else:
+            self._reply("true")
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_nacosclient_retry_methods():
+    logger.info("======= Testing NacosClient retry methods")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), UnavailableNacosHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        nacos = NacosClient("127.0.0.1", server.server_address[1], backoff_factor=0)
+        # a POST changing configs is not sent twice
+        success, data = nacos.config_publish("test", "DEFAULT_GROUP", "content")
+        assert not success and "503" in data
+        # idempotent requests and the listener are retried
+        assert nacos.config_get("test", "DEFAULT_GROUP") == (True, "true")
+        success, data = nacos.config_listen_batch(
+            [("test", "DEFAULT_GROUP", "", None)], no_hangup=True
+        )
+        assert success and data == []
+        methods = [method for method, _ in UnavailableNacosHandler.requests]
+        assert methods == ["POST", "GET", "GET", "POST", "POST"]
+        assert nacos.connection_stats()["connections"] == 1
+        nacos.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+    logger.info(f"======= Test result: {UnavailableNacosHandler.requests}")
+
+
+class TokenNacosHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    logins = []  # tokens issued, the last one is accepted
+    rejected = []  # tokens rejected
+
+    def _reply(self, body: str, code: int = 200):
+        data = body.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        time.sleep(0.2)
+        self.logins.append(f"token{len(self.logins)}")
+        token = {"accessToken": self.logins[-1], "tokenTtl": 1, "globalAdmin": True}
+        self._reply(json.dumps(token))
+
+    def do_GET(self):
+        token = parse_qs(urlsplit(self.path).query).get("accessToken", [None])[0]
+        if not self.logins or token != self.logins[-1]:
+            self.rejected.append(token)
+            self._reply("token invalid!", 403)
+        else:
+            self._reply("content")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_nacostokenmanager():
+    logger.info("======= Testing NacosTokenManager")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), TokenNacosHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    logins, rejected = TokenNacosHandler.logins, TokenNacosHandler.rejected
+    try:
+        nacos = NacosClient(
+            "127.0.0.1", server.server_address[1], nacos_username, nacos_password
+        )
+        assert logins == []
+        # concurrent first requests share one login
+        results = []
+        threads = [
+            Thread(target=lambda: results.append(nacos.config_get("test", "G")))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results == [(True, "content")] * 8
+        assert len(logins) == 1
+        # refreshed in the background before the token expired
+        time.sleep(1.2)
+        assert len(logins) == 2
+        assert nacos.config_get("test", "G") == (True, "content")
+        assert rejected == []
+        # a revoked token is refreshed once and the request retried
+        logins.append("revoked")
+        assert nacos.config_get("test", "G") == (True, "content")
+        assert len(logins) == 4 and len(rejected) == 1
+        nacos.close()
+        time.sleep(1.2)
+        assert len(logins) == 4
+    finally:
+        server.shutdown()
+        server.server_close()
+    logger.info(f"======= Test result: {logins}")
+
+
+def test_nacosclient_login_unreachable():
+    logger.info("======= Testing NacosClient.login unreachable")
+    start = time.time()
+    nacos = NacosClient("127.0.0.1", 1, nacos_username, nacos_password, retries=1)
+    assert not nacos.alive()
+    assert not nacos.login()[0]
+    # requests do not wait for a login again before the retry interval
+    assert nacos.token_manager.get() is None
+    nacos.close()
+    assert time.time() - start < 3
+    logger.info(f"======= Test result: {time.time() - start}")
+
+
+def test_nacosclient_config_snapshot():
+    logger.info("======= Testing NacosClient config snapshot")
+    start = time.time()
+    with tempfile.TemporaryDirectory() as tmp:
+        # no login in the constructor, nothing to wait for
+        nacos = NacosClient(
+            "127.0.0.1", 1, nacos_username, nacos_password, snapshot_path=tmp
+        )
+        assert time.time() - start < 0.5
+        assert not nacos.config_snapshot_get("test", "DEFAULT_GROUP")[0]
+        server = ThreadingHTTPServer(("127.0.0.1", 0), LocalNacosHandler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            nacos = NacosClient(
+                "127.0.0.1",
+                server.server_address[1],
+                nacos_username,
+                nacos_password,
+                snapshot_path=tmp,
+            )
+            assert nacos.config_get("test", "DEFAULT_GROUP", "ns") == (True, "content")
+            # unsafe names are never used as paths
+            assert nacos.config_get("../test", "DEFAULT_GROUP")[0]
+            nacos.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+        assert os.listdir(tmp) == ["ns"]
+        # read back by another client while nacos is gone
+        nacos = NacosClient("127.0.0.1", 1, snapshot_path=tmp)
+        success, snapshot = nacos.config_snapshot_get("test", "DEFAULT_GROUP", "ns")
+        assert success and snapshot["content"] == "content"
+        assert snapshot["md5"] == hashlib.md5(b"content").hexdigest()
+        assert not nacos.config_snapshot_get("test", "DEFAULT_GROUP")[0]
+        assert not nacos.config_snapshot_get("../test", "DEFAULT_GROUP")[0]
+    logger.info(f"======= Test result: {snapshot}")
+
+
 def test_nacosclient_config_get():
     logger.info("======= Testing NacosClient.config_get")
     nacos = NacosClient(nacos_ip, nacos_port, nacos_username, nacos_password)
@@ -2,11 +2,21 @@
 import logging
 import time
 from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+import subprocess
+import tempfile
 import os, sys
 
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
-from nginx import NginxUtils
-
+from nginx import (
+    NginxUtils,
+    NginxStatusPoller,
+    NginxStatusSeries,
+    NginxRestartPolicy,
+    NginxReloadScheduler,
+    parse_stub_status,
+)
 
 BASE_PATH = Path(__file__).resolve().parent.parent
 PROJ_PATH = Path(__file__).resolve().parent.parent.parent
@@ -38,6 +48,583 @@ def test_nginx_utils():
     nu.start()
 
 
+STUB_STATUS_BODY = """Active connections: 291 
+server accepts handled requests
+ 16630948 16630947 31070465 
+Reading: 6 Writing: 179 Waiting: 106 
+"""
+
+
+class StubStatusHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = STUB_STATUS_BODY.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_parse_stub_status():
+    data = parse_stub_status(STUB_STATUS_BODY)
+    assert data == {
+        "active_connections": 291,
+        "server_accepts": 16630948,
+        "server_handled": 16630947,
+        "server_requests": 31070465,
+        "reading": 6,
+        "writing": 179,
+        "waiting": 106,
+    }
+    assert parse_stub_status("<html>502 Bad Gateway</html>") is None
+    assert parse_stub_status("Active connections: x\n\n1 2\nReading: 1") is None
+
+
+def test_nginx_status_poller():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubStatusHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/status"
+        poller = NginxStatusPoller(url)
+        success, body = poller.fetch()
+        assert success and body == STUB_STATUS_BODY
+        conn = poller._conn
+        success, body = poller.fetch()
+        assert success
+        assert poller._conn is conn  # keep-alive connection reused
+        assert poller.latency >= 0
+        # callers in several threads share the connection
+        results = []
+
+        def fetch():
+            results.extend(poller.fetch() for _ in range(20))
+
+        threads = [Thread(target=fetch) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results == [(True, STUB_STATUS_BODY)] * 160
+        nu = NginxUtils("nginx", "/tmp", url)
+        success, status = nu.status()
+        assert success
+        assert status["alive"] and status["server_handled"] == 16630947
+        assert status["latency"] >= 0
+        poller.close()
+        nu.status_poller.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_nginx_signal_by_pid_file():
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(f"{tmp}/logs")
+        hup_file = f"{tmp}/hup"
+        # fake nginx master which records SIGHUP
+        master = subprocess.Popen(
+            [
+                "bash",
+                "-c",
+                "exec -a 'nginx: master process' python3 -c \""
+                "import signal, time; "
+                f"signal.signal(signal.SIGHUP, lambda *a: open('{hup_file}', 'w').write('HUP')); "
+                f"open('{tmp}/ready', 'w').close(); "
+                'time.sleep(10)"',
+            ]
+        )
+        try:
+            with open(f"{tmp}/logs/nginx.pid", "w") as f:
+                f.write(f"{master.pid}\n")
+            nu = NginxUtils(f"{tmp}/nginx", tmp)
+            # the signal handler is set once ready
+            for _ in range(50):
+                if nu.master_pid() == master.pid and os.path.exists(f"{tmp}/ready"):
+                    break
+                time.sleep(0.1)
+            assert nu.master_pid() == master.pid
+            assert nu.reload()
+            for _ in range(50):
+                if os.path.exists(hup_file):
+                    break
+                time.sleep(0.1)
+            assert os.path.exists(hup_file)
+            assert nu.stop()
+            assert master.wait(5) is not None
+            # stale pid falls back to the (missing) nginx binary
+            assert nu.master_pid() is None
+            assert not nu.reload()
+        finally:
+            master.kill()
+
+
+def test_nginx_status_series():
+    logger.info("======= Testing NginxStatusSeries =======")
+    series = NginxStatusSeries(capacity=100)
+
+    def sample(requests, accepts=None, handled=None, latency=0.001, alive=True):
+        accepts = requests if accepts is None else accepts
+        return {
+            "alive": alive,
+            "active_connections": 1,
+            "server_accepts": accepts,
+            "server_handled": accepts if handled is None else handled,
+            "server_requests": requests,
+            "latency": latency,
+        }
+
+    assert series.rate("requests", 60, now=0) == 0.0
+    # 10 requests per second, sampled every 5s for 20 minutes
+    for i in range(241):
+        assert series.append(sample(i * 50), timestamp=i * 5)
+    assert series.size == 100
+    assert series.rate("requests", 60, now=1200) == 10.0
+    assert series.rate("requests", 900, now=1200) == 10.0
+    assert series.increase("requests", 60, now=1200) == 600
+    assert series.percentile("requests", 99, 300, now=1200) == 10.0
+    # nearest rank, selected in place in the scratch buffer of the series
+    latencies = NginxStatusSeries(capacity=10)
+    for i, latency in enumerate([5, 1, 4, 2, 3, 9, 7, 8, 6, 0]):
+        latencies.append(sample(i, latency=latency), timestamp=i)
+    assert [
+        latencies.percentile("latency", q, 100, now=9) for q in (10, 50, 90, 100)
+    ] == [0, 4, 8, 9]
+    # dead nginx is not sampled, a restart resets the counters
+    assert not series.append(sample(-1, alive=False), timestamp=1205)
+    series.append(sample(100, accepts=100, handled=90), timestamp=1210)
+    series.append(sample(200, accepts=150, handled=130), timestamp=1220)
+    assert series.resets == 1
+    assert series.increase("requests", 20, now=1220) == 200
+    summary = series.summary(now=1220)
+    assert summary["1m"]["dropped"] == 20
+    assert summary["1m"]["requests_per_second"] > 0
+    # throughput collapse: no samples in the window
+    assert series.rate("requests", 60, now=2000) == 0.0
+    assert series.percentile("latency", 50, 60, now=2000) == 0.0
+
+
+def test_nginx_restart_policy():
+    logger.info("======= Testing NginxRestartPolicy =======")
+    policy = NginxRestartPolicy(
+        failure_threshold=3, backoff_base=1, crash_loop_limit=3, crash_loop_window=100
+    )
+    # a single failed probe is not confirmed
+    assert not policy.observe(False, now=0)
+    assert policy.state == "suspect"
+    assert not policy.observe(True, now=1)
+    assert policy.state == "healthy"
+    assert not policy.observe(False, now=2)
+    assert not policy.observe(False, now=3)
+    assert policy.observe(False, now=4)
+    policy.recovered(False, now=4)
+    # backoff 1s, 2s, then the crash loop opens the circuit
+    assert not policy.observe(False, now=4.5)
+    assert policy.state == "backoff"
+    assert policy.observe(False, now=5)
+    policy.recovered(False, now=5)
+    assert not policy.observe(False, now=6)
+    assert policy.observe(False, now=7)
+    policy.recovered(True, now=7)
+    assert policy.state == "open"
+    assert not policy.observe(False, now=8)
+    assert not policy.observe(False, now=9)
+    assert not policy.observe(False, now=10)
+    assert not policy.observe(False, now=106)
+    # half open after the window, a failed attempt opens the circuit again
+    assert policy.observe(False, now=107)
+    policy.recovered(False, now=107)
+    assert policy.state == "open"
+    assert policy.observe(False, now=207)
+    policy.recovered(True, now=207)
+    assert policy.state == "healthy"
+    # the probes are ignored while suspended, e.g. during an upgrade
+    policy.suspend()
+    for t in range(300, 310):
+        assert not policy.observe(False, now=t)
+    assert policy.failures == 0 and policy.snapshot()["suspended"]
+    policy.resume()
+    assert not policy.observe(False, now=310)
+    assert policy.state == "suspect"
+
+
+def test_nginx_reload_scheduler():
+    logger.info("======= Testing NginxReloadScheduler =======")
+    scheduler = NginxReloadScheduler(
+        debounce=1, min_interval=5, max_delay=3, max_old_workers=2, drain_timeout=20
+    )
+    assert scheduler.due(now=0) is None and scheduler.state == "idle"
+    # a burst is debounced after its last request
+    scheduler.request(now=0)
+    scheduler.request(now=0.5)
+    assert scheduler.due(now=1) == 0.5 and scheduler.state == "debounce"
+    assert scheduler.due(now=1.5) == 0
+    assert scheduler.begin() == 2
+    scheduler.reloaded(True, 2, now=1.5)
+    assert scheduler.snapshot() == {
+        "state": "idle",
+        "pending": 0,
+        "reloads": 1,
+        "merged": 1,
+    }
+    # spaced by the min interval
+    scheduler.request(now=2)
+    assert scheduler.due(now=3) == 3.5 and scheduler.state == "throttled"
+    assert scheduler.due(now=6.5) == 0
+    scheduler.reloaded(True, scheduler.begin(), now=6.5)
+    # continuous requests are debounced at most max_delay
+    for t in range(24, 30):
+        scheduler.request(now=t * 0.5)
+        assert scheduler.due(now=t * 0.5) > 0
+    assert scheduler.due(now=15) == 0
+    batch = scheduler.begin()
+    # a request during the reload waits for the next one
+    scheduler.request(now=15.5)
+    scheduler.reloaded(True, batch, now=16)
+    assert scheduler.pending == 1 and scheduler.state == "debounce"
+    # delayed while the old workers drain, until the drain timeout
+    assert scheduler.due(old_workers=3, now=22) == scheduler.drain_interval
+    assert scheduler.state == "draining"
+    assert scheduler.due(old_workers=2, now=23) == 0
+    assert scheduler.due(old_workers=3, now=35.5) == 0
+    # held while suspended, e.g. during an upgrade
+    scheduler.suspend()
+    assert scheduler.due(now=40) == scheduler.drain_interval
+    assert scheduler.state == "suspended"
+    scheduler.resume()
+    assert scheduler.due(now=40) == 0
+
+
+def test_nginx_old_workers():
+    logger.info("======= Testing NginxUtils.old_workers =======")
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(f"{tmp}/logs")
+        # fake nginx master with a worker and an old worker
+        master = subprocess.Popen(
+            [
+                "bash",
+                "-c",
+                "(exec -a 'nginx: worker process' sleep 10) & "
+                "(exec -a 'nginx: worker process is shutting down' sleep 10) & "
+                "exec -a 'nginx: master process' sleep 10",
+            ],
+            start_new_session=True,
+        )
+        try:
+            with open(f"{tmp}/logs/nginx.pid", "w") as f:
+                f.write(f"{master.pid}\n")
+            nu = NginxUtils(f"{tmp}/nginx", tmp)
+            workers = []
+            for _ in range(50):
+                workers = nu.old_workers()
+                if workers:
+                    break
+                time.sleep(0.1)
+            assert len(workers) == 1
+            with open(f"/proc/{workers[0]}/cmdline", "rb") as f:
+                assert b"shutting down" in f.read()
+        finally:
+            # the workers too
+            os.killpg(master.pid, 9)
+            master.wait(5)
+
+
+# fake nginx master which starts a new worker on SIGHUP, or logs [emerg] if broken
+FAKE_NGINX_RELOAD_MASTER = """
+import os, signal, subprocess, sys, time
+
+prefix = sys.argv[1]
+
+
+def start_worker(*args):
+    if os.path.exists(f"{prefix}/broken"):
+        with open(f"{prefix}/logs/error.log", "a") as f:
+            f.write('[emerg] 1#1: unknown directive "broken" in nginx.conf:1\\n')
+    elif not os.path.exists(f"{prefix}/stuck"):
+        subprocess.Popen(["bash", "-c", "exec -a 'nginx: worker process' sleep 10"])
+
+
+signal.signal(signal.SIGHUP, start_worker)
+signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+start_worker()
+with open(f"{prefix}/logs/nginx.pid", "w") as f:
+    f.write(str(os.getpid()))
+while True:
+    time.sleep(0.1)
+"""
+
+
+def test_nginx_reload_verified():
+    logger.info("======= Testing NginxUtils reload =======")
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(f"{tmp}/logs")
+        with open(f"{tmp}/master.py", "w") as f:
+            f.write(FAKE_NGINX_RELOAD_MASTER)
+        master = subprocess.Popen(
+            [
+                "bash",
+                "-c",
+                f"exec -a 'nginx: master process' python3 {tmp}/master.py {tmp}",
+            ],
+            start_new_session=True,
+        )
+        try:
+            nu = NginxUtils(f"{tmp}/nginx", tmp)
+            for _ in range(50):
+                if nu.master_pid() == master.pid and nu._listening_workers(master.pid):
+                    break
+                time.sleep(0.1)
+            assert len(nu._listening_workers(master.pid)) == 1
+            # a new generation of workers
+            assert nu.reload(timeout=5)
+            assert len(nu._listening_workers(master.pid)) == 2
+            # the config is rejected by the master
+            open(f"{tmp}/broken", "w").close()
+            start = time.monotonic()
+            assert not nu.reload(timeout=5)
+            assert time.monotonic() - start < 4
+            # the master does not start new workers
+            os.remove(f"{tmp}/broken")
+            open(f"{tmp}/stuck", "w").close()
+            assert not nu.reload(timeout=0.5)
+        finally:
+            # the workers too
+            os.killpg(master.pid, 9)
+            master.wait(5)
+
+
+# fake nginx: "nginx -p <prefix>" starts a master serving stub_status
+FAKE_NGINX = """#!/bin/bash
+if [ "$3" = "-s" ]; then exit 1; fi
+(exec -a 'nginx: master process' python3 "$2/master.py" "$2" >/dev/null 2>&1 &)
+"""
+
+FAKE_NGINX_MASTER = """
+import os, sys
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+prefix = sys.argv[1]
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = b"Active connections: 1 \\nserver accepts handled requests\\n 1 1 1 \\nReading: 0 Writing: 1 Waiting: 0 \\n"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+server = HTTPServer(("127.0.0.1", int(open(f"{prefix}/port").read())), Handler)
+with open(f"{prefix}/logs/nginx.pid", "w") as f:
+    f.write(str(os.getpid()))
+server.serve_forever()
+"""
+
+
+def test_nginx_recover():
+    logger.info("======= Testing NginxUtils recover =======")
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(f"{tmp}/logs")
+        with open(f"{tmp}/nginx", "w") as f:
+            f.write(FAKE_NGINX)
+        os.chmod(f"{tmp}/nginx", 0o755)
+        with open(f"{tmp}/master.py", "w") as f:
+            f.write(FAKE_NGINX_MASTER)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), BaseHTTPRequestHandler)
+        port = server.server_address[1]
+        server.server_close()
+        with open(f"{tmp}/port", "w") as f:
+            f.write(str(port))
+        nu = NginxUtils(f"{tmp}/nginx", tmp, f"http://127.0.0.1:{port}/status")
+        try:
+            start = time.monotonic()
+            success, action = nu.recover()
+            logger.info(f"recovered by {action} in {time.monotonic() - start:.3f}s")
+            assert success and action == "start"
+            assert time.monotonic() - start < 3
+            pid = nu.master_pid()
+            assert nu.status()[0]
+            # restart waits for the old master to exit instead of sleeping
+            start = time.monotonic()
+            assert nu.restart()
+            assert time.monotonic() - start < 3
+            assert nu.master_pid() not in (None, pid)
+            # killed master, the stale pid file is ignored
+            os.kill(nu.master_pid(), 9)
+            assert nu.wait_stopped(timeout=5)
+            success, action = nu.recover()
+            assert success and action == "start"
+        finally:
+            pid = nu.master_pid()
+            if pid is not None:
+                os.kill(pid, 9)
+
+
+# fake nginx master handling the binary upgrade signals, with a worker process
+# which keeps answering on the shared socket for a while after WINCH
+FAKE_NGINX_UPGRADE_MASTER = """
+import os, sys, signal, socket, subprocess, threading, time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+prefix = sys.argv[1]
+pid_path = f"{prefix}/logs/nginx.pid"
+port = int(open(f"{prefix}/port").read())
+upgraded = os.path.exists(pid_path + ".oldbin")  # started by USR2
+worker = None
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = b"Active connections: 1 \\nserver accepts handled requests\\n 1 1 1 \\nReading: 0 Writing: 1 Waiting: 0 \\n"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(HTTPServer):
+    def server_bind(self):
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+
+def serve():
+    server = Server(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    stopping = threading.Event()
+    signal.signal(signal.SIGQUIT, lambda *args: stopping.set())
+    master = os.getppid()
+    while not stopping.wait(0.05):
+        if os.getppid() != master:
+            os._exit(0)
+    time.sleep(0.3)
+    os._exit(0)
+
+
+def start_workers(*args):
+    global worker
+    if worker is None:
+        worker = subprocess.Popen(
+            ["bash", "-c", f"exec -a 'nginx: worker process' python3 {__file__} {prefix} worker"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+
+def stop_workers(*args):
+    global worker
+    if worker is not None:
+        worker.send_signal(signal.SIGQUIT)
+        worker = None
+
+
+def upgrade(*args):
+    os.rename(pid_path, pid_path + ".oldbin")
+    subprocess.Popen(
+        ["bash", "-c", f"exec -a 'nginx: master process' python3 {__file__} {prefix}"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def quit(*args):
+    stop_workers()
+    try:
+        old_pid = int(open(pid_path + ".oldbin").read())
+    except OSError:
+        old_pid = None
+    if old_pid == os.getpid():
+        os.remove(pid_path + ".oldbin")
+    elif old_pid is not None:
+        os.rename(pid_path + ".oldbin", pid_path)
+    else:
+        os.remove(pid_path)
+    os._exit(0)
+
+
+def reap(*args):
+    try:
+        while os.waitpid(-1, os.WNOHANG)[0]:
+            pass
+    except ChildProcessError:
+        pass
+
+
+if sys.argv[2:] == ["worker"]:
+    serve()
+signal.signal(signal.SIGCHLD, reap)
+signal.signal(signal.SIGUSR2, upgrade)
+signal.signal(signal.SIGWINCH, stop_workers)
+signal.signal(signal.SIGHUP, start_workers)
+signal.signal(signal.SIGQUIT, quit)
+signal.signal(signal.SIGTERM, quit)
+if not (upgraded and os.path.exists(f"{prefix}/broken")):
+    start_workers()
+with open(pid_path, "w") as f:
+    f.write(str(os.getpid()))
+while True:
+    time.sleep(0.1)
+"""
+
+
+def test_nginx_upgrade():
+    logger.info("======= Testing NginxUtils upgrade =======")
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(f"{tmp}/logs")
+        with open(f"{tmp}/nginx", "w") as f:
+            f.write(FAKE_NGINX)
+        os.chmod(f"{tmp}/nginx", 0o755)
+        with open(f"{tmp}/master.py", "w") as f:
+            f.write(FAKE_NGINX_UPGRADE_MASTER)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), BaseHTTPRequestHandler)
+        port = server.server_address[1]
+        server.server_close()
+        with open(f"{tmp}/port", "w") as f:
+            f.write(str(port))
+        nu = NginxUtils(f"{tmp}/nginx", tmp, f"http://127.0.0.1:{port}/status")
+        pids = []
+        try:
+            assert not nu.upgrade()  # not running
+            assert nu.start() and nu.wait_ready(5)
+            old_pid = nu.master_pid()
+            pids.append(old_pid)
+            assert nu.upgrade(timeout=5)
+            new_pid = nu.master_pid()
+            pids.append(new_pid)
+            assert new_pid not in (None, old_pid)
+            assert nu.wait_stopped(old_pid, 5)
+            assert not os.path.exists(f"{tmp}/logs/nginx.pid.oldbin")
+            assert nu.status()[0]
+            # the new master does not serve, the old one takes over again
+            open(f"{tmp}/broken", "w").close()
+            assert not nu.upgrade(timeout=1)
+            assert nu.master_pid() == new_pid
+            assert nu.wait_stopped(timeout=0) is False
+            for _ in range(50):
+                if not os.path.exists(f"{tmp}/logs/nginx.pid.oldbin"):
+                    break
+                time.sleep(0.1)
+            assert nu._read_pid() == new_pid
+            assert nu.wait_ready(5)
+        finally:
+            for pid in pids + [nu._read_pid()]:
+                try:
+                    os.kill(pid, 9)
+                except (OSError, TypeError):
+                    pass
+
+
 def test():
     logger.info("Tests starting...")
     logger.info("Testing NginxUtils...")
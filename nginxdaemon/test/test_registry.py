@@ -0,0 +1,128 @@
+#!/bin/python3
+import logging
+import json
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+import os, sys
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from nacos import NacosClient
+from registry import NacosRegistry, local_ip
+
+
+logger = logging.getLogger(__name__)
+
+# (method, path, params) of the naming requests
+NACOS_REQUESTS = []
+# instances: (ip, port) -> params of the register request
+NACOS_INSTANCES = {}
+
+
+class RegistryNacosHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self, body: str):
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, method):
+        url = urlsplit(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        params.pop("accessToken", None)
+        if url.path == "/nacos/v1/auth/login":
+            token = {"accessToken": "token", "tokenTtl": 18000, "globalAdmin": True}
+            self._reply(json.dumps(token))
+            return
+        NACOS_REQUESTS.append((method, url.path, params))
+        key = (params.get("ip"), params.get("port"))
+        if url.path == "/nacos/v1/ns/instance":
+            if method == "POST":
+                NACOS_INSTANCES[key] = params
+            elif method == "DELETE":
+                NACOS_INSTANCES.pop(key, None)
+            elif method == "PUT":
+                NACOS_INSTANCES[key].update(params)
+            self._reply("ok")
+        elif url.path == "/nacos/v1/ns/instance/beat":
+            code = 10200 if key in NACOS_INSTANCES else 20404
+            self._reply(
+                json.dumps(
+                    {"clientBeatInterval": 2000, "code": code, "lightBeatEnabled": True}
+                )
+            )
+        else:
+            self._reply("ok")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_nacos_registry():
+    logger.info("======= Testing NacosRegistry =======")
+    NACOS_REQUESTS.clear()
+    NACOS_INSTANCES.clear()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RegistryNacosHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        nacos = NacosClient("127.0.0.1", server.server_address[1], "nacos", "nacos")
+        ip = local_ip("127.0.0.1", server.server_address[1])
+        assert ip == "127.0.0.1"
+        registry = NacosRegistry(nacos, "proxy", ip, 80, group_name="ulab")
+        # registered on the first beat, with the full beat
+        success, data = registry.beat(True)
+        assert success
+        assert registry.registered
+        assert NACOS_INSTANCES[(ip, "80")]["groupName"] == "ulab"
+        method, path, params = NACOS_REQUESTS[-1]
+        assert path == "/nacos/v1/ns/instance/beat"
+        assert json.loads(params["beat"])["serviceName"] == "ulab@@proxy"
+        assert registry.beat_interval == 2
+        assert registry.light_beat
+        # light beat, health unchanged
+        NACOS_REQUESTS.clear()
+        assert registry.beat(True)[0]
+        assert len(NACOS_REQUESTS) == 1
+        assert "beat" not in NACOS_REQUESTS[0][2]
+        # unhealthy nginx disables the ephemeral instance
+        assert registry.beat(False)[0]
+        assert NACOS_INSTANCES[(ip, "80")]["enabled"] == "false"
+        assert registry.beat(True)[0]
+        assert NACOS_INSTANCES[(ip, "80")]["enabled"] == "true"
+        # expired instance is registered again
+        NACOS_INSTANCES.clear()
+        assert registry.beat(True)[0]
+        assert (ip, "80") in NACOS_INSTANCES
+        assert not registry.light_beat
+        assert registry.deregister()[0]
+        assert NACOS_INSTANCES == {}
+        assert not registry.registered
+        nacos.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test():
+    logger.info("Tests starting...")
+    test_nacos_registry()
+    logger.info("Tests finished.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="[%(asctime)s - %(levelname)s]: %(message)s"
+    )
+    test()
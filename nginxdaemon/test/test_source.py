@@ -0,0 +1,130 @@
+#!/bin/python3
+import logging
+import hashlib
+import time
+import tempfile
+from pathlib import Path
+from threading import Timer
+import os, sys
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+import config
+from nacos import NacosClient
+from sync import ConfigSync
+from source import FileConfigSource, NacosConfigSource
+from fakenacos import FakeNacosServer
+
+
+logger = logging.getLogger(__name__)
+
+
+def test_file_config_source():
+    logger.info("======= Testing FileConfigSource")
+    with tempfile.TemporaryDirectory() as tmp:
+        source = FileConfigSource(tmp, poll_interval=0.05)
+        success, result = source.config_get("a.conf", "G")
+        assert not success
+        assert source.config_publish("a.conf", "G", "a") == (True, True)
+        assert (Path(tmp) / "public" / "G" / "a.conf").read_text() == "a"
+        assert source.config_publish("series", "G", "a.conf\n\nb.conf\n", tenant="t")[0]
+        assert source.config_series("series", "G", "t") == (True, ["a.conf", "b.conf"])
+        # names escaping the dir are rejected
+        assert not source.config_publish("../a.conf", "G", "a")[0]
+        assert not source.config_get("a.conf", "..")[0]
+        md5 = hashlib.md5(b"a").hexdigest()
+        success, changed = source.config_listen_batch(
+            [("a.conf", "G", md5, None), ("b.conf", "G", "", None)], no_hangup=True
+        )
+        assert success and changed == []
+        Timer(0.2, source.config_publish, ("a.conf", "G", "b")).start()
+        start = time.monotonic()
+        success, changed = source.config_listen_batch(
+            [("a.conf", "G", md5, None)], pulling_timeout=5000
+        )
+        assert success and changed == [("a.conf", "G", None)]
+        assert time.monotonic() - start < 4
+        assert not source.config_snapshot_get("a.conf", "G")[0]
+        result = changed
+    logger.info(f"======= Test result: {result}")
+
+
+def _config_sync_round_trip(source, names: list):
+    """upload the configs to the source from a conf dir and download them into another"""
+    config_base_path = config.CONFIG_BASE_PATH
+    manifest_file = config.NGINX_DAEMON_MANIFEST_FILE
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for side in ("upload", "download"):
+                (Path(tmp) / side).mkdir()
+            config.CONFIG_BASE_PATH = Path(tmp) / "upload"
+            config.NGINX_DAEMON_MANIFEST_FILE = Path(tmp) / "upload" / "manifest.json"
+            for name in names:
+                (config.CONFIG_BASE_PATH / name).write_text(f"conf {name}")
+            sync = ConfigSync(source, concurrency=8)
+            start = time.perf_counter()
+            success, result = sync.upload(names, "G")
+            upload_seconds = time.perf_counter() - start
+            assert success and len(result["changed"]) == len(names)
+            config.CONFIG_BASE_PATH = Path(tmp) / "download"
+            config.NGINX_DAEMON_MANIFEST_FILE = Path(tmp) / "download" / "manifest.json"
+            start = time.perf_counter()
+            success, result = sync.download(names, "G")
+            download_seconds = time.perf_counter() - start
+            assert success and len(result["changed"]) == len(names)
+            assert (
+                config.CONFIG_BASE_PATH / names[-1]
+            ).read_text() == f"conf {names[-1]}"
+            # nothing is fetched again
+            success, result = sync.download(names, "G")
+            assert success and result["changed"] == []
+            if isinstance(source, FileConfigSource):
+                # the file source has no snapshot, the local configs are kept
+                assert sync.source is source
+                success, result = sync.restore(names[:2], "G")
+                assert success and result == {"changed": [], "failed": names[:2]}
+            return upload_seconds, download_seconds
+    finally:
+        config.CONFIG_BASE_PATH = config_base_path
+        config.NGINX_DAEMON_MANIFEST_FILE = manifest_file
+
+
+def test_config_sync_file_source():
+    logger.info("======= Testing ConfigSync with FileConfigSource")
+    names = [f"{i}.conf" for i in range(200)]
+    with tempfile.TemporaryDirectory() as tmp:
+        result = _config_sync_round_trip(FileConfigSource(tmp), names)
+        assert len(os.listdir(Path(tmp) / "public" / "G")) == len(names)
+    logger.info(f"======= Test result: {result}")
+
+
+def test_config_sync_fake_nacos():
+    logger.info("======= Testing ConfigSync with FakeNacosServer")
+    names = [f"{i}.conf" for i in range(500)]
+    with FakeNacosServer(username="nacos", password="nacos", latency=0.001) as server:
+        nacos = NacosClient(
+            "127.0.0.1", server.port, "nacos", "nacos", pool_size=8, timeout=10
+        )
+        try:
+            result = _config_sync_round_trip(NacosConfigSource(nacos), names)
+            assert server.requests[("POST", "cs/configs")] == len(names)
+            assert server.requests[("GET", "cs/configs")] == len(names)
+            assert server.requests[("POST", "auth/login")] == 1
+        finally:
+            nacos.close()
+    logger.info(f"======= Test result: {result}")
+
+
+def test():
+    logger.info("Tests starting...")
+    logger.info("Testing ConfigSource...")
+    test_file_config_source()
+    test_config_sync_file_source()
+    test_config_sync_fake_nacos()
+    logger.info("Tests finished.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="[%(asctime)s - %(levelname)s]: %(message)s"
+    )
+    test()
@@ -0,0 +1,253 @@
+#!/bin/python3
+import logging
+import hashlib
+import json
+import time
+import shutil
+import tempfile
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from urllib.parse import urlsplit, parse_qs
+import os, sys
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+import config
+from nacos import NacosClient
+from sync import ConfigSync
+
+
+BASE_PATH = Path(__file__).resolve().parent.parent
+PROJ_PATH = Path(__file__).resolve().parent.parent.parent
+
+logger = logging.getLogger(__name__)
+
+NACOS_CONFIGS = {}
+NACOS_REQUESTS = []
+NACOS_LATENCY = {"GET": 0}
+
+
+class SyncNacosHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self, body: str, code: int = 200):
+        data = body.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _params(self):
+        query = urlsplit(self.path).query
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            query += "&" + self.rfile.read(length).decode("utf-8")
+        return {k: v[0] for k, v in parse_qs(query).items()}
+
+    def do_GET(self):
+        params = self._params()
+        time.sleep(NACOS_LATENCY["GET"])
+        NACOS_REQUESTS.append(("GET", params.get("dataId")))
+        if params.get("dataId") in NACOS_CONFIGS:
+            self._reply(NACOS_CONFIGS[params["dataId"]])
+        else:
+            self._reply("config data not exist", 404)
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        params = self._params()
+        if path.endswith("/auth/login"):
+            token = {"accessToken": "token", "tokenTtl": 18000, "globalAdmin": True}
+            self._reply(json.dumps(token))
+        elif path.endswith("/cs/configs/listener"):
+            changed = ""
+            for item in params["Listening-Configs"].split(chr(1)):
+                if item == "":
+                    continue
+                data_id, group, md5 = item.split(chr(2))[:3]
+                content = NACOS_CONFIGS.get(data_id)
+                server_md5 = (
+                    "" if content is None else hashlib.md5(content.encode()).hexdigest()
+                )
+                if server_md5 != md5:
+                    changed += f"{data_id}%02{group}%01"
+            self._reply(changed)
+        else:
+            NACOS_REQUESTS.append(("POST", params.get("dataId")))
+            NACOS_CONFIGS[params["dataId"]] = params["content"]
+            self._reply("true")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_config_sync():
+    logger.info("======= Testing ConfigSync")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SyncNacosHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    config_base_path = config.CONFIG_BASE_PATH
+    manifest_file = config.NGINX_DAEMON_MANIFEST_FILE
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            config.CONFIG_BASE_PATH = Path(tmp)
+            config.NGINX_DAEMON_MANIFEST_FILE = Path(tmp) / "tmp" / "manifest.json"
+            NACOS_CONFIGS.clear()
+            NACOS_CONFIGS.update({f"{i}.conf": f"conf {i}" for i in range(10)})
+            names = list(NACOS_CONFIGS)
+            nacos = NacosClient("127.0.0.1", server.server_address[1], "nacos", "nacos")
+            sync = ConfigSync(nacos)
+            # first sync downloads everything
+            success, result = sync.download(names, "DEFAULT_GROUP")
+            assert success and result["changed"] == names
+            assert (Path(tmp) / "3.conf").read_text() == "conf 3"
+            # nothing changed, nothing fetched and nothing written
+            NACOS_REQUESTS.clear()
+            success, result = sync.download(names, "DEFAULT_GROUP")
+            assert success and result["changed"] == []
+            assert NACOS_REQUESTS == []
+            # only the changed config is fetched
+            NACOS_CONFIGS["3.conf"] = "conf 3 changed"
+            success, result = sync.download(names, "DEFAULT_GROUP")
+            assert success and result["changed"] == ["3.conf"]
+            assert NACOS_REQUESTS == [("GET", "3.conf")]
+            # a change already fetched by the listener is not fetched again
+            NACOS_REQUESTS.clear()
+            NACOS_CONFIGS["4.conf"] = "conf 4 changed"
+            success, changed = sync.listener.check()
+            assert success and changed == [("4.conf", "DEFAULT_GROUP", None)]
+            success, result = sync.download(names, "DEFAULT_GROUP")
+            assert success and result["changed"] == ["4.conf"]
+            assert NACOS_REQUESTS == [("GET", "4.conf")]
+            # a config rolled back on reload failure is kept until it changes
+            config.nginx_config_commit_custom()
+            NACOS_CONFIGS["6.conf"] = "conf 6 rejected"
+            success, result = sync.download(names, "DEFAULT_GROUP")
+            assert success and result["changed"] == ["6.conf"]
+            assert config.nginx_config_rollback_custom()[0]
+            assert (Path(tmp) / "6.conf").read_text() == "conf 6"
+            success, result = sync.download(names, "DEFAULT_GROUP")
+            assert success and result["changed"] == []
+            NACOS_CONFIGS["6.conf"] = "conf 6 fixed"
+            success, result = sync.download(names, "DEFAULT_GROUP")
+            assert success and result["changed"] == ["6.conf"]
+            # only the locally edited config is uploaded
+            NACOS_REQUESTS.clear()
+            (Path(tmp) / "5.conf").write_text("conf 5 local")
+            success, result = sync.upload(names, "DEFAULT_GROUP")
+            assert success and result["changed"] == ["5.conf"]
+            assert ("POST", "5.conf") in NACOS_REQUESTS
+            assert len([r for r in NACOS_REQUESTS if r[0] == "POST"]) == 1
+            assert NACOS_CONFIGS["5.conf"] == "conf 5 local"
+            # the manifest is per server
+            manifest = json.loads(config.NGINX_DAEMON_MANIFEST_FILE.read_text())
+            assert list(manifest) == [nacos.base_url]
+            # a server which lost its configs gets all of them again
+            NACOS_CONFIGS.clear()
+            success, result = sync.upload(names, "DEFAULT_GROUP")
+            assert success and result["changed"] == names
+            assert NACOS_CONFIGS["5.conf"] == "conf 5 local"
+            nacos.close()
+    finally:
+        config.CONFIG_BASE_PATH = config_base_path
+        config.NGINX_DAEMON_MANIFEST_FILE = manifest_file
+        server.shutdown()
+        server.server_close()
+    logger.info(f"======= Test result: {True}")
+
+
+def test_config_sync_concurrency():
+    logger.info("======= Testing ConfigSync concurrency")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SyncNacosHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    config_base_path = config.CONFIG_BASE_PATH
+    manifest_file = config.NGINX_DAEMON_MANIFEST_FILE
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            config.CONFIG_BASE_PATH = Path(tmp)
+            config.NGINX_DAEMON_MANIFEST_FILE = Path(tmp) / "tmp" / "manifest.json"
+            NACOS_CONFIGS.clear()
+            NACOS_CONFIGS.update({f"{i}.conf": f"conf {i}" for i in range(20)})
+            NACOS_LATENCY["GET"] = 0.2
+            nacos = NacosClient(
+                "127.0.0.1", server.server_address[1], "nacos", "nacos", pool_size=10
+            )
+            sync = ConfigSync(nacos, concurrency=10)
+            start = time.time()
+            success, result = sync.download(list(NACOS_CONFIGS), "DEFAULT_GROUP")
+            elapsed = time.time() - start
+            assert success and len(result["changed"]) == 20
+            assert elapsed < 20 * 0.2 / 2
+            nacos.close()
+    finally:
+        NACOS_LATENCY["GET"] = 0
+        config.CONFIG_BASE_PATH = config_base_path
+        config.NGINX_DAEMON_MANIFEST_FILE = manifest_file
+        server.shutdown()
+        server.server_close()
+    logger.info(f"======= Test result: {elapsed}")
+
+
+def test_config_sync_restore():
+    logger.info("======= Testing ConfigSync restore")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SyncNacosHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    config_base_path = config.CONFIG_BASE_PATH
+    manifest_file = config.NGINX_DAEMON_MANIFEST_FILE
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            config.CONFIG_BASE_PATH = Path(tmp) / "conf"
+            config.NGINX_DAEMON_MANIFEST_FILE = Path(tmp) / "tmp" / "manifest.json"
+            snapshot_path = str(Path(tmp) / "tmp" / "snapshot")
+            os.makedirs(config.CONFIG_BASE_PATH)
+            NACOS_CONFIGS.clear()
+            NACOS_CONFIGS.update({f"{i}.conf": f"conf {i}" for i in range(3)})
+            names = list(NACOS_CONFIGS)
+            nacos = NacosClient(
+                "127.0.0.1",
+                server.server_address[1],
+                "nacos",
+                "nacos",
+                snapshot_path=snapshot_path,
+            )
+            success, result = ConfigSync(nacos).download(names, "DEFAULT_GROUP")
+            assert success and result["changed"] == names
+            nacos.close()
+            # the conf dir is lost and nacos is unreachable
+            shutil.rmtree(config.CONFIG_BASE_PATH)
+            os.makedirs(config.CONFIG_BASE_PATH)
+            (config.CONFIG_BASE_PATH / "1.conf").write_text("conf 1")
+            nacos = NacosClient("127.0.0.1", 1, snapshot_path=snapshot_path)
+            sync = ConfigSync(nacos)
+            success, result = sync.restore(names + ["3.conf"], "DEFAULT_GROUP")
+            assert success
+            assert result == {"changed": ["0.conf", "2.conf"], "failed": ["3.conf"]}
+            assert (config.CONFIG_BASE_PATH / "2.conf").read_text() == "conf 2"
+            # rejected snapshots are not applied
+            (config.CONFIG_BASE_PATH / "2.conf").write_text("conf 2 local")
+            sync.validate = lambda path: False
+            success, result = sync.restore(names, "DEFAULT_GROUP")
+            assert not success and result["failed"] == ["2.conf"]
+            assert (config.CONFIG_BASE_PATH / "2.conf").read_text() == "conf 2 local"
+            nacos.close()
+    finally:
+        config.CONFIG_BASE_PATH = config_base_path
+        config.NGINX_DAEMON_MANIFEST_FILE = manifest_file
+        server.shutdown()
+        server.server_close()
+    logger.info(f"======= Test result: {result}")
+
+
+def test():
+    logger.info("Tests starting...")
+    logger.info("Testing ConfigSync...")
+    test_config_sync()
+    test_config_sync_concurrency()
+    test_config_sync_restore()
+    logger.info("Tests finished.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="[%(asctime)s - %(levelname)s]: %(message)s"
+    )
+    test()
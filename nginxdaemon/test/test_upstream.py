@@ -0,0 +1,180 @@
+#!/bin/python3
+import logging
+import json
+import tempfile
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+import os, sys
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from nacos import NacosClient
+from upstream import UpstreamGenerator, render_server, upstream_name
+import config
+
+
+logger = logging.getLogger(__name__)
+
+# service name -> hosts, None to fail the list request
+NACOS_SERVICES = {}
+
+
+class UpstreamNacosHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self, body: str, status: int = 200):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        token = {"accessToken": "token", "tokenTtl": 18000, "globalAdmin": True}
+        self._reply(json.dumps(token))
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        hosts = NACOS_SERVICES.get(params.get("serviceName"))
+        if hosts is None:
+            self._reply("service not found", 500)
+            return
+        self._reply(json.dumps({"hosts": hosts}))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def host(ip, port=22, weight=1.0, healthy=True, metadata=None):
+    return {
+        "ip": ip,
+        "port": port,
+        "weight": weight,
+        "healthy": healthy,
+        "enabled": True,
+        "metadata": metadata or {},
+    }
+
+
+def test_render_server():
+    logger.info("======= Testing render_server =======")
+    assert upstream_name("ulab-ssh") == "nacos_ulab_ssh"
+    assert render_server(host("10.0.0.1", weight=2.4)) == "server 10.0.0.1:22 weight=2;"
+    assert render_server(host("10.0.0.1", healthy=False)) == "server 10.0.0.1:22 down;"
+    assert render_server(host("10.0.0.1", weight=0)) == "server 10.0.0.1:22 down;"
+    metadata = {
+        "nginx.weight": "5",
+        "nginx.backup": "true",
+        "nginx.max_fails": "3",
+        "nginx.fail_timeout": "10s",
+        "version": "1",
+    }
+    assert (
+        render_server(host("10.0.0.1", metadata=metadata))
+        == "server 10.0.0.1:22 weight=5 max_fails=3 fail_timeout=10s backup;"
+    )
+    assert render_server(host("::1", port="80")) == "server [::1]:80 weight=1;"
+    assert render_server(host("svc-1.local")) == "server svc-1.local:22 weight=1;"
+    # the values are written into the nginx config, an instance with another one is skipped
+    for ip, port, metadata in (
+        ("10.0.0.1;", 22, {}),
+        ("10.0.0.1 backup", 22, {}),
+        ("fe80::1%eth0", 22, {}),
+        ("10.0.0.1", 0, {}),
+        ("10.0.0.1", 65536, {}),
+        ("10.0.0.1", "22;", {}),
+        ("10.0.0.1", 22, {"nginx.max_conns": "1; evil"}),
+        ("10.0.0.1", 22, {"nginx.fail_timeout": "10s}"}),
+        ("10.0.0.1", 22, {"nginx.backup": "yes"}),
+        ("10.0.0.1", 22, {"nginx.weight": "5\n"}),
+        ("10.0.0.1", 22, {"nginx.max_fails": "\u0663"}),
+    ):
+        assert render_server(host(ip, port=port, metadata=metadata)) is None
+    assert UpstreamGenerator.parse_services(" ssh:stream, web ,bad:udp,") == [
+        ("ssh", "stream"),
+        ("web", "http"),
+    ]
+
+
+def test_upstream_generator_sync():
+    logger.info("======= Testing UpstreamGenerator sync =======")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), UpstreamNacosHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    config_base_path = config.CONFIG_BASE_PATH
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            config.CONFIG_BASE_PATH = Path(tmp) / "conf"
+            os.makedirs(config.CONFIG_BASE_PATH)
+            (config.CONFIG_BASE_PATH / "nginx.conf").write_text("")
+            nacos = NacosClient("127.0.0.1", server.server_address[1], "nacos", "nacos")
+            validated = []
+            generator = UpstreamGenerator(
+                nacos,
+                [("ssh", "stream"), ("web", "http")],
+                validate=lambda path: validated.append(path) or True,
+            )
+            # nothing is written before every service is listed once
+            NACOS_SERVICES.clear()
+            NACOS_SERVICES["ssh"] = [host("10.0.0.2"), host("10.0.0.1")]
+            assert generator.sync() == (False, [])
+            assert not (config.CONFIG_BASE_PATH / "nacos_upstream_stream.conf").exists()
+            NACOS_SERVICES["web"] = []
+            success, changed = generator.sync()
+            assert success
+            assert sorted(changed) == [
+                "nacos_upstream_http.conf",
+                "nacos_upstream_stream.conf",
+            ]
+            assert len(validated) == 1
+            stream = (
+                config.CONFIG_BASE_PATH / "nacos_upstream_stream.conf"
+            ).read_text()
+            logger.info(stream)
+            assert (
+                "upstream nacos_ssh {\n"
+                "    server 10.0.0.1:22 weight=1;\n"
+                "    server 10.0.0.2:22 weight=1;\n"
+                "}\n"
+            ) in stream
+            http = (config.CONFIG_BASE_PATH / "nacos_upstream_http.conf").read_text()
+            assert "upstream nacos_web {\n    server 127.0.0.1:65535 down;" in http
+            # same instances in another order, nothing written
+            NACOS_SERVICES["ssh"].reverse()
+            assert generator.sync() == (True, [])
+            # scale out, and a failed list keeps the previous instances
+            NACOS_SERVICES["ssh"].append(host("10.0.0.3", weight=3))
+            NACOS_SERVICES["web"] = None
+            assert generator.sync() == (True, ["nacos_upstream_stream.conf"])
+            stream = (
+                config.CONFIG_BASE_PATH / "nacos_upstream_stream.conf"
+            ).read_text()
+            assert "server 10.0.0.3:22 weight=3;" in stream
+            # rejected by the validation, nothing is applied
+            generator.validate = lambda path: False
+            NACOS_SERVICES["ssh"] = []
+            assert generator.sync() == (False, [])
+            stream = (
+                config.CONFIG_BASE_PATH / "nacos_upstream_stream.conf"
+            ).read_text()
+            assert "server 10.0.0.3:22 weight=3;" in stream
+            nacos.close()
+    finally:
+        config.CONFIG_BASE_PATH = config_base_path
+        server.shutdown()
+        server.server_close()
+
+
+def test():
+    logger.info("Tests starting...")
+    test_render_server()
+    test_upstream_generator_sync()
+    logger.info("Tests finished.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="[%(asctime)s - %(levelname)s]: %(message)s"
+    )
+    test()
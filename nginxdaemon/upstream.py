@@ -0,0 +1,221 @@
+#!/bin/python3
+import ipaddress
+import logging
+import re
+from nacos import NacosClient
+import config
+
+
+logger = logging.getLogger(__name__)
+
+# rendered files, included by nginx.conf in the http and stream blocks
+UPSTREAM_CONFIG_FILES = {
+    "http": "nacos_upstream_http.conf",
+    "stream": "nacos_upstream_stream.conf",
+}
+
+# instance metadata overriding the server parameters
+UPSTREAM_METADATA_PREFIX = "nginx."
+
+# formats of the metadata values, an instance with another value is skipped
+# as they are written into the nginx config
+UPSTREAM_OPTION_FORMATS = {
+    "weight": re.compile(r"[0-9]+(\.[0-9]+)?"),
+    "down": re.compile(r"(?i)true|false"),
+    "backup": re.compile(r"(?i)true|false"),
+    "max_fails": re.compile(r"[0-9]+"),
+    "fail_timeout": re.compile(r"[0-9]+(ms|s|m|h|d|w|M|y)?"),
+    "max_conns": re.compile(r"[0-9]+"),
+}
+
+HOSTNAME = re.compile(
+    r"(?=.{1,253}$)([A-Za-z0-9]([A-Za-z0-9-]{0,61}[A-Za-z0-9])?\.)*"
+    r"[A-Za-z0-9]([A-Za-z0-9-]{0,61}[A-Za-z0-9])?"
+)
+
+# an upstream needs at least one server, used if a service has no instance
+UPSTREAM_PLACEHOLDER = "server 127.0.0.1:65535 down;  # no instance"
+
+
+def upstream_name(service_name: str, prefix: str = "nacos_"):
+    """nginx upstream name of a service, e.g. ulab-ssh -> nacos_ulab_ssh"""
+    return prefix + re.sub(r"[^A-Za-z0-9_]", "_", service_name)
+
+
+def server_address(host: dict):
+    """ip:port of a nacos instance, [ip]:port for ipv6, None if the ip or port is invalid"""
+    ip, port = str(host.get("ip", "")), host.get("port")
+    try:
+        port = None if isinstance(port, bool) else int(port)
+    except (TypeError, ValueError):
+        port = None
+    if port is None or not 1 <= port <= 65535:
+        return None
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return f"{ip}:{port}" if HOSTNAME.fullmatch(ip) else None
+    if address.version == 6:
+        # no scope id, e.g. fe80::1%eth0
+        return f"[{address}]:{port}" if "%" not in ip else None
+    return f"{address}:{port}"
+
+
+def render_server(host: dict):
+    """nginx server line of a nacos instance, None if it is invalid
+
+    Health and weight come from the instance, and can be overridden by
+    the metadata nginx.weight, nginx.down, nginx.backup, nginx.max_fails,
+    nginx.fail_timeout and nginx.max_conns. The values are written into
+    the nginx config, an instance with an invalid ip, port or value is skipped.
+    """
+    address = server_address(host)
+    if address is None:
+        logger.warning(f"Skip nacos instance with invalid address: {host}")
+        return None
+    metadata = host.get("metadata") or {}
+    options = {
+        key[len(UPSTREAM_METADATA_PREFIX) :]: str(value)
+        for key, value in metadata.items()
+        if key.startswith(UPSTREAM_METADATA_PREFIX)
+    }
+    for key, value in options.items():
+        value_format = UPSTREAM_OPTION_FORMATS.get(key)
+        if value_format is not None and not value_format.fullmatch(value):
+            logger.warning(f"Skip nacos instance {address} with invalid nginx.{key}")
+            return None
+    weight = options.pop("weight", None)
+    try:
+        weight = float(host.get("weight", 1) if weight is None else weight)
+    except (TypeError, ValueError):
+        weight = 1
+    down = (
+        not host.get("healthy", True)
+        or not host.get("enabled", True)
+        or weight <= 0
+        or options.pop("down", "false").lower() == "true"
+    )
+    parts = [f"server {address}"]
+    if not down:
+        parts.append(f"weight={max(int(round(weight)), 1)}")
+    for key in ("max_fails", "fail_timeout", "max_conns"):
+        value = options.get(key)
+        if value is not None:
+            parts.append(f"{key}={value}")
+    if options.get("backup", "false").lower() == "true":
+        parts.append("backup")
+    if down:
+        parts.append("down")
+    return " ".join(parts) + ";"
+
+
+class UpstreamGenerator:
+    def __init__(
+        self,
+        nacos: NacosClient,
+        services: list,
+        group_name: str = None,
+        namespace_id: str = None,
+        validate=None,
+    ):
+        """Render nginx upstream blocks from the instances of nacos services
+
+        The rendered files are written by nginx_config_apply_custom only if
+        their content changed, the instances of a service failing to be listed
+        are kept from the previous round.
+
+        Args:
+            nacos (NacosClient): nacos client
+            services (list): [(service name, http or stream)], see parse_services
+            group_name (str, optional): service group name. Defaults to None.
+            namespace_id (str, optional): namespace id. Defaults to None.
+            validate (callable, optional): validate(staged nginx.conf path) -> bool. Defaults to None.
+        """
+        self.nacos = nacos
+        self.services = services
+        self.group_name = group_name or None
+        self.namespace_id = namespace_id or None
+        self.validate = validate
+        self.instances = {}  # service name -> hosts of the last successful list
+
+    @staticmethod
+    def parse_services(spec: str):
+        """'ssh:stream, web:http, api' -> [("ssh", "stream"), ("web", "http"), ("api", "http")]"""
+        services = []
+        for item in spec.split(","):
+            name, _, kind = item.strip().partition(":")
+            kind = kind.strip() or "http"
+            if not name.strip():
+                continue
+            if kind not in UPSTREAM_CONFIG_FILES:
+                logger.error(f"Unknown upstream type {kind} of service {name}")
+                continue
+            services.append((name.strip(), kind))
+        return services
+
+    def fetch(self):
+        """List the instances of every service.
+
+        Returns:
+            bool: every service has been listed at least once
+        """
+        for service_name, _ in self.services:
+            success, data = self.nacos.instance_list(
+                service_name,
+                group_name=self.group_name,
+                namespace_id=self.namespace_id,
+            )
+            if success and isinstance(data, dict):
+                self.instances[service_name] = data.get("hosts") or []
+            else:
+                logger.error(f"List instances of service {service_name} error: {data}")
+        return all(name in self.instances for name, _ in self.services)
+
+    def render(self):
+        """Render the upstream files.
+
+        Returns:
+            dict: filename -> content
+        """
+        blocks = {kind: [] for kind in UPSTREAM_CONFIG_FILES}
+        for service_name, kind in self.services:
+            servers = []
+            for host in self.instances.get(service_name, []):
+                server = render_server(host)
+                if server is not None:
+                    servers.append((str(host["ip"]), int(host["port"]), server))
+            servers = [server for _, _, server in sorted(servers)] or [
+                UPSTREAM_PLACEHOLDER
+            ]
+            blocks[kind].append(
+                f"upstream {upstream_name(service_name)} {{\n"
+                + "".join(f"    {server}\n" for server in servers)
+                + "}\n"
+            )
+        return {
+            filename: "# generated by nginxdaemon from nacos, do not edit\n"
+            + "".join(blocks[kind])
+            for kind, filename in UPSTREAM_CONFIG_FILES.items()
+        }
+
+    def sync(self):
+        """Fetch, render and write the upstream files if changed.
+
+        Returns:
+            success, changed: success or not and the files changed
+        """
+        if not self.fetch():
+            return False, []
+        changed = {}
+        for filename, content in self.render().items():
+            success, current = config.nginx_config_get_custom(filename)
+            if not success or current != content:
+                changed[filename] = content
+        if not changed:
+            return True, []
+        success, msg = config.nginx_config_apply_custom(changed, self.validate)
+        if not success:
+            logger.error(f"Write upstream config error: {msg}")
+            return False, []
+        logger.info(f"Upstream config changed: {list(changed)}")
+        return True, list(changed)